@@ -1,13 +1,23 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Any
+import asyncio
+import json
 import logging
 import os
+import time
 
 from core.device_manager import DeviceManager, DEVICE_TYPE_MAPPING
+from core.command_tracker import COMMAND_CONFIRMED, COMMAND_PENDING, COMMAND_UNTRACKED, COMMAND_SUPERSEDED
 from core.rule_engine import RulesEngine
+from core.rule_compiler import RuleValidationError
 from core.mqtt_client import MQTT_Client  
+from core.message_pipeline import MessagePipeline
+from core.event_stream import EventBroadcaster, format_sse
+from core.history import HistoryManager, ROLLUP_RESOLUTIONS, RESOLUTION_RAW
+from logging_config import get_log_buffer, matches_log_filters, tail_file
 import config
 
 logger = logging.getLogger(__name__)
@@ -15,6 +25,12 @@ logger = logging.getLogger(__name__)
 device_manager_instance: DeviceManager = None
 rules_engine_instance: RulesEngine = None
 mqtt_client_instance: MQTT_Client = None
+message_pipeline_instance: MessagePipeline = None
+history_manager_instance: HistoryManager = None
+event_broadcaster = EventBroadcaster()
+log_broadcaster = EventBroadcaster()
+# Znacznik uruchomienia procesu - po restarcie wersje liczone są od zera, więc stare ETagi muszą przestać pasować.
+_etag_epoch = format(time.time_ns(), "x")
 
 app = FastAPI(title="Smart Home API", version="1.0.0")
 
@@ -26,14 +42,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def setup_api(dm: DeviceManager, re: RulesEngine, mc: MQTT_Client):
+def setup_api(dm: DeviceManager, re: RulesEngine, mc: MQTT_Client, mp: Optional[MessagePipeline] = None,
+              hm: Optional[HistoryManager] = None):
     """
     Konfiguracja instancji menedżerów dla modułu API. 
     """
-    global device_manager_instance, rules_engine_instance, mqtt_client_instance
+    global device_manager_instance, rules_engine_instance, mqtt_client_instance, message_pipeline_instance, history_manager_instance
     device_manager_instance = dm
     rules_engine_instance = re
     mqtt_client_instance = mc
+    message_pipeline_instance = mp
+    history_manager_instance = hm
+    dm.add_listener(event_broadcaster.publish)
+    log_buffer = get_log_buffer()
+    if(log_buffer):
+        log_buffer.add_listener(log_broadcaster.publish)
     logger.info("API zostało skonfigurowane z instancjami menedżerów.")
 
 class ActionRequest(BaseModel):
@@ -77,14 +100,65 @@ class RenameRequest(BaseModel):
     """
     new_name: str
 
+def _cached_json_response(request: Request, name: str, version: int, body: bytes) -> Response:
+    """
+    Zwraca gotową treść JSON z nagłówkiem ETag lub 304, jeśli klient ma już tę wersję.
+    """
+    etag = f'W/"{name}-{_etag_epoch}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if(if_none_match and (if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(",")))):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/devices", summary="Pobiera listę urządzeń")
-def list_devices():
+def list_devices(request: Request):
     """
     Zwraca listę wszystkich urządzeń wraz z ich aktualnym stanem.
     """
     if(not device_manager_instance):
          raise HTTPException(status_code=503, detail="System niegotowy.")
-    return {"devices": device_manager_instance.get_devices_data()}
+    version, body = device_manager_instance.get_devices_json()
+    return _cached_json_response(request, "devices", version, body)
+
+@app.get("/events", summary="Strumień zmian stanu urządzeń (SSE)")
+async def stream_events(request: Request):
+    """
+    Wysyła migawkę wszystkich urządzeń (zdarzenie 'snapshot' z numerem sekwencyjnym),
+    a następnie tylko zmiany: 'state', 'device_added', 'device_updated', 'device_removed'.
+    """
+    if(not device_manager_instance):
+         raise HTTPException(status_code=503, detail="System niegotowy.")
+    subscription = event_broadcaster.subscribe(asyncio.get_running_loop())
+
+    def snapshot() -> tuple[int, str]:
+        seq, devices = device_manager_instance.get_snapshot()
+        return seq, format_sse("snapshot", json.dumps({"seq": seq, "devices": devices}), seq)
+
+    async def event_generator():
+        try:
+            seq, message = snapshot()
+            yield message
+            while(True):
+                try:
+                    event_seq, message = await asyncio.wait_for(subscription.queue.get(), timeout=config.EVENT_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if(await request.is_disconnected()):
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if(subscription.overflowed):
+                    subscription.drain()
+                    seq, message = snapshot()
+                    yield message
+                    continue
+                if(event_seq > seq):
+                    yield message
+        finally:
+            event_broadcaster.unsubscribe(subscription)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=headers)
 
 @app.post("/devices", summary="Dodaje nowe urządzenie")
 def add_device(device: DeviceRegistrationModel):
@@ -122,16 +196,22 @@ def delete_device(device_id: str):
     raise HTTPException(status_code=404, detail="Urządzenie nie znalezione.")
 
 @app.post("/devices/action", summary="Wykonuje akcję (urządzenie lub grupa)")
-def perform_action(request: ActionRequest):
+async def perform_action(request: ActionRequest, wait: bool = False):
     """
     Wysyła komendę sterującą do wskazanego urządzenia.
+    Z 'wait=true' odpowiedź wraca dopiero, gdy urządzenie potwierdzi komendę raportem stanu
+    (504, jeśli nie potwierdzi mimo ponowień), najpóźniej po COMMAND_WAIT_TIMEOUT_SECONDS -
+    wtedy 202 ze statusem 'pending', a ponowienia trwają dalej w tle. Oczekiwanie nie zajmuje wątku puli.
+    Dla grup parametr jest ignorowany.
     """
     if(not device_manager_instance):
          raise HTTPException(status_code=503, detail="System niegotowy.")
-    
-    success = device_manager_instance.perform_action(
-        mqtt_client_instance, request.device_id, request.action, request.value
-    )
+
+    device = device_manager_instance.get_device(request.device_id) if(wait) else None
+    if(device):
+        return await _perform_action_and_wait(device, request)
+    success = await asyncio.to_thread(device_manager_instance.perform_action,
+                                      mqtt_client_instance, request.device_id, request.action, request.value)
     if(not success):
         logger.warning(f"API: Nieudana próba akcji '{request.action}' na celu {request.device_id}")
         raise HTTPException(status_code=404, detail=f"Cel {request.device_id} nie znaleziony.")
@@ -139,11 +219,27 @@ def perform_action(request: ActionRequest):
     logger.info(f"API: Wysłano akcję '{request.action}' do celu: {request.device_id}")
     return {"status": "success"}
 
+async def _perform_action_and_wait(device, request: ActionRequest):
+    command = await asyncio.to_thread(device_manager_instance.send_command, mqtt_client_instance, device, request.action, request.value)
+    if(command is None):
+        raise HTTPException(status_code=400, detail=f"Akcja '{request.action}' nie jest obsługiwana przez {request.device_id}.")
+    status = await command.wait_async(min(config.COMMAND_WAIT_TIMEOUT_SECONDS, device_manager_instance.commands.max_wait()))
+    if(status in (COMMAND_CONFIRMED, COMMAND_UNTRACKED)):
+        logger.info(f"API: Akcja '{request.action}' na {request.device_id} zakończona: {status}")
+        return {"status": "success", "command": command.to_dict()}
+    if(status == COMMAND_PENDING):
+        return JSONResponse(status_code=202, content={"status": "pending", "command": command.to_dict()})
+    if(status == COMMAND_SUPERSEDED):
+        raise HTTPException(status_code=409, detail="Komenda została zastąpiona nowszą komendą dla tego urządzenia.")
+    logger.warning(f"API: Urządzenie {request.device_id} nie potwierdziło akcji '{request.action}' ({command.attempts} prób).")
+    raise HTTPException(status_code=504, detail=f"Urządzenie {request.device_id} nie potwierdziło komendy.")
+
 @app.get("/groups", summary="Pobiera listę grup")
-def list_groups():
+def list_groups(request: Request):
     if(not device_manager_instance):
          raise HTTPException(status_code=503, detail="System niegotowy.")
-    return {"groups": device_manager_instance.get_groups()}
+    version, body = device_manager_instance.get_groups_json()
+    return _cached_json_response(request, "groups", version, body)
 
 @app.post("/groups", summary="Tworzy nową grupę")
 def create_group(group: GroupModel):
@@ -201,6 +297,47 @@ def set_pairing(state: str):
     logger.info(f"API: Zmieniono tryb parowania Zigbee na: {is_enabled}")
     return {"status": "success", "message": f"Parowanie ustawione na: {is_enabled}"}
 
+@app.get("/system/metrics", summary="Pobiera metryki przetwarzania")
+def get_metrics():
+    """
+    Zwraca metryki potoku wiadomości MQTT (głębokość kolejek, odrzucone i scalone wiadomości)
+    oraz wykonywania akcji reguł (scalone komendy, opóźnienie od wyzwolenia do publikacji)
+    i potwierdzeń komend (ponowienia, opóźnienie od wysłania do potwierdzenia per urządzenie).
+    """
+    metrics = {}
+    if(message_pipeline_instance):
+        metrics["mqtt_pipeline"] = message_pipeline_instance.get_metrics()
+    if(device_manager_instance):
+        metrics["commands"] = device_manager_instance.commands.get_metrics()
+    if(rules_engine_instance):
+        metrics["rule_actions"] = rules_engine_instance.actions.get_metrics()
+    return metrics
+
+@app.get("/history/{device_id}", summary="Pobiera listę wartości z historią dla urządzenia")
+def list_history_keys(device_id: str):
+    if(not history_manager_instance):
+         raise HTTPException(status_code=503, detail="Historia odczytów jest wyłączona.")
+    return {"device_id": device_id, "keys": history_manager_instance.get_keys(device_id)}
+
+@app.get("/history/{device_id}/{key}", summary="Pobiera historię wartości w zakresie czasu")
+def get_history(device_id: str, key: str, start: Optional[float] = None, end: Optional[float] = None, resolution: Optional[str] = None):
+    """
+    Zwraca punkty historii dla zakresu [start, end] (sekundy unixowe, domyślnie ostatnie 24 h).
+    Bez parametru 'resolution' rozdzielczość jest dobierana automatycznie do długości zakresu.
+    """
+    if(not history_manager_instance):
+         raise HTTPException(status_code=503, detail="Historia odczytów jest wyłączona.")
+    if(resolution is not None and resolution != RESOLUTION_RAW and resolution not in ROLLUP_RESOLUTIONS):
+        raise HTTPException(status_code=400, detail=f"Nieznana rozdzielczość: {resolution}")
+    end = end if end is not None else time.time()
+    start = start if start is not None else end - 86400
+    if(start > end):
+        raise HTTPException(status_code=400, detail="Początek zakresu jest późniejszy niż koniec.")
+    result = history_manager_instance.query(device_id, key, start, end, resolution)
+    if(result is None):
+        raise HTTPException(status_code=404, detail=f"Brak historii '{key}' dla urządzenia {device_id}.")
+    return result
+
 @app.put("/devices/{device_id}/rename", summary="Zmienia nazwę urządzenia")
 def rename_device(device_id: str, request: RenameRequest):
     if(not mqtt_client_instance):
@@ -213,13 +350,14 @@ def rename_device(device_id: str, request: RenameRequest):
     return {"status": "queued", "message": "Wysłano żądanie zmiany nazwy."}
 
 @app.get("/rules", summary="Pobiera reguły")
-def list_rules():
+def list_rules(request: Request):
     """
     Zwraca aktualną listę reguł automatyzacji.
     """
     if(not rules_engine_instance):
          raise HTTPException(status_code=503, detail="System niegotowy.")
-    return {"rules": rules_engine_instance.get_rules()}
+    version, body = rules_engine_instance.get_rules_json()
+    return _cached_json_response(request, "rules", version, body)
 
 @app.post("/rules", summary="Dodaje regułę")
 def add_rule(rule: RuleModel):
@@ -228,7 +366,12 @@ def add_rule(rule: RuleModel):
     """
     if(not rules_engine_instance):
          raise HTTPException(status_code=503, detail="System niegotowy.")
-    if(rules_engine_instance.add_rule(rule.model_dump())):
+    rule_data = rule.model_dump()
+    try:
+        rules_engine_instance.validate_rule(rule_data)
+    except RuleValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Niepoprawna reguła: {e}")
+    if(rules_engine_instance.add_rule(rule_data)):
         logger.info(f"API: Dodano nową regułę: {rule.name} (ID: {rule.id})")
         return {"status": "success", "id": rule.id}
     raise HTTPException(status_code=409, detail="Reguła już istnieje.")
@@ -240,9 +383,13 @@ def update_rule(rule_id: str, rule: RuleModel):
     """
     if(not rules_engine_instance):
          raise HTTPException(status_code=503, detail="System niegotowy.")
-    rules_engine_instance.remove_rule(rule_id)
     rule_data = rule.model_dump()
     rule_data['id'] = rule_id
+    try:
+        rules_engine_instance.validate_rule(rule_data)
+    except RuleValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Niepoprawna reguła: {e}")
+    rules_engine_instance.remove_rule(rule_id)
     if(rules_engine_instance.add_rule(rule_data)):
         logger.info(f"API: Zaktualizowano regułę ID: {rule_id}")
         return {"status": "success", "message": "Reguła zaktualizowana."}
@@ -261,19 +408,77 @@ def delete_rule(rule_id: str):
         return {"status": "success"}
     raise HTTPException(status_code=404, detail="Reguła nie znaleziona.")
 
+def _parse_log_level(level: Optional[str]) -> Optional[int]:
+    if(level is None):
+        return None
+    levelno = logging.getLevelName(level.upper())
+    if(not isinstance(levelno, int)):
+        raise HTTPException(status_code=400, detail=f"Nieznany poziom logowania: {level}")
+    return levelno
+
+def _read_log_file(lines: int, levelno: Optional[int], logger_name: Optional[str]) -> list[str]:
+    """
+    Awaryjny odczyt z pliku (gdy bufor w pamięci nie jest dostępny) - czyta plik od końca.
+    """
+    if(levelno is None and not logger_name):
+        return tail_file(config.LOG_FILE_PATH, lines)
+    result = []
+    for line in reversed(tail_file(config.LOG_FILE_PATH, lines * 10)):
+        parts = line.split("] [", 2)
+        if(len(parts) < 3):
+            continue
+        name = parts[2].split("]", 1)[0]
+        line_level = logging.getLevelName(parts[1].strip())
+        if(isinstance(line_level, int) and matches_log_filters(line_level, name, levelno, logger_name)):
+            result.append(line)
+            if(len(result) >= lines):
+                break
+    result.reverse()
+    return result
+
 @app.get("/logs", summary="Pobiera ostatnie logi systemowe")
-def get_system_logs(lines: int = 50):
+async def get_system_logs(request: Request, lines: int = 50, level: Optional[str] = None, logger_name: Optional[str] = None, follow: bool = False):
     """
-    Zwraca ostatnie N linii z pliku logów.
+    Zwraca ostatnie N linii logu, opcjonalnie od podanego poziomu ('level') i tylko z danego loggera ('logger_name').
+    Przy follow=true odpowiedź jest strumieniem SSE: najpierw ostatnie linie, potem nowe wpisy na bieżąco.
     """
+    levelno = _parse_log_level(level)
+    lines = max(0, lines)
+    log_buffer = get_log_buffer()
+    if(follow):
+        if(not log_buffer):
+            raise HTTPException(status_code=503, detail="Śledzenie logów wymaga bufora logów w pamięci.")
+        subscription = log_broadcaster.subscribe(asyncio.get_running_loop())
+
+        async def log_generator():
+            last_seq = 0
+            try:
+                while(True):
+                    newest_seq = log_buffer.last_seq
+                    limit = lines if(last_seq == 0) else config.LOG_BUFFER_SIZE
+                    for seq, _, _, line in log_buffer.get_entries(limit, levelno, logger_name, since=last_seq):
+                        yield format_sse("log", json.dumps(line), seq)
+                        newest_seq = max(newest_seq, seq)
+                    last_seq = newest_seq
+                    try:
+                        await asyncio.wait_for(subscription.queue.get(), timeout=config.EVENT_STREAM_KEEPALIVE_SECONDS)
+                        subscription.drain()
+                    except asyncio.TimeoutError:
+                        if(await request.is_disconnected()):
+                            break
+                        yield ": keepalive\n\n"
+            finally:
+                log_broadcaster.unsubscribe(subscription)
+
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return StreamingResponse(log_generator(), media_type="text/event-stream", headers=headers)
+
+    if(log_buffer):
+        return {"logs": [entry[3] + "\n" for entry in log_buffer.get_entries(lines, levelno, logger_name)]}
     if(not os.path.exists(config.LOG_FILE_PATH)):
         return {"logs": ["Brak pliku logów."]}
-    
     try:
-        with open(config.LOG_FILE_PATH, "r", encoding="utf-8") as f:
-            all_lines = f.readlines()
-            last_lines = all_lines[-lines:]
-            return {"logs": last_lines}
+        return {"logs": await asyncio.to_thread(_read_log_file, lines, levelno, logger_name)}
     except Exception as e:
         logger.error(f"Błąd odczytu logów: {e}")
-        return {"logs": [f"Błąd odczytu logów: {str(e)}"]}
\ No newline at end of file
+        return {"logs": [f"Błąd odczytu logów: {str(e)}"]}
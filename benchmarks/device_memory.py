@@ -0,0 +1,78 @@
+"""
+Porównanie pamięci zajmowanej przez urządzenia: dawny model (obiekt z __dict__ + stan jako dict
++ lista atrybutów) i obecny (__slots__ + DeviceState + krotka internowanych kluczy).
+
+Uruchomienie z katalogu głównego projektu:
+    python -m benchmarks.device_memory [liczba_urządzeń]
+lub bezpośrednio:
+    python benchmarks/device_memory.py [liczba_urządzeń]
+"""
+import json
+import os
+import sys
+import tracemalloc
+
+# Przy uruchomieniu jako skrypt katalog główny projektu nie jest na ścieżce importu.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.devices_types import LightDevice, SocketDevice, SensorDevice
+from core.device_state import KEY_TABLE
+
+PAYLOADS = {
+    LightDevice: {"state": "ON", "brightness": 180, "color_temp": 370, "color_mode": "color_temp", "linkquality": 120},
+    SocketDevice: {"state": "ON", "power": 12.4, "voltage": 231.2, "current": 0.06, "energy": 4.21, "child_lock": "UNLOCK", "linkquality": 96},
+    SensorDevice: {"temperature": 21.37, "humidity": 48.2, "pressure": 1012.1, "battery": 87, "voltage": 2985, "linkquality": 72},
+}
+
+class LegacyDevice:
+    """Dawny model urządzenia - zwykły obiekt ze stanem w słowniku."""
+    def __init__(self, device_id, name, topic):
+        self.device_id = device_id
+        self.name = name
+        self.topic = topic
+        self.state = {"state": "UNKNOWN"}
+
+def payload_from_mqtt(payload: dict) -> dict:
+    # Każda wiadomość MQTT jest dekodowana osobno, więc klucze to za każdym razem nowe obiekty str.
+    return json.loads(json.dumps(payload))
+
+def build_legacy(count: int):
+    devices, attributes = {}, {}
+    classes = list(PAYLOADS)
+    for n in range(count):
+        payload = payload_from_mqtt(PAYLOADS[classes[n % len(classes)]])
+        device = LegacyDevice(f"0x{n:016x}", f"Urządzenie {n}", f"zigbee2mqtt/Urządzenie {n}")
+        device.state.update(payload)
+        devices[device.device_id] = device
+        attributes[device.device_id] = list(set(payload) - {"linkquality"})
+    return devices, attributes
+
+def build_compact(count: int):
+    devices, attributes = {}, {}
+    classes = list(PAYLOADS)
+    for n in range(count):
+        device_class = classes[n % len(classes)]
+        payload = payload_from_mqtt(PAYLOADS[device_class])
+        device = device_class(f"0x{n:016x}", f"Urządzenie {n}", f"zigbee2mqtt/Urządzenie {n}")
+        device.state.update(payload)
+        devices[device.device_id] = device
+        attributes[device.device_id] = tuple(KEY_TABLE.intern(key) for key in payload if key != "linkquality")
+    return devices, attributes
+
+def measure(builder, count: int) -> float:
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    result = builder(count)
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename"))
+    del result
+    return allocated / count
+
+if(__name__ == "__main__"):
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    legacy = measure(build_legacy, count)
+    compact = measure(build_compact, count)
+    print(f"Liczba urządzeń: {count}")
+    print(f"Dawny model:   {legacy:8.0f} B na urządzenie")
+    print(f"Obecny model:  {compact:8.0f} B na urządzenie ({(1 - compact / legacy) * 100:.0f}% mniej)")
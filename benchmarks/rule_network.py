@@ -0,0 +1,49 @@
+"""
+Koszt dodawania reguł złożonych i liczba sprawdzanych warunków przy zmianie stanu.
+Reguły współdzielą warunek na czujniku ruchu i różnią się czujnikiem drzwi oraz oknem czasowym.
+
+Uruchomienie z katalogu głównego projektu:
+    python -m benchmarks.rule_network [liczba_reguł]
+"""
+import sys
+import time
+
+from core.rule_compiler import compile_rule
+from core.rule_network import RuleNetwork
+from core.devices_types import SensorDevice
+
+def make_rule(n: int) -> dict:
+    return {
+        "id": f"r{n}", "name": f"Reguła {n}",
+        "trigger": {"type": "compound", "all": [
+            {"device_id": "motion", "key": "occupancy", "operator": "eq", "value": True},
+            {"device_id": f"door{n % 50}", "key": "contact", "operator": "eq", "value": False},
+            {"time_window": {"from": f"{n % 24:02d}:00", "to": f"{(n + 6) % 24:02d}:00"}},
+        ]},
+        "action": {"device_id": f"lamp{n}", "command": "turn_on"},
+    }
+
+if(__name__ == "__main__"):
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    motion = SensorDevice("motion", "Ruch", "zigbee2mqtt/Ruch")
+    motion.update_state({"occupancy": False})
+    states = {f"door{n}": {"contact": False} for n in range(50)}
+    states["motion"] = motion.state
+    network = RuleNetwork(states.get)
+    compiled = [compile_rule(make_rule(n)) for n in range(count)]
+
+    timings = []
+    for rule in compiled:
+        start = time.perf_counter()
+        network.add(rule.rule_id, rule.condition)
+        timings.append(time.perf_counter() - start)
+
+    network.evaluations = 0
+    motion.update_state({"occupancy": True})
+    start = time.perf_counter()
+    results = network.on_state_change("motion", ["occupancy"], motion.state)
+    elapsed = time.perf_counter() - start
+
+    print(f"Liczba reguł: {count}, węzłów sieci: {len(network)}")
+    print(f"Dodanie pierwszej reguły: {timings[0] * 1e6:8.1f} µs, ostatniej: {timings[-1] * 1e6:8.1f} µs")
+    print(f"Zmiana 'occupancy': {network.evaluations} sprawdzonych warunków, {len(results)} reguł do oceny, {elapsed * 1e6:.1f} µs")
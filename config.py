@@ -9,6 +9,56 @@ BROKER_ADDRESS = "localhost"
 BROKER_PORT = 1883
 MQTT_TOPIC_SUBSCRIBE = "zigbee2mqtt/#"
 
+# --- Potok Przetwarzania Wiadomości MQTT ---
+# Liczba wątków przetwarzających wiadomości (0 = przetwarzanie w wątku sieciowym paho).
+MQTT_WORKERS = 2
+# Łączna pojemność kolejek wiadomości oczekujących na przetworzenie.
+MQTT_QUEUE_SIZE = 1000
+# Zachowanie przy pełnej kolejce: "drop_oldest" lub "coalesce" (scalenie z oczekującą wiadomością tego samego topicu).
+MQTT_OVERFLOW_POLICY = "coalesce"
+
+# --- Wykonywanie Akcji Reguł ---
+# Liczba wątków wykonujących akcje wyzwolonych reguł (0 = akcje w wątku oceniającym reguły).
+# Akcje jednego urządzenia docelowego trafiają zawsze do tego samego wątku, więc zachowują kolejność.
+ACTION_WORKERS = 4
+# Łączna pojemność kolejek akcji; przy pełnej kolejce wyzwalający wątek czeka na wolne miejsce.
+ACTION_QUEUE_SIZE = 500
+# Liczba ostatnich pomiarów opóźnienia (od wyzwolenia reguły do publikacji komendy) w metrykach.
+ACTION_LATENCY_SAMPLES = 1000
+
+# --- Potwierdzanie Komend ---
+# Czas oczekiwania na raport stanu potwierdzający wysłaną komendę; po jego upływie komenda jest wysyłana ponownie.
+COMMAND_ACK_TIMEOUT_SECONDS = 3
+# Liczba ponownych wysłań niepotwierdzonej komendy; każde kolejne oczekiwanie jest COMMAND_RETRY_BACKOFF razy dłuższe.
+COMMAND_RETRIES = 2
+COMMAND_RETRY_BACKOFF = 2.0
+# Dokładność timerów oczekiwania na potwierdzenie.
+COMMAND_TIMER_TICK_SECONDS = 0.1
+# Tolerancja potwierdzenia wartości liczbowych (względna, ale nie mniejsza niż COMMAND_NUMERIC_TOLERANCE_MIN),
+# bo urządzenia zaokrąglają lub przycinają żądane wartości (np. jasność 255 -> 254).
+COMMAND_NUMERIC_TOLERANCE = 0.02
+COMMAND_NUMERIC_TOLERANCE_MIN = 1
+# Najdłuższe oczekiwanie endpointu /devices/action?wait=true na potwierdzenie; ponowienia trwają dalej w tle.
+COMMAND_WAIT_TIMEOUT_SECONDS = 5
+
+# Okna scalania (w sekundach) kolejnych raportów tego samego urządzenia w jedną zmianę stanu.
+# Klucz to ID urządzenia albo typ ("light", "socket", "sensor"); brak wpisu = brak scalania.
+# Przykład: {"socket": 1.0, "0x00158d0001a2b3c4": 0.5}
+COALESCE_WINDOWS: dict[str, float] = {}
+
+# Tryb asyncio: MQTT, reguły czasowe, zapis stanów i API działają w jednej pętli zdarzeń
+# (bez wątku paho, wątku reguł, wątku scalania i wątków roboczych MQTT_WORKERS). Zapis do SQLite odbywa się poza pętlą,
+# w osobnym wątku zapisu.
+ASYNC_MODE = os.getenv("ASYNC_MODE", "false").lower() in ("1", "true", "yes")
+
+# Akcje na grupach: jeśli włączone, nasze grupy są odwzorowywane na grupy Zigbee2MQTT
+# (o nazwie Z2M_GROUP_PREFIX + ID grupy), a komenda trafia do całej grupy jedną transmisją radiową.
+Z2M_NATIVE_GROUPS = False
+Z2M_GROUP_PREFIX = "smarthome_"
+
+# Czy usuwać urządzenia Zigbee (ID = adres IEEE), których nie ma już na liście 'zigbee2mqtt/bridge/devices'.
+DEVICE_SYNC_REMOVE_MISSING = True
+
 # --- Dane Logowania ---
 MQTT_USERNAME = os.getenv("MQTT_USERNAME") 
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
@@ -17,6 +67,9 @@ MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
 API_HOST = "localhost"
 API_PORT = 8000
 ALLOWED_ORIGINS = ["*"]
+# Strumień zmian stanu urządzeń (SSE): limit zaległych zdarzeń na klienta i odstęp sygnału podtrzymania.
+EVENT_STREAM_QUEUE_SIZE = 500
+EVENT_STREAM_KEEPALIVE_SECONDS = 15
 
 # --- Ścieżki do Plików Trwałych ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -24,6 +77,59 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 FRONTEND_DIR = os.path.join(BASE_DIR, "frontend")
 DATABASE_FILE_PATH = os.path.join(DATA_DIR, "smarthome.db")
 LOG_FILE_PATH = os.path.join(BASE_DIR, "smart_home.log")
+# Liczba ostatnich wpisów logu trzymanych w pamięci dla endpointu /logs.
+LOG_BUFFER_SIZE = 2000
+# Wpisy logu trafiają do kolejki i są zapisywane przez osobny wątek; przy pełnej kolejce nowe wpisy są odrzucane.
+LOG_QUEUE_SIZE = 10000
+# Wpisy z gorącej ścieżki obsługi wiadomości (extra={"device_id": ..., "sampled": True}) są przepuszczane
+# najwyżej raz na tyle sekund dla urządzenia (0 = bez próbkowania).
+LOG_SAMPLE_INTERVAL_SECONDS = 10
 
 # --- Ustawienia Logiki i Wątków ---
-TIME_CHECK_INTERVAL_SECONDS = 60
\ No newline at end of file
+# Reguły czasowe są budzone dokładnie na swoją godzinę; ten interwał to jedynie
+# maksymalny czas snu, po którym sprawdzany jest ewentualny skok zegara systemowego.
+TIME_CHECK_INTERVAL_SECONDS = 60
+# Wyzwolenia spóźnione o więcej niż tyle sekund (np. po synchronizacji NTP) są pomijane.
+TIME_RULE_GRACE_SECONDS = 60
+# Koło czasowe dla opcji reguł 'debounce' i 'min_interval': długość taktu (dokładność timerów)
+# i liczba przegródek; dłuższe opóźnienia wykonują kilka obrotów koła.
+RULE_TIMER_TICK_SECONDS = 0.25
+RULE_TIMER_SLOTS = 512
+# Stany wykonania reguł (zatrzask, czas ostatniego wyzwolenia) są zapisywane zbiorczo co tyle sekund.
+RULE_STATE_FLUSH_INTERVAL_SECONDS = 5
+
+# --- Ustawienia SQLite ---
+# Każdy wątek dostaje własne połączenie; WAL pozwala czytać bez czekania na zapis.
+DB_JOURNAL_MODE = "WAL"
+DB_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "mmap_size": 64 * 1024 * 1024,
+    "cache_size": -8000,  # ujemna wartość = rozmiar w KiB
+    "busy_timeout": 5000,
+}
+DB_CACHED_STATEMENTS = 256
+
+# --- Ustawienia Zapisu Stanu (write-behind) ---
+# Stany urządzeń są zbierane w pamięci i zapisywane zbiorczo, w jednej transakcji.
+# DB_FLUSH_INTERVAL_SECONDS ogranicza, ile sekund zmian stanu można utracić przy awarii zasilania.
+DB_WRITE_BEHIND = True
+DB_FLUSH_INTERVAL_SECONDS = 5
+DB_FLUSH_MAX_DIRTY = 100
+# Klucze zmieniające się niemal w każdym raporcie (jakość sygnału, znacznik czasu). Są aktualizowane
+# w pamięci, ale sama ich zmiana nie jest zapisywana do bazy, logowana ani nie uruchamia reguł.
+VOLATILE_STATE_KEYS = ["linkquality", "last_seen"]
+
+# --- Historia Odczytów ---
+# Wartości liczbowe ze stanów urządzeń trafiają do tabel historii zbiorczo, razem z agregatami 1 min / 1 h / 1 dzień.
+HISTORY_ENABLED = True
+HISTORY_FLUSH_INTERVAL_SECONDS = 10
+HISTORY_BATCH_SIZE = 500
+# Ile dni przechowywać dane surowe i agregaty (None = bez limitu).
+HISTORY_RETENTION_DAYS = {"raw": 7, "1m": 90, "1h": 730, "1d": None}
+HISTORY_PRUNE_INTERVAL_SECONDS = 3600
+# Historia dostaje tylko zmiany wartości, więc średnia w agregatach jest ważona czasem: odczyt obowiązuje
+# do następnego odczytu tej samej wartości, najdłużej tyle sekund (dłuższa przerwa = brak danych).
+HISTORY_MAX_HOLD_SECONDS = 3600
+# Maksymalna liczba punktów zwracanych przez API - na jej podstawie dobierana jest rozdzielczość.
+HISTORY_MAX_POINTS = 1500
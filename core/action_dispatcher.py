@@ -0,0 +1,180 @@
+import json
+import threading
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+class _ActionShard:
+    """
+    Kolejka jednego wątku wykonującego akcje. Wpisy to listy [cel, komenda, wartość, ID reguł, czas wyzwolenia].
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.queue: deque = deque()
+        self.cond = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+
+class ActionDispatcher:
+    """
+    Wykonuje akcje wyzwolonych reguł na ograniczonej puli wątków. Akcje są dzielone według
+    urządzenia (lub grupy) docelowego, więc akcje jednego celu wykonywane są po kolei, w kolejności
+    wyzwolenia, a akcje różnych celów - równolegle. Identyczne komendy do tego samego celu,
+    wyzwolone w jednym przebiegu oceny reguł (zob. batch()), są wykonywane raz.
+    Dopóki pula nie jest uruchomiona (oraz przy workers=0), akcje wykonywane są w wątku wywołującym.
+    """
+    def __init__(self, executor: Callable[[str, str, Any], Any], workers: int = config.ACTION_WORKERS,
+                 queue_size: int = config.ACTION_QUEUE_SIZE, latency_samples: int = config.ACTION_LATENCY_SAMPLES):
+        self.executor = executor
+        self._shards = [_ActionShard(max(1, queue_size // workers)) for _ in range(workers)] if(workers > 0) else []
+        self._running = False
+        self._local = threading.local()
+        self._metrics_lock = threading.Lock()
+        self._submitted = 0
+        self._executed = 0
+        self._deduplicated = 0
+        self._errors = 0
+        self._latencies: deque = deque(maxlen=max(1, latency_samples))
+        self._latency_max = 0.0
+
+    @staticmethod
+    def _dedupe_key(target_id: str, command: str, value: Any) -> tuple:
+        try:
+            return (target_id, command, json.dumps(value, sort_keys=True))
+        except (TypeError, ValueError):
+            return (target_id, command, repr(value))
+
+    @contextmanager
+    def batch(self):
+        """
+        Przebieg oceny reguł: akcje zgłoszone w bloku są zbierane, identyczne komendy scalane,
+        a całość jest przekazywana do wykonania po wyjściu z bloku. Bloki zagnieżdżone należą do zewnętrznego.
+        """
+        if(getattr(self._local, "pending", None) is not None):
+            yield
+            return
+        self._local.pending = {}
+        try:
+            yield
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            for entry in pending.values():
+                self._dispatch(entry)
+
+    def submit(self, rule_id: str, target_id: str, command: str, value: Any = None):
+        """
+        Zgłasza akcję reguły. Czas wyzwolenia jest zapamiętywany do pomiaru opóźnienia wykonania.
+        """
+        entry = [target_id, command, value, [rule_id], time.monotonic()]
+        pending = getattr(self._local, "pending", None)
+        with self._metrics_lock:
+            self._submitted += 1
+        if(pending is None):
+            self._dispatch(entry)
+            return
+        key = self._dedupe_key(target_id, command, value)
+        previous = pending.get(key)
+        if(previous is None):
+            pending[key] = entry
+            return
+        previous[3].append(rule_id)
+        with self._metrics_lock:
+            self._deduplicated += 1
+        logger.debug("Pominięto powtórzoną akcję %s na %s z reguły ID=%s (ta sama komenda w tym przebiegu).", command, target_id, rule_id)
+
+    def _dispatch(self, entry: list):
+        if(not self._running):
+            self._execute(entry)
+            return
+        shard = self._shards[hash(entry[0]) % len(self._shards)]
+        with shard.cond:
+            # Pełna kolejka spowalnia wyzwalający wątek zamiast gubić akcje.
+            while(len(shard.queue) >= shard.maxsize and self._running):
+                shard.cond.wait()
+            if(self._running):
+                shard.queue.append(entry)
+                shard.cond.notify_all()
+                return
+        self._execute(entry)
+
+    def _execute(self, entry: list):
+        target_id, command, value, rule_ids, triggered_at = entry
+        try:
+            self.executor(target_id, command, value)
+        except Exception as e:
+            with self._metrics_lock:
+                self._errors += 1
+            logger.error(f"Błąd wykonania akcji {command} na {target_id} (reguły {', '.join(rule_ids)}): {e}")
+            return
+        latency = time.monotonic() - triggered_at
+        with self._metrics_lock:
+            self._executed += 1
+            self._latencies.append(latency)
+            if(latency > self._latency_max):
+                self._latency_max = latency
+        logger.debug("Wykonano akcję %s na %s (reguły %s) w %.1f ms od wyzwolenia.", command, target_id, rule_ids, latency * 1000)
+
+    def start(self):
+        if(self._running or not self._shards):
+            return
+        self._running = True
+        for index, shard in enumerate(self._shards):
+            shard.thread = threading.Thread(target=self._worker_loop, args=(shard,), name=f"rule-action-{index}", daemon=True)
+            shard.thread.start()
+        logger.info(f"Uruchomiono wykonywanie akcji reguł: {len(self._shards)} wątków.")
+
+    def stop(self, timeout: float = 5):
+        """
+        Zatrzymuje wątki po wykonaniu akcji, które już czekają w kolejkach.
+        """
+        if(not self._running):
+            return
+        self._running = False
+        for shard in self._shards:
+            with shard.cond:
+                shard.cond.notify_all()
+        for shard in self._shards:
+            if(shard.thread and shard.thread.is_alive()):
+                shard.thread.join(timeout=timeout)
+        logger.info("Zatrzymano wykonywanie akcji reguł.")
+
+    def _worker_loop(self, shard: _ActionShard):
+        while(True):
+            with shard.cond:
+                while(not shard.queue and self._running):
+                    shard.cond.wait()
+                if(not shard.queue):
+                    return
+                entry = shard.queue.popleft()
+                shard.cond.notify_all()
+            self._execute(entry)
+
+    def get_metrics(self) -> dict:
+        depths = [len(shard.queue) for shard in self._shards]
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            latency_max = self._latency_max
+            metrics = {
+                "workers": len(self._shards),
+                "running": self._running,
+                "queue_depth": sum(depths),
+                "queue_depth_per_worker": depths,
+                "submitted": self._submitted,
+                "executed": self._executed,
+                "deduplicated": self._deduplicated,
+                "errors": self._errors,
+            }
+        if(latencies):
+            metrics["latency_ms"] = {
+                "samples": len(latencies),
+                "avg": round(sum(latencies) / len(latencies) * 1000, 3),
+                "p50": round(latencies[len(latencies) // 2] * 1000, 3),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3),
+                "max": round(latency_max * 1000, 3),
+            }
+        return metrics
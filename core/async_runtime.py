@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+def _call_in_loop(loop: asyncio.AbstractEventLoop, callback, *args):
+    """
+    Wywołuje funkcję od razu, jeśli jesteśmy w wątku pętli, a w przeciwnym razie przekazuje ją do pętli.
+    """
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if(running is loop):
+        callback(*args)
+    else:
+        loop.call_soon_threadsafe(callback, *args)
+
+class LoopEvent:
+    """
+    asyncio.Event, który można bezpiecznie ustawić z dowolnego wątku (np. z wątku puli API).
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self._event = asyncio.Event()
+
+    def set(self):
+        _call_in_loop(self.loop, self._event.set)
+
+    async def wait(self, timeout: Optional[float] = None):
+        """
+        Czeka na ustawienie zdarzenia lub upływ czasu, po czym je kasuje.
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+class AsyncioMqttLoop:
+    """
+    Obsługuje gniazdo klienta paho w pętli asyncio (add_reader/add_writer) zamiast w wątku loop_start().
+    Wywołania zwrotne paho, w tym on_message, wykonują się wtedy w wątku pętli zdarzeń.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client, max_reconnect_delay: float = 120):
+        self.loop = loop
+        self.client = client
+        self.max_reconnect_delay = max_reconnect_delay
+        self._misc_task: Optional[asyncio.Task] = None
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _on_socket_open(self, client, userdata, sock):
+        _call_in_loop(self.loop, self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        _call_in_loop(self.loop, self.loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        _call_in_loop(self.loop, self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        _call_in_loop(self.loop, self.loop.remove_writer, sock)
+
+    def start(self):
+        if(self._misc_task is None):
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def stop(self):
+        if(self._misc_task):
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    async def _misc_loop(self):
+        """
+        Obsługa keepalive paho oraz ponowne łączenie z brokerem (tę rolę pełni normalnie wątek loop_start()).
+        """
+        delay = 1
+        while(True):
+            if(self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN):
+                try:
+                    self.client.reconnect()
+                    delay = 1
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Ponowne połączenie z brokerem MQTT nieudane: {e}. Kolejna próba za {delay}s.")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+                    continue
+            await asyncio.sleep(1)
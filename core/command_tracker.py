@@ -0,0 +1,284 @@
+import asyncio
+import threading
+import logging
+import time
+from typing import Any, Callable, Optional
+
+import config
+from .async_runtime import LoopEvent
+from .timer_wheel import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+COMMAND_PENDING = "pending"
+COMMAND_CONFIRMED = "confirmed"
+COMMAND_FAILED = "failed"
+COMMAND_SUPERSEDED = "superseded"
+# Komenda bez wartości, które urządzenie mogłoby potwierdzić w raporcie stanu (np. kolor HEX).
+COMMAND_UNTRACKED = "untracked"
+
+class PendingCommand:
+    """
+    Komenda wysłana do urządzenia i oczekująca na potwierdzenie w raporcie stanu.
+    'expected' to klucze payloadu, których wartości urządzenie musi zgłosić, zanim komenda uznana zostanie za wykonaną.
+    """
+    __slots__ = ("device_id", "topic", "payload", "expected", "send", "attempts", "issued_at", "latency", "status", "done", "callbacks")
+
+    def __init__(self, device_id: str, topic: str, payload: dict, expected: dict, send: Callable[[], Any], issued_at: float):
+        self.device_id = device_id
+        self.topic = topic
+        self.payload = payload
+        self.expected = expected
+        self.send = send
+        self.attempts = 1
+        self.issued_at = issued_at
+        self.latency: Optional[float] = None
+        self.status = COMMAND_PENDING if(expected) else COMMAND_UNTRACKED
+        self.done = threading.Event()
+        # Wywoływane po rozstrzygnięciu komendy (w wątku, który ją rozstrzygnął).
+        self.callbacks: list[Callable[[], Any]] = []
+        if(not expected):
+            self.done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> str:
+        """
+        Czeka na potwierdzenie, ostateczne niepowodzenie lub zastąpienie komendy i zwraca jej status.
+        """
+        self.done.wait(timeout)
+        return self.status
+
+    async def wait_async(self, timeout: Optional[float] = None) -> str:
+        """
+        Odpowiednik wait() dla pętli asyncio - oczekiwanie nie zajmuje żadnego wątku.
+        """
+        loop = asyncio.get_running_loop()
+        resolved = loop.create_future()
+
+        def resolve():
+            if(not resolved.done()):
+                resolved.set_result(None)
+
+        self.callbacks.append(lambda: loop.call_soon_threadsafe(resolve))
+        if(not self.done.is_set()):
+            try:
+                await asyncio.wait_for(resolved, timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.status
+
+    def to_dict(self) -> dict:
+        return {
+            "device_id": self.device_id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "latency_ms": round(self.latency * 1000, 1) if(self.latency is not None) else None,
+        }
+
+class CommandTracker:
+    """
+    Śledzi komendy wysłane do urządzeń, dopasowuje do nich przychodzące raporty stanu
+    i mierzy opóźnienie od wysłania komendy do potwierdzenia przez urządzenie.
+    Komenda niepotwierdzona w czasie 'timeout' jest wysyłana ponownie, z czasem oczekiwania
+    wydłużanym 'backoff' razy przy każdej próbie; po 'retries' powtórzeniach uznawana jest za nieudaną.
+    Na urządzenie przypada najwyżej jedna oczekująca komenda - nowa komenda zastępuje poprzednią.
+    """
+    def __init__(self, timeout: float = config.COMMAND_ACK_TIMEOUT_SECONDS, retries: int = config.COMMAND_RETRIES,
+                 backoff: float = config.COMMAND_RETRY_BACKOFF, clock: Callable[[], float] = time.monotonic,
+                 tolerance: float = config.COMMAND_NUMERIC_TOLERANCE, min_tolerance: float = config.COMMAND_NUMERIC_TOLERANCE_MIN):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.min_tolerance = min_tolerance
+        self.clock = clock
+        self._pending: dict[str, PendingCommand] = {}
+        self._timers = TimerWheel(tick=config.COMMAND_TIMER_TICK_SECONDS, clock=clock)
+        self._lock = threading.Lock()
+        # device_id -> [liczba potwierdzeń, suma opóźnień, ostatnie, maksymalne]
+        self._latency: dict[str, list] = {}
+        self._confirmed = 0
+        self._retried = 0
+        self._failed = 0
+        self._superseded = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._async_wake: LoopEvent = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @staticmethod
+    def _expected_values(payload: dict) -> dict:
+        # Zigbee2MQTT raportuje kolor we własnym formacie (np. x/y), więc potwierdzane są tylko wartości proste.
+        return {key: value for key, value in payload.items() if(isinstance(value, (str, int, float)))}
+
+    def _value_matches(self, expected: Any, reported: Any) -> bool:
+        """
+        Wartość liczbowa potwierdza komendę, jeśli mieści się w tolerancji (urządzenia zaokrąglają
+        lub przycinają wartości, np. jasność 255 -> 254); pozostałe wartości muszą być równe.
+        """
+        if(isinstance(expected, (int, float)) and isinstance(reported, (int, float))
+           and not isinstance(expected, bool) and not isinstance(reported, bool)):
+            return abs(reported - expected) <= max(self.min_tolerance, abs(expected) * self.tolerance)
+        return expected == reported
+
+    def track(self, device_id: str, topic: str, payload: dict, send: Callable[[], Any]) -> PendingCommand:
+        """
+        Rejestruje wysłaną komendę. 'send' ponawia publikację przy braku potwierdzenia.
+        """
+        now = self.clock()
+        command = PendingCommand(device_id, topic, payload, self._expected_values(payload), send, now)
+        if(command.status == COMMAND_UNTRACKED):
+            return command
+        with self._lock:
+            previous = self._pending.get(device_id)
+            self._pending[device_id] = command
+            if(previous is not None):
+                self._superseded += 1
+            self._timers.schedule(device_id, self.timeout, lambda: self._on_timeout(command), now)
+        if(previous is not None):
+            self._finish(previous, COMMAND_SUPERSEDED)
+        self._notify_wake()
+        return command
+
+    def pending(self, device_id: str) -> Optional[PendingCommand]:
+        return self._pending.get(device_id)
+
+    def on_report(self, device_id: str, payload: dict):
+        """
+        Dopasowuje raport stanu urządzenia do oczekującej komendy. Wywoływane dla każdej wiadomości,
+        także takiej, która nie zmienia stanu (urządzenie mogło już mieć żądaną wartość).
+        """
+        command = self._pending.get(device_id)
+        if(command is None or not isinstance(payload, dict)):
+            return
+        with self._lock:
+            if(self._pending.get(device_id) is not command):
+                return
+            expected = command.expected
+            for key, value in payload.items():
+                if(key in expected and self._value_matches(expected[key], value)):
+                    del expected[key]
+            if(expected):
+                return
+            del self._pending[device_id]
+            command.latency = self.clock() - command.issued_at
+            stats = self._latency.setdefault(device_id, [0, 0.0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += command.latency
+            stats[2] = command.latency
+            stats[3] = max(stats[3], command.latency)
+            self._confirmed += 1
+            self._timers.cancel(device_id)
+        self._finish(command, COMMAND_CONFIRMED)
+        logger.debug("Urządzenie %s potwierdziło komendę %s po %.0f ms (próba %d).", device_id, command.payload, command.latency * 1000, command.attempts,
+                     extra={"device_id": device_id})
+
+    def _on_timeout(self, command: PendingCommand):
+        with self._lock:
+            if(self._pending.get(command.device_id) is not command):
+                return
+            if(command.attempts > self.retries):
+                del self._pending[command.device_id]
+                self._failed += 1
+                retry = False
+            else:
+                command.attempts += 1
+                self._retried += 1
+                retry = True
+                delay = self.timeout * self.backoff ** (command.attempts - 1)
+                self._timers.schedule(command.device_id, delay, lambda: self._on_timeout(command))
+        if(not retry):
+            self._finish(command, COMMAND_FAILED)
+            logger.warning(f"Urządzenie {command.device_id} nie potwierdziło komendy {command.payload} po {command.attempts} próbach.",
+                           extra={"device_id": command.device_id})
+            return
+        logger.info(f"Brak potwierdzenia komendy {command.payload} od {command.device_id}. Ponawiam (próba {command.attempts}, "
+                    f"następne oczekiwanie {delay:.1f}s).", extra={"device_id": command.device_id})
+        try:
+            command.send()
+        except Exception as e:
+            logger.error(f"Błąd ponownej publikacji komendy dla {command.device_id}: {e}")
+
+    @staticmethod
+    def _finish(command: PendingCommand, status: str):
+        command.status = status
+        command.done.set()
+        for callback in command.callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Błąd powiadomienia o rozstrzygnięciu komendy dla {command.device_id}: {e}")
+
+    def run_due(self, now: Optional[float] = None):
+        """
+        Obsługuje komendy, których czas oczekiwania na potwierdzenie minął ('now' w czasie monotonicznym).
+        """
+        for device_id, callback in self._timers.advance(now):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Błąd obsługi limitu czasu komendy dla {device_id}: {e}")
+
+    def max_wait(self) -> float:
+        """
+        Najdłuższy czas od wysłania komendy do jej rozstrzygnięcia (wszystkie próby z wydłużanym oczekiwaniem).
+        """
+        return sum(self.timeout * self.backoff ** attempt for attempt in range(self.retries + 1)) + config.COMMAND_TIMER_TICK_SECONDS
+
+    def _next_timeout(self) -> Optional[float]:
+        return self._timers.seconds_until_next()
+
+    def _notify_wake(self):
+        self._wake.set()
+        if(self._async_wake):
+            self._async_wake.set()
+
+    def start(self):
+        if(self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="command-tracker", daemon=True)
+        self._thread.start()
+        logger.info(f"Uruchomiono śledzenie potwierdzeń komend (limit {self.timeout}s, {self.retries} powtórzeń).")
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+        if(self._thread and self._thread.is_alive()):
+            self._thread.join(timeout=2)
+            logger.info("Zatrzymano śledzenie potwierdzeń komend.")
+
+    def _loop(self):
+        while(not self._stop_event.is_set()):
+            self.run_due()
+            self._wake.wait(self._next_timeout())
+            self._wake.clear()
+
+    async def run_async(self):
+        """
+        Odpowiednik wątku śledzenia dla trybu asyncio - ponowne publikacje wykonywane są w pętli zdarzeń.
+        """
+        self._async_wake = LoopEvent(asyncio.get_running_loop())
+        logger.info(f"Uruchomiono śledzenie potwierdzeń komend (limit {self.timeout}s, {self.retries} powtórzeń, tryb asyncio).")
+        try:
+            while(True):
+                self.run_due()
+                await self._async_wake.wait(self._next_timeout())
+        finally:
+            self._async_wake = None
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "confirmed": self._confirmed,
+                "retried": self._retried,
+                "failed": self._failed,
+                "superseded": self._superseded,
+                "latency_ms": {
+                    device_id: {"count": count, "avg": round(total / count * 1000, 1), "last": round(last * 1000, 1), "max": round(peak * 1000, 1)}
+                    for device_id, (count, total, last, peak) in self._latency.items()
+                },
+            }
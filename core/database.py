@@ -1,11 +1,218 @@
 import sqlite3
 import logging
 import json
+import threading
+import weakref
 import config
 from typing import List, Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+# Wersja schematu zapisywana w PRAGMA user_version. Wersja 1 (i 0 - baza bez numeru)
+# przechowywała stan, atrybuty i składy grup jako JSON w kolumnach tabel devices i groups,
+# wersja 3 dodaje tabelę rule_states, a wersja 4 - tabele historii odczytów (wcześniej tworzone
+# poza schematem przez HistoryManager) z kolumnami średniej ważonej czasem.
+SCHEMA_VERSION = 4
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS devices (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        type TEXT NOT NULL
+    );
+    """,
+    # Jeden wiersz na atrybut stanu. Wartości liczbowe i tekstowe zapisywane są wprost
+    # (można je filtrować w SQL), pozostałe jako JSON z encoded = 1.
+    """
+    CREATE TABLE IF NOT EXISTS device_state (
+        device_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value,
+        encoded INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (device_id, key)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS device_attributes (
+        device_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (device_id, key)
+    ) WITHOUT ROWID;
+    """,
+    # Pełna definicja wyzwalacza i akcji zostaje w JSON (reguły czytane są tylko przy starcie),
+    # a pola, po których wyszukuje się reguły, mają własne, indeksowane kolumny.
+    """
+    CREATE TABLE IF NOT EXISTS rules (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        active INTEGER NOT NULL,
+        trigger TEXT NOT NULL,
+        action TEXT NOT NULL,
+        trigger_type TEXT,
+        trigger_device_id TEXT,
+        trigger_key TEXT
+    );
+    """,
+    # Stan wykonania reguł (zatrzask i czas ostatniego wyzwolenia), aby restart nie wyzwalał reguł ponownie.
+    """
+    CREATE TABLE IF NOT EXISTS rule_states (
+        rule_id TEXT PRIMARY KEY,
+        last_triggered REAL,
+        is_active INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS groups (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS group_members (
+        group_id TEXT NOT NULL,
+        device_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (group_id, device_id)
+    ) WITHOUT ROWID;
+    """,
+    # Historia odczytów: seria to para (urządzenie, klucz). Tabele danych mają klucz (seria, czas),
+    # więc zapytanie o zakres jednej serii to odczyt ciągłego fragmentu indeksu.
+    """
+    CREATE TABLE IF NOT EXISTS history_series (
+        id INTEGER PRIMARY KEY,
+        device_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        UNIQUE (device_id, key)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS history_raw (
+        series_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (series_id, ts)
+    ) WITHOUT ROWID;
+    """,
+    # weighted_sum / weighted_seconds to całka wartości po czasie jej obowiązywania w przedziale (średnia ważona czasem).
+    """
+    CREATE TABLE IF NOT EXISTS history_rollup (
+        series_id INTEGER NOT NULL,
+        resolution INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        samples INTEGER NOT NULL,
+        value_sum REAL NOT NULL,
+        value_min REAL NOT NULL,
+        value_max REAL NOT NULL,
+        weighted_sum REAL NOT NULL DEFAULT 0,
+        weighted_seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (series_id, resolution, bucket)
+    ) WITHOUT ROWID;
+    """,
+)
+
+SCHEMA_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_device_state_key ON device_state (key, value);",
+    "CREATE INDEX IF NOT EXISTS idx_group_members_device ON group_members (device_id);",
+    "CREATE INDEX IF NOT EXISTS idx_rules_trigger_device ON rules (trigger_device_id, trigger_key);",
+    "CREATE INDEX IF NOT EXISTS idx_rules_trigger_type ON rules (trigger_type);",
+)
+
+UPSERT_DEVICE = """
+    INSERT INTO devices (id, name, topic, type) VALUES (?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET name = excluded.name, topic = excluded.topic, type = excluded.type
+"""
+
+UPSERT_HISTORY_ROLLUP = """
+    INSERT INTO history_rollup (series_id, resolution, bucket, samples, value_sum, value_min, value_max, weighted_sum, weighted_seconds)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (series_id, resolution, bucket) DO UPDATE SET
+        samples = samples + excluded.samples,
+        value_sum = value_sum + excluded.value_sum,
+        value_min = MIN(value_min, excluded.value_min),
+        value_max = MAX(value_max, excluded.value_max),
+        weighted_sum = weighted_sum + excluded.weighted_sum,
+        weighted_seconds = weighted_seconds + excluded.weighted_seconds
+"""
+
+UPSERT_DEVICE_STATE = """
+    INSERT INTO device_state (device_id, key, value, encoded) VALUES (?, ?, ?, ?)
+    ON CONFLICT (device_id, key) DO UPDATE SET value = excluded.value, encoded = excluded.encoded
+"""
+
+def _encode_value(value: Any) -> tuple:
+    """
+    Zamienia wartość stanu na parę (wartość kolumny, encoded). Liczby i teksty zapisywane są wprost,
+    wartości logiczne, None, listy i obiekty - jako JSON.
+    """
+    if(isinstance(value, (str, int, float)) and not isinstance(value, bool)):
+        return value, 0
+    return json.dumps(value), 1
+
+def _decode_value(value: Any, encoded: int) -> Any:
+    return json.loads(value) if(encoded) else value
+
+def _load_json(text: Optional[str], default: Any) -> Any:
+    if(not text):
+        return default
+    try:
+        return json.loads(text)
+    except ValueError:
+        return default
+
+def _trigger_columns(trigger: Any) -> tuple:
+    """
+    Wyciąga z definicji wyzwalacza wartości indeksowanych kolumn (trigger_type, trigger_device_id, trigger_key).
+    """
+    if(not isinstance(trigger, dict)):
+        return (None, None, None)
+    return (trigger.get("type", "state"), trigger.get("device_id"), trigger.get("key"))
+
+class _ThreadConnection:
+    """
+    Połączenie przypisane do wątku. Obiekt żyje w threading.local, więc po zakończeniu wątku
+    jest usuwany, a finalizator zamyka połączenie - krótkotrwałe wątki (pule wykonawców) nie zostawiają otwartych plików.
+    """
+    __slots__ = ("connection", "__weakref__")
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+def _close_thread_connection(conn: sqlite3.Connection, connections: List[sqlite3.Connection], lock: threading.Lock):
+    with lock:
+        if(conn not in connections):
+            return
+        connections.remove(conn)
+    try:
+        conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Błąd zamykania połączenia z bazą danych: {e}")
+
+class _FetchedCursor:
+    """
+    Wynik odczytu pobrany w całości pod blokadą (współdzielone połączenie bazy ':memory:').
+    """
+    def __init__(self, rows: list):
+        self._rows = rows
+        self._position = 0
+
+    def fetchone(self):
+        if(self._position >= len(self._rows)):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    def fetchall(self) -> list:
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
 class DatabaseManager:
     """
     Klasa odpowiedzialna za zarządzanie połączeniem SQLite i operacjami CRUD.
@@ -13,151 +220,381 @@ class DatabaseManager:
     
     def __init__(self, db_path: str = config.DATABASE_FILE_PATH):
         self.db_path = db_path
-        self._connection = None
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._shared_connection = None
         self._initialize_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Otwiera nowe połączenie i ustawia parametry strojenia SQLite (PRAGMA) dla tego połączenia.
+        """
+        try:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=config.DB_CACHED_STATEMENTS)
+            conn.row_factory = sqlite3.Row
+            for pragma, value in config.DB_PRAGMAS.items():
+                conn.execute(f"PRAGMA {pragma} = {value};")
+        except sqlite3.Error as e:
+            logger.critical(f"KRYTYCZNY BŁĄD połączenia z bazą danych: {e}")
+            raise
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
     def _get_connection(self) -> sqlite3.Connection:
         """
-        Pobiera lub tworzy połączenie z bazą danych.
+        Zwraca połączenie z bazą danych przypisane do bieżącego wątku.
+        Baza ':memory:' istnieje tylko w obrębie jednego połączenia, więc jest ono współdzielone.
         """
-        if(self._connection is None):
-            try:
-                self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
-                self._connection.row_factory = sqlite3.Row 
-            except sqlite3.Error as e:
-                logger.critical(f"KRYTYCZNY BŁĄD połączenia z bazą danych: {e}")
-                raise
-        return self._connection
+        if(self.db_path == ":memory:"):
+            with self._connections_lock:
+                if(self._shared_connection is None):
+                    self._shared_connection = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=config.DB_CACHED_STATEMENTS)
+                    self._shared_connection.row_factory = sqlite3.Row
+                    self._connections.append(self._shared_connection)
+            return self._shared_connection
 
-    def _execute_query(self, query: str, params: tuple = ()) -> sqlite3.Cursor:
+        holder = getattr(self._local, "holder", None)
+        if(holder is None):
+            conn = self._connect()
+            holder = _ThreadConnection(conn)
+            weakref.finalize(holder, _close_thread_connection, conn, self._connections, self._connections_lock)
+            self._local.holder = holder
+        return holder.connection
+
+    def _execute_read(self, query: str, params: tuple = ()) -> sqlite3.Cursor:
         """
-        Wykonuje zapytanie i zwraca kursor.
+        Wykonuje zapytanie odczytu. Nie blokuje się na zapisie (tryb WAL).
+        Współdzielone połączenie bazy ':memory:' jest używane pod blokadą zapisu, a wynik pobierany od razu.
         """
-        conn = self._get_connection()
-        cursor = conn.cursor()
+        if(self.db_path == ":memory:"):
+            conn = self._get_connection()
+            with self._write_lock:
+                try:
+                    return _FetchedCursor(conn.execute(query, params).fetchall())
+                except sqlite3.Error as e:
+                    logger.error(f"Błąd wykonania zapytania: {query} z parametrami {params}. Błąd: {e}")
+                    raise
+        cursor = self._get_connection().cursor()
         try:
             cursor.execute(query, params)
-            conn.commit()
         except sqlite3.Error as e:
             logger.error(f"Błąd wykonania zapytania: {query} z parametrami {params}. Błąd: {e}")
             raise
         return cursor
 
+    def _execute_query(self, query: str, params: tuple = ()) -> sqlite3.Cursor:
+        """
+        Wykonuje zapytanie modyfikujące pod blokadą zapisu i zatwierdza transakcję.
+        """
+        conn = self._get_connection()
+        with self._write_lock:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params)
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.error(f"Błąd wykonania zapytania: {query} z parametrami {params}. Błąd: {e}")
+                raise
+        return cursor
+
+    def _execute_many(self, query: str, params_seq: List[tuple]) -> sqlite3.Cursor:
+        """
+        Wykonuje to samo zapytanie dla wielu zestawów parametrów w jednej transakcji.
+        """
+        conn = self._get_connection()
+        with self._write_lock:
+            cursor = conn.cursor()
+            try:
+                cursor.executemany(query, params_seq)
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.error(f"Błąd wykonania zapytania zbiorczego: {query} ({len(params_seq)} rekordów). Błąd: {e}")
+                raise
+        return cursor
+
+    def _execute_transaction(self, statements: List[tuple]) -> List[int]:
+        """
+        Wykonuje listę par (zapytanie, lista parametrów) w jednej transakcji.
+        Zwraca liczbę zmienionych wierszy dla każdego zapytania.
+        """
+        conn = self._get_connection()
+        with self._write_lock:
+            cursor = conn.cursor()
+            rowcounts = []
+            try:
+                for query, params_seq in statements:
+                    cursor.executemany(query, params_seq)
+                    rowcounts.append(cursor.rowcount)
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.error(f"Błąd wykonania transakcji ({len(statements)} zapytań). Błąd: {e}")
+                raise
+        return rowcounts
+
     def _initialize_db(self):
         """
-        Tworzy tabele, jeśli nie istnieją.
+        Tworzy tabele, jeśli nie istnieją, i migruje bazę zapisaną w starszym schemacie (PRAGMA user_version).
         """
         logger.info(f"Inicjalizacja schematu bazy danych w pliku: {self.db_path}")
-        self._execute_query("""
-            CREATE TABLE IF NOT EXISTS devices (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                topic TEXT NOT NULL,
-                type TEXT NOT NULL,
-                state TEXT,
-                attributes TEXT 
-            );
-        """)
-        self._execute_query("""
-            CREATE TABLE IF NOT EXISTS rules (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                active INTEGER NOT NULL,
-                trigger TEXT NOT NULL,
-                action TEXT NOT NULL
-            );
-        """)
-        self._execute_query("""
-            CREATE TABLE IF NOT EXISTS groups (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                members TEXT NOT NULL
-            );
-        """)
+        if(self.db_path != ":memory:"):
+            journal_mode = self._execute_read(f"PRAGMA journal_mode = {config.DB_JOURNAL_MODE};").fetchone()[0]
+            logger.info(f"Tryb dziennika SQLite: {journal_mode}")
+        version = self._execute_read("PRAGMA user_version;").fetchone()[0]
+        if(version >= SCHEMA_VERSION):
+            return
+        conn = self._get_connection()
+        with self._write_lock:
+            try:
+                conn.execute("BEGIN")
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                self._migrate_json_columns(conn)
+                self._migrate_history_rollup(conn)
+                for statement in SCHEMA_INDEXES:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.critical(f"KRYTYCZNY BŁĄD migracji schematu bazy danych (wersja {version} -> {SCHEMA_VERSION}): {e}")
+                raise
+        if(version > 0):
+            logger.info(f"Zaktualizowano schemat bazy danych: wersja {version} -> {SCHEMA_VERSION}.")
+
+    @staticmethod
+    def _columns(conn: sqlite3.Connection, table: str) -> set:
+        return {row[1] for row in conn.execute(f"PRAGMA table_info({table});")}
+
+    def _migrate_json_columns(self, conn: sqlite3.Connection):
+        """
+        Przenosi dane z kolumn JSON starego schematu (devices.state, devices.attributes,
+        groups.members, rules.trigger) do tabel device_state, device_attributes, group_members
+        i kolumn wyzwalacza reguł. Wywoływane wewnątrz transakcji migracji.
+        """
+        if("state" in self._columns(conn, "devices")):
+            rows = conn.execute("SELECT id, state, attributes FROM devices;").fetchall()
+            state_rows, attribute_rows = [], []
+            for device_id, state_json, attributes_json in rows:
+                state = _load_json(state_json, {})
+                state_rows += [(device_id, key, *_encode_value(value)) for key, value in state.items()]
+                attribute_rows += [(device_id, key, position) for position, key in enumerate(_load_json(attributes_json, []))]
+            conn.executemany(UPSERT_DEVICE_STATE, state_rows)
+            conn.executemany("INSERT OR IGNORE INTO device_attributes (device_id, key, position) VALUES (?, ?, ?)", attribute_rows)
+            self._rebuild_table(conn, "devices")
+            logger.info(f"Migracja: przeniesiono stany {len(rows)} urządzeń do tabeli device_state.")
+
+        if("members" in self._columns(conn, "groups")):
+            rows = conn.execute("SELECT id, members FROM groups;").fetchall()
+            conn.executemany("INSERT OR IGNORE INTO group_members (group_id, device_id, position) VALUES (?, ?, ?)",
+                             [(group_id, device_id, position) for group_id, members_json in rows
+                              for position, device_id in enumerate(_load_json(members_json, []))])
+            self._rebuild_table(conn, "groups")
+            logger.info(f"Migracja: przeniesiono składy {len(rows)} grup do tabeli group_members.")
+
+        rule_columns = self._columns(conn, "rules")
+        if("trigger_type" not in rule_columns):
+            for column in ("trigger_type", "trigger_device_id", "trigger_key"):
+                if(column not in rule_columns):
+                    conn.execute(f"ALTER TABLE rules ADD COLUMN {column} TEXT;")
+            rows = conn.execute("SELECT id, trigger FROM rules;").fetchall()
+            conn.executemany("UPDATE rules SET trigger_type = ?, trigger_device_id = ?, trigger_key = ? WHERE id = ?",
+                             [(*_trigger_columns(_load_json(trigger_json, {})), rule_id) for rule_id, trigger_json in rows])
+
+    def _rebuild_table(self, conn: sqlite3.Connection, table: str):
+        """
+        Odtwarza tabelę według bieżącego SCHEMA, przenosząc wspólne kolumny i pomijając usunięte.
+        Zastępuje ALTER TABLE ... DROP COLUMN, którego nie ma w SQLite starszym niż 3.35
+        (np. 3.34 w Raspberry Pi OS Bullseye). Wywoływane wewnątrz transakcji migracji.
+        """
+        definition = next(statement for statement in SCHEMA if(f"CREATE TABLE IF NOT EXISTS {table} (" in statement))
+        conn.execute(definition.replace(f"CREATE TABLE IF NOT EXISTS {table} (", f"CREATE TABLE {table}_new ("))
+        kept = ", ".join(column for column in self._columns(conn, f"{table}_new") if(column in self._columns(conn, table)))
+        conn.execute(f"INSERT INTO {table}_new ({kept}) SELECT {kept} FROM {table};")
+        conn.execute(f"DROP TABLE {table};")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table};")
+
+    def _migrate_history_rollup(self, conn: sqlite3.Connection):
+        """
+        Dodaje kolumny średniej ważonej czasem do tabeli agregatów utworzonej przed wersją 4.
+        """
+        columns = self._columns(conn, "history_rollup")
+        for column in ("weighted_sum", "weighted_seconds"):
+            if(column not in columns):
+                conn.execute(f"ALTER TABLE history_rollup ADD COLUMN {column} REAL NOT NULL DEFAULT 0;")
 
     def get_all_devices_data(self) -> List[Dict[str, Any]]:
         """
-        Pobiera dane wszystkich urządzeń z bazy.
+        Pobiera dane wszystkich urządzeń z bazy, razem ze stanem i listą atrybutów.
         """
-        cursor = self._execute_query("SELECT * FROM devices;")
-        devices = []
-        for row in cursor.fetchall():
-            d = dict(row)
-            if(d.get('attributes')):
-                try:
-                    d['attributes'] = json.loads(d['attributes'])
-                except:
-                    d['attributes'] = []
-            else:
-                d['attributes'] = []
-            devices.append(d)
-        return devices
+        devices = {row["id"]: dict(row, state={}, attributes=[]) for row in self._execute_read("SELECT id, name, topic, type FROM devices;")}
+        for device_id, key, value, encoded in self._execute_read("SELECT device_id, key, value, encoded FROM device_state;"):
+            device = devices.get(device_id)
+            if(device is not None):
+                device["state"][key] = _decode_value(value, encoded)
+        for device_id, key in self._execute_read("SELECT device_id, key FROM device_attributes ORDER BY device_id, position;"):
+            device = devices.get(device_id)
+            if(device is not None):
+                device["attributes"].append(key)
+        return list(devices.values())
+
+    def get_device_state(self, device_id: str, keys: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Odczytuje stan urządzenia - cały lub tylko podane klucze.
+        """
+        query = "SELECT key, value, encoded FROM device_state WHERE device_id = ?"
+        params: tuple = (device_id,)
+        if(keys is not None):
+            query += f" AND key IN ({', '.join('?' * len(keys))})"
+            params += tuple(keys)
+        return {key: _decode_value(value, encoded) for key, value, encoded in self._execute_read(query, params)}
+
+    def find_devices_by_state(self, key: str, value: Any) -> List[str]:
+        """
+        Zwraca ID urządzeń, których atrybut 'key' ma wartość 'value' (filtrowanie po stronie SQL).
+        """
+        cursor = self._execute_read("SELECT device_id FROM device_state WHERE key = ? AND value = ? AND encoded = ?",
+                                    (key, *_encode_value(value)))
+        return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def _device_config_statements(device_data: Dict[str, Any], state: Dict[str, Any]) -> List[tuple]:
+        """
+        Zapytania zapisujące pełną konfigurację urządzenia: wiersz devices, cały stan i listę atrybutów.
+        """
+        device_id = device_data['id']
+        return [
+            (UPSERT_DEVICE, [(device_id, device_data['name'], device_data['topic'], device_data['type'])]),
+            ("DELETE FROM device_state WHERE device_id = ?", [(device_id,)]),
+            (UPSERT_DEVICE_STATE, [(device_id, key, *_encode_value(value)) for key, value in state.items()]),
+            ("DELETE FROM device_attributes WHERE device_id = ?", [(device_id,)]),
+            ("INSERT INTO device_attributes (device_id, key, position) VALUES (?, ?, ?)",
+             [(device_id, key, position) for position, key in enumerate(device_data.get('attributes', []))]),
+        ]
 
     def save_device_state(self, device_id: str, state: Dict[str, Any], save_config: bool = False, device_data: Optional[Dict] = None):
         """
-        Aktualizuje stan (state) urządzenia w bazie danych.
+        Zapisuje stan urządzenia. Bez save_config zapisywane są tylko klucze obecne w 'state'
+        (pozostałe wartości w bazie nie są zmieniane), z save_config - cała konfiguracja i pełny stan.
         """
-        state_json = json.dumps(state)
-        
         if(save_config and device_data):
-            attributes_json = json.dumps(device_data.get('attributes', []))
-            self._execute_query("""
-                INSERT OR REPLACE INTO devices (id, name, topic, type, state, attributes)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (device_data['id'], device_data['name'], device_data['topic'], device_data['type'], state_json, attributes_json))
+            self._execute_transaction(self._device_config_statements(device_data, state))
         else:
-            self._execute_query("UPDATE devices SET state = ? WHERE id = ?", (state_json, device_id))
+            self.save_device_states([(device_id, state)])
+
+    def save_device_states(self, states: List[tuple]):
+        """
+        Zapisuje zmienione klucze stanów wielu urządzeń w jednej transakcji.
+        Przyjmuje listę krotek (device_id, stan lub jego zmieniony fragment).
+        """
+        params = [(device_id, key, *_encode_value(value)) for device_id, state in states for key, value in state.items()]
+        if(not params):
+            return
+        self._execute_many(UPSERT_DEVICE_STATE, params)
+
+    def apply_device_sync(self, inserts: List[Dict[str, Any]], updates: List[tuple], removals: List[str]):
+        """
+        Zapisuje wynik synchronizacji urządzeń w jednej transakcji:
+        nowe urządzenia, zmiany metadanych (name, topic, type, id) i usunięcia (razem z członkostwem w grupach).
+        """
+        statements = []
+        for device_data in inserts:
+            statements += self._device_config_statements(device_data, device_data.get('state', {}))
+        statements.append(("UPDATE devices SET name = ?, topic = ?, type = ? WHERE id = ?", updates))
+        statements += self._device_removal_statements(removals)
+        self._execute_transaction(statements)
 
     def update_device_attributes(self, device_id: str, attributes: List[str]):
         """
-        Aktualizuje listę dostępnych atrybutów dla urządzenia.
+        Zapisuje listę dostępnych atrybutów urządzenia. Atrybuty tylko przybywają,
+        więc dopisywane są jedynie nowe wiersze.
         """
-        attr_json = json.dumps(attributes)
-        self._execute_query("UPDATE devices SET attributes = ? WHERE id = ?", (attr_json, device_id))
-    
+        self._execute_many("INSERT OR IGNORE INTO device_attributes (device_id, key, position) VALUES (?, ?, ?)",
+                           [(device_id, key, position) for position, key in enumerate(attributes)])
+
+    @staticmethod
+    def _device_removal_statements(device_ids: List[str]) -> List[tuple]:
+        params = [(device_id,) for device_id in device_ids]
+        return [
+            ("DELETE FROM devices WHERE id = ?", params),
+            ("DELETE FROM device_state WHERE device_id = ?", params),
+            ("DELETE FROM device_attributes WHERE device_id = ?", params),
+            ("DELETE FROM group_members WHERE device_id = ?", params),
+        ]
+
     def remove_device(self, device_id: str) -> bool:
         """
-        Usuwa urządzenie z bazy danych. Zwraca True, jeśli usunięto.
+        Usuwa urządzenie z bazy danych (wraz ze stanem i członkostwem w grupach). Zwraca True, jeśli usunięto.
         """
-        cursor = self._execute_query("DELETE FROM devices WHERE id = ?", (device_id,))
-        return cursor.rowcount > 0
+        return self._execute_transaction(self._device_removal_statements([device_id]))[0] > 0
 
     def get_all_groups(self) -> List[Dict[str, Any]]:
         """
         Pobiera dane wszystkich grup z bazy.
         """
-        cursor = self._execute_query("SELECT * FROM groups;")
-        groups = []
-        for row in cursor.fetchall():
-            g = dict(row)
-            g['members'] = json.loads(g['members'])
-            groups.append(g)
-        return groups
+        groups = {row["id"]: dict(row, members=[]) for row in self._execute_read("SELECT id, name FROM groups;")}
+        for group_id, device_id in self._execute_read("SELECT group_id, device_id FROM group_members ORDER BY group_id, position;"):
+            group = groups.get(group_id)
+            if(group is not None):
+                group["members"].append(device_id)
+        return list(groups.values())
 
     def add_group(self, group_id: str, name: str, members: List[str]):
         """
-        Dodaje nową grupę do bazy danych.
+        Dodaje grupę do bazy danych (lub nadpisuje istniejącą razem z jej składem).
+        """
+        self._execute_transaction([
+            ("INSERT INTO groups (id, name) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET name = excluded.name", [(group_id, name)]),
+            ("DELETE FROM group_members WHERE group_id = ?", [(group_id,)]),
+            ("INSERT INTO group_members (group_id, device_id, position) VALUES (?, ?, ?)",
+             [(group_id, device_id, position) for position, device_id in enumerate(members)]),
+        ])
+
+    def add_group_member(self, group_id: str, device_id: str):
+        """
+        Dopisuje urządzenie na koniec składu grupy.
         """
-        members_json = json.dumps(members)
         self._execute_query("""
-            INSERT OR REPLACE INTO groups (id, name, members)
-            VALUES (?, ?, ?)
-        """, (group_id, name, members_json))
+            INSERT OR IGNORE INTO group_members (group_id, device_id, position)
+            SELECT ?, ?, COALESCE(MAX(position), -1) + 1 FROM group_members WHERE group_id = ?
+        """, (group_id, device_id, group_id))
+
+    def remove_group_member(self, group_id: str, device_id: str) -> bool:
+        """
+        Usuwa urządzenie ze składu grupy. Zwraca True, jeśli usunięto.
+        """
+        cursor = self._execute_query("DELETE FROM group_members WHERE group_id = ? AND device_id = ?", (group_id, device_id))
+        return cursor.rowcount > 0
 
     def remove_group(self, group_id: str) -> bool:
         """
         Usuwa grupę z bazy danych. Zwraca True, jeśli usunięto.
         """
-        cursor = self._execute_query("DELETE FROM groups WHERE id = ?", (group_id,))
-        return cursor.rowcount > 0
+        return self._execute_transaction([
+            ("DELETE FROM groups WHERE id = ?", [(group_id,)]),
+            ("DELETE FROM group_members WHERE group_id = ?", [(group_id,)]),
+        ])[0] > 0
 
     def get_all_rules_data(self) -> List[Dict[str, Any]]:
         """
         Pobiera wszystkie reguły z bazy.
         """
-        cursor = self._execute_query("SELECT * FROM rules;")
+        return self._read_rules("SELECT id, name, active, trigger, action FROM rules;")
+
+    def get_rules_data_for_device(self, device_id: str) -> List[Dict[str, Any]]:
+        """
+        Pobiera reguły wyzwalane stanem podanego urządzenia (z indeksu na trigger_device_id).
+        """
+        return self._read_rules("SELECT id, name, active, trigger, action FROM rules WHERE trigger_device_id = ?;", (device_id,))
+
+    def _read_rules(self, query: str, params: tuple = ()) -> List[Dict[str, Any]]:
         rules = []
-        for row in cursor.fetchall():
+        for row in self._execute_read(query, params).fetchall():
             rule_dict = dict(row)
             rule_dict['trigger'] = json.loads(rule_dict['trigger'])
             rule_dict['action'] = json.loads(rule_dict['action'])
@@ -174,16 +611,36 @@ class DatabaseManager:
         active_int = 1 if rule.get('active', True) else 0
 
         self._execute_query("""
-            INSERT INTO rules (id, name, active, trigger, action)
-            VALUES (?, ?, ?, ?, ?)
-        """, (rule['id'], rule['name'], active_int, trigger_json, action_json))
+            INSERT INTO rules (id, name, active, trigger, action, trigger_type, trigger_device_id, trigger_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (rule['id'], rule['name'], active_int, trigger_json, action_json, *_trigger_columns(rule['trigger'])))
 
     def remove_rule(self, rule_id: str) -> bool:
         """
-        Usuwa regułę na podstawie ID i zwraca True, jeśli rekord został usunięty.
+        Usuwa regułę (razem z jej stanem wykonania) na podstawie ID i zwraca True, jeśli rekord został usunięty.
         """
-        cursor = self._execute_query("DELETE FROM rules WHERE id = ?", (rule_id,))
-        return cursor.rowcount > 0
+        return self._execute_transaction([
+            ("DELETE FROM rules WHERE id = ?", [(rule_id,)]),
+            ("DELETE FROM rule_states WHERE rule_id = ?", [(rule_id,)]),
+        ])[0] > 0
+
+    def get_rule_states(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Pobiera zapisane stany wykonania reguł: rule_id -> {last_triggered (sekundy unixowe lub None), is_active}.
+        """
+        cursor = self._execute_read("SELECT rule_id, last_triggered, is_active FROM rule_states;")
+        return {row["rule_id"]: {"last_triggered": row["last_triggered"], "is_active": bool(row["is_active"])} for row in cursor.fetchall()}
+
+    def save_rule_states(self, states: List[tuple]):
+        """
+        Zapisuje stany wykonania wielu reguł w jednej transakcji. Przyjmuje krotki (rule_id, last_triggered, is_active).
+        """
+        if(not states):
+            return
+        self._execute_many("""
+            INSERT INTO rule_states (rule_id, last_triggered, is_active) VALUES (?, ?, ?)
+            ON CONFLICT (rule_id) DO UPDATE SET last_triggered = excluded.last_triggered, is_active = excluded.is_active
+        """, [(rule_id, last_triggered, 1 if is_active else 0) for rule_id, last_triggered, is_active in states])
     
     def update_device_metadata(self, device_id: str, name: str, topic: str, dev_type: str):
         """
@@ -193,4 +650,89 @@ class DatabaseManager:
             UPDATE devices 
             SET name = ?, topic = ?, type = ? 
             WHERE id = ?
-        """, (name, topic, dev_type, device_id))
\ No newline at end of file
+        """, (name, topic, dev_type, device_id))
+
+    # --- Historia odczytów ---
+
+    def get_history_series(self) -> Dict[tuple, int]:
+        """
+        Zwraca ID serii historii: (device_id, key) -> id.
+        """
+        return {(row["device_id"], row["key"]): row["id"] for row in self._execute_read("SELECT id, device_id, key FROM history_series;")}
+
+    def save_history(self, raw_rows: List[tuple], rollups: List[tuple], series_ids: Dict[tuple, int]) -> Dict[tuple, int]:
+        """
+        Zapisuje w jednej transakcji odczyty (device_id, key, ts, value) i przyrosty agregatów
+        (device_id, key, resolution, bucket, samples, value_sum, value_min, value_max, weighted_sum, weighted_seconds).
+        Serie spoza 'series_ids' są tworzone w tej samej transakcji; zwracane są ID nowo utworzonych serii.
+        """
+        conn = self._get_connection()
+        created = {}
+
+        def series_id(device_id: str, key: str) -> int:
+            found = series_ids.get((device_id, key)) or created.get((device_id, key))
+            if(found is None):
+                conn.execute("INSERT OR IGNORE INTO history_series (device_id, key) VALUES (?, ?)", (device_id, key))
+                found = conn.execute("SELECT id FROM history_series WHERE device_id = ? AND key = ?", (device_id, key)).fetchone()[0]
+                created[(device_id, key)] = found
+            return found
+
+        with self._write_lock:
+            try:
+                conn.executemany("INSERT OR REPLACE INTO history_raw (series_id, ts, value) VALUES (?, ?, ?)",
+                                 [(series_id(device_id, key), ts, value) for device_id, key, ts, value in raw_rows])
+                conn.executemany(UPSERT_HISTORY_ROLLUP, [(series_id(device_id, key), *rest) for device_id, key, *rest in rollups])
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.error(f"Błąd zapisu historii ({len(raw_rows)} odczytów, {len(rollups)} agregatów). Błąd: {e}")
+                raise
+        return created
+
+    def prune_history(self, series_ids: List[int], raw_cutoff_ms: Optional[int], rollup_cutoffs: Dict[int, int]) -> int:
+        """
+        Usuwa odczyty starsze niż 'raw_cutoff_ms' i agregaty starsze niż próg danej rozdzielczości
+        (rozdzielczość w sekundach -> najstarszy zachowany przedział). Zwraca liczbę usuniętych wierszy.
+        """
+        statements = []
+        if(raw_cutoff_ms is not None):
+            statements.append(("DELETE FROM history_raw WHERE series_id = ? AND ts < ?",
+                               [(series_id, raw_cutoff_ms) for series_id in series_ids]))
+        for resolution, cutoff in rollup_cutoffs.items():
+            statements.append(("DELETE FROM history_rollup WHERE series_id = ? AND resolution = ? AND bucket < ?",
+                               [(series_id, resolution, cutoff) for series_id in series_ids]))
+        if(not statements or not series_ids):
+            return 0
+        rowcounts = self._execute_transaction(statements)
+        return sum(count for count in rowcounts if(count > 0))
+
+    def get_history_raw(self, series_id: int, start_ms: int, end_ms: int) -> List[tuple]:
+        cursor = self._execute_read("SELECT ts, value FROM history_raw WHERE series_id = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+                                    (series_id, start_ms, end_ms))
+        return [tuple(row) for row in cursor.fetchall()]
+
+    def get_history_rollups(self, series_id: int, resolution: int, start: int, end: int) -> List[tuple]:
+        """
+        Zwraca agregaty (bucket, samples, value_sum, value_min, value_max, weighted_sum, weighted_seconds) z zakresu przedziałów.
+        """
+        cursor = self._execute_read(
+            """
+            SELECT bucket, samples, value_sum, value_min, value_max, weighted_sum, weighted_seconds FROM history_rollup
+            WHERE series_id = ? AND resolution = ? AND bucket BETWEEN ? AND ? ORDER BY bucket
+            """,
+            (series_id, resolution, start, end))
+        return [tuple(row) for row in cursor.fetchall()]
+
+    def close(self):
+        """
+        Zamyka wszystkie otwarte połączenia z bazą danych.
+        """
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.error(f"Błąd zamykania połączenia z bazą danych: {e}")
+            self._connections.clear()
+            self._shared_connection = None
+        self._local = threading.local()
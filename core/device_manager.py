@@ -1,10 +1,15 @@
+import asyncio
 import logging
-import os 
 import json
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from .devices_types import LightDevice, SocketDevice, SensorDevice, BaseDevice 
 from .database import DatabaseManager
+from .async_runtime import LoopEvent
+from .device_state import KEY_TABLE
+from .group_executor import GroupExecutor
+from .command_tracker import CommandTracker, PendingCommand
 import config 
 
 logger = logging.getLogger(__name__)
@@ -15,84 +20,245 @@ DEVICE_TYPE_MAPPING = {
     "sensor": SensorDevice
 }
 
+# Klucze diagnostyczne Zigbee2MQTT, które nie są atrybutami urządzenia.
+IGNORED_ATTRIBUTE_KEYS = frozenset({"linkquality", "last_seen", "update", "update_available"})
+VOLATILE_STATE_KEYS = frozenset(config.VOLATILE_STATE_KEYS)
+
 class DeviceManager:
     """
     Zarządza listą urządzeń, ich stanami, oraz obsługuje ich wczytywanie/zapisywanie.
     """
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: DatabaseManager, write_behind: bool = config.DB_WRITE_BEHIND):
         self.devices: dict[str, BaseDevice] = {}
-        self.device_attributes: dict[str, list] = {}
+        # Nazwy atrybutów są internowane we wspólnej tablicy KEY_TABLE.
+        self.device_attributes: dict[str, tuple[str, ...]] = {}
         self.groups: dict[str, dict] = {}
+        self._topic_index: dict[str, BaseDevice] = {}
         self._lock = threading.Lock()
         self.db_manager = db_manager
+        self.write_behind = write_behind
+        # device_id -> klucze stanu zmienione od ostatniego zapisu.
+        self._dirty_devices: dict[str, set[str]] = {}
+        self._flush_lock = threading.Lock()
+        self._flush_thread = None
+        self._flush_wake = threading.Event()
+        self._async_flush_wake: LoopEvent = None
+        # Tryb asyncio: jeden wątek wykonujący zapisy do bazy zlecone z pętli zdarzeń (zob. start_db_writer).
+        self._db_writer: ThreadPoolExecutor | None = None
+        self.group_executor = GroupExecutor(self)
+        # Komendy oczekujące na potwierdzenie w raporcie stanu urządzenia.
+        self.commands = CommandTracker()
+        self._stop_event = threading.Event()
+        self._event_lock = threading.Lock()
+        self._listeners: list = []
+        self._seq = 0
+        self._groups_version = 0
+        self._devices_json_cache: tuple[int, bytes] | None = None
+        self._groups_json_cache: tuple[int, bytes] | None = None
         self.load_from_db()
 
+    def add_listener(self, listener):
+        """
+        Rejestruje funkcję wywoływaną dla każdej zmiany (stan, dodanie, usunięcie urządzenia).
+        Funkcja jest wywoływana w wątku, który wprowadził zmianę, więc musi być szybka.
+        """
+        with self._event_lock:
+            self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        with self._event_lock:
+            self._listeners = [l for l in self._listeners if l is not listener]
+
+    def _emit(self, event_type: str, **data):
+        """
+        Nadaje zdarzeniu kolejny numer sekwencyjny i przekazuje je słuchaczom.
+        Nie może być wywoływane pod blokadą self._lock.
+        """
+        with self._event_lock:
+            self._seq += 1
+            if(not self._listeners):
+                return
+            event = {"seq": self._seq, "type": event_type, **data}
+            for listener in self._listeners:
+                try:
+                    listener(event)
+                except Exception as e:
+                    logger.error(f"Błąd słuchacza zdarzeń urządzeń: {e}")
+
+    def get_snapshot(self) -> tuple[int, list[dict]]:
+        """
+        Zwraca spójną parę (numer sekwencyjny, dane urządzeń). Zdarzenia o numerze
+        większym od zwróconego opisują zmiany, których migawka jeszcze nie zawiera.
+        """
+        with self._event_lock:
+            return self._seq, self.get_devices_data()
+
+    @property
+    def version(self) -> int:
+        """
+        Wersja listy urządzeń - rośnie przy każdej zmianie stanu lub konfiguracji urządzenia.
+        """
+        return self._seq
+
+    def get_devices_json(self) -> tuple[int, bytes]:
+        """
+        Zwraca (wersja, zserializowana odpowiedź /devices). Treść jest budowana
+        ponownie tylko wtedy, gdy od ostatniego wywołania zmieniła się wersja.
+        """
+        cached = self._devices_json_cache
+        if(cached and cached[0] == self._seq):
+            return cached
+        with self._event_lock:
+            cached = (self._seq, json.dumps({"devices": self.get_devices_data()}).encode("utf-8"))
+        self._devices_json_cache = cached
+        return cached
+
+    def get_groups_json(self) -> tuple[int, bytes]:
+        """
+        Zwraca (wersja, zserializowana odpowiedź /groups), budowaną ponownie tylko po zmianie grup.
+        """
+        cached = self._groups_json_cache
+        if(cached and cached[0] == self._groups_version):
+            return cached
+        with self._lock:
+            cached = (self._groups_version, json.dumps({"groups": list(self.groups.values())}).encode("utf-8"))
+        self._groups_json_cache = cached
+        return cached
+
+    def _device_data(self, device: BaseDevice) -> dict:
+        return {
+            "id": device.device_id,
+            "name": device.name,
+            "type": device.__class__.__name__.replace("Device", "").lower(),
+            "topic": device.topic,
+            "state": dict(device.state),
+            "available_keys": list(self.device_attributes.get(device.device_id, ()))
+        }
+
     def add_device(self, device: BaseDevice):
         with self._lock:
             if(device.device_id in self.devices):
                 logger.warning(f"Urządzenie o ID {device.device_id} już istnieje. Pominięto dodanie.")
                 return
             self.devices[device.device_id] = device
-            self.device_attributes[device.device_id] = []
+            self.device_attributes[device.device_id] = ()
+            self._index_topic(device)
         
         logger.info(f"Dodano urządzenie: {device.name} (ID: {device.device_id})")
         self.save_device_to_db(device, save_config=True)
+        self._emit("device_added", device=self._device_data(device))
 
     def remove_device(self, device_id: str) -> bool:
         """
         Usuwa urządzenie z pamięci, bazy danych ORAZ ze wszystkich grup.
         """
         db_success = self.db_manager.remove_device(device_id)
+        removed = db_success
         with self._lock:
             if(device_id in self.devices):
+                self._unindex_topic(self.devices[device_id])
                 del self.devices[device_id]
                 self.device_attributes.pop(device_id, None)
+                removed = True
+            self._dirty_devices.pop(device_id, None)
+            # Członkostwo w grupach zostało usunięte z bazy razem z urządzeniem.
             for group in self.groups.values():
                 if(device_id in group['members']):
                     group['members'].remove(device_id)
-                    self.db_manager.add_group(group['id'], group['name'], group['members'])
+                    self._groups_version += 1
+                    removed = True
                     logger.info(f"Usunięto sierotę {device_id} z grupy {group['id']}")
+        # Zdarzenie (i nowy numer sekwencji) tylko wtedy, gdy coś faktycznie zniknęło.
+        if(removed):
+            self._emit("device_removed", device_id=device_id)
         if(db_success):
             logger.info(f"Usunięto urządzenie: {device_id}")
             return True
         return False
 
-    def get_device_by_topic(self, topic: str) -> BaseDevice | None:
+    def _index_topic(self, device: BaseDevice):
+        """
+        Rejestruje topic urządzenia w indeksie. Wywoływane pod blokadą.
+        """
+        self._topic_index[device.topic] = device
+
+    def _unindex_topic(self, device: BaseDevice):
+        """
+        Usuwa topic urządzenia z indeksu, o ile wskazuje on na to urządzenie. Wywoływane pod blokadą.
+        """
+        if(self._topic_index.get(device.topic) is device):
+            del self._topic_index[device.topic]
+
+    def get_device(self, device_id: str) -> BaseDevice | None:
+        return self.devices.get(device_id)
+
+    def get_device_ids(self) -> list[str]:
         with self._lock:
-            for device in self.devices.values():
-                if(topic == device.topic or topic.startswith(device.topic + "/")): 
-                    return device
-        return None
+            return list(self.devices)
 
-    def update_device(self, topic: str, payload: dict):
-        device = self.get_device_by_topic(topic)
+    def get_device_by_topic(self, topic: str) -> BaseDevice | None:
+        """
+        Zwraca urządzenie dla topicu lub jego podtopicu (np. '<topic>/availability').
+        Wyszukiwanie po słowniku, kolejno dla coraz krótszych prefiksów topicu,
+        więc koszt zależy od głębokości topicu, a nie od liczby urządzeń.
+        """
+        index = self._topic_index
+        device = index.get(topic)
         if(device):
-            device.update_state(payload)
-            self.save_device_to_db(device, save_config=False)
-            self._update_known_attributes(device.device_id, payload)
-        else:
+            return device
+        end = topic.rfind("/")
+        while(end > 0):
+            device = index.get(topic[:end])
+            if(device):
+                return device
+            end = topic.rfind("/", 0, end)
+        return None
+
+    def update_device(self, topic: str, payload: dict, device: BaseDevice | None = None) -> list[str]:
+        """
+        Aktualizuje stan urządzenia. Jeśli wywołujący już rozwiązał urządzenie
+        (np. router wiadomości), może je przekazać, aby uniknąć ponownego wyszukiwania.
+        Zwraca zmienione klucze stanu z pominięciem kluczy ulotnych (VOLATILE_STATE_KEYS) -
+        tylko te są zapisywane do bazy; pusta lista oznacza, że nic istotnego się nie zmieniło.
+        """
+        if(device is None):
+            device = self.get_device_by_topic(topic)
+        if(not device):
             logger.debug(f"Pominięto aktualizację: Nie znaleziono urządzenia dla topicu: {topic}")
+            return []
+        self.commands.on_report(device.device_id, payload)
+        changed = device.update_state(payload)
+        if(not changed):
+            return []
+        relevant = [key for key in changed if(key not in VOLATILE_STATE_KEYS)]
+        if(relevant):
+            self.save_device_to_db(device, save_config=False, keys=relevant)
+            self._update_known_attributes(device.device_id, relevant)
+        state = device.state
+        self._emit("state", device_id=device.device_id, state={key: state[key] for key in changed})
+        return relevant
 
-    def _update_known_attributes(self, device_id: str, payload: dict):
+    def _update_known_attributes(self, device_id: str, keys):
         """
-        Sprawdza, czy w payloadzie są nowe klucze i zapisuje je w bazie.
+        Sprawdza, czy wśród zmienionych kluczy są nowe atrybuty i zapisuje je w bazie.
         """
+        updated_attrs = None
         with self._lock:
-            current_attrs = set(self.device_attributes.get(device_id, []))
-            new_keys = set(payload.keys())
-            
-            ignored_keys = {"linkquality", "last_seen", "update", "update_available"}
-            new_keys = new_keys - ignored_keys
-
-            if(not new_keys.issubset(current_attrs)):
-                updated_attrs = list(current_attrs.union(new_keys))
-                self.device_attributes[device_id] = updated_attrs
-                self.db_manager.update_device_attributes(device_id, updated_attrs)
-                logger.info(f"Zaktualizowano atrybuty dla {device_id}: {updated_attrs}")
+            current_attrs = self.device_attributes.get(device_id, ())
+            new_keys = [key for key in keys if(key not in IGNORED_ATTRIBUTE_KEYS and key not in current_attrs)]
+            if(new_keys):
+                attrs = current_attrs + tuple(KEY_TABLE.intern(key) for key in new_keys)
+                self.device_attributes[device_id] = attrs
+                updated_attrs = list(attrs)
+        if(updated_attrs is not None):
+            self._write_db(self.db_manager.update_device_attributes, device_id, updated_attrs)
+            logger.info(f"Zaktualizowano atrybuty dla {device_id}: {updated_attrs}")
+            self._emit("device_attributes", device_id=device_id, available_keys=updated_attrs)
 
     def create_group(self, group_id: str, name: str, members: list[str]):
         with self._lock:
             self.groups[group_id] = {"id": group_id, "name": name, "members": members}
+            self._groups_version += 1
         self.db_manager.add_group(group_id, name, members)
         logger.info(f"Utworzono grupę: {name} ({group_id}) z członkami: {members}")
 
@@ -101,9 +267,14 @@ class DeviceManager:
         with self._lock:
             if(group_id in self.groups):
                 del self.groups[group_id]
+                self._groups_version += 1
                 logger.info(f"Usunięto grupę: {group_id}")
-                return True
-        return success
+                deleted = True
+            else:
+                deleted = success
+        if(deleted):
+            self.group_executor.forget(group_id)
+        return deleted
 
     def get_groups(self) -> list[dict]:
         with self._lock:
@@ -117,24 +288,34 @@ class DeviceManager:
             group = self.groups.get(target_id)
         
         if(group):
-            logger.info(f"Wykonywanie akcji grupowej na {target_id}...")
-            members = group.get("members", [])
-            for member_id in members:
-                self.perform_action(mqtt_client, member_id, action, value)
-            return True
+            return self.group_executor.execute(mqtt_client, target_id, action, value)
         with self._lock:
             device = self.devices.get(target_id)
 
         if(device):
-            device.perform_action(mqtt_client, action, value)
+            self.send_command(mqtt_client, device, action, value)
             return True
 
+    def send_command(self, mqtt_client, device: BaseDevice, action: str, value=None) -> PendingCommand | None:
+        """
+        Wysyła komendę do urządzenia i rejestruje ją w śledzeniu potwierdzeń (przed publikacją,
+        aby nie przegapić szybkiej odpowiedzi). Zwraca None, jeśli akcja jest nieobsługiwana.
+        """
+        payload = device.build_action_payload(action, value)
+        if(payload is None):
+            return None
+        command = self.commands.track(device.device_id, f"{device.topic}/set", payload,
+                                      lambda: device.publish_command(mqtt_client, payload, action))
+        device.publish_command(mqtt_client, payload, action)
+        return command
+
     def load_from_db(self):
         devices_data = self.db_manager.get_all_devices_data()
         
         with self._lock:
             self.devices.clear()
             self.device_attributes.clear()
+            self._topic_index.clear()
             for d in devices_data:
                 dtype = d.get("type")
                 device_class = DEVICE_TYPE_MAPPING.get(dtype)
@@ -143,9 +324,10 @@ class DeviceManager:
                     try:
                         device = device_class(device_id=d["id"], name=d["name"], topic=d["topic"])
                         if(d.get("state")):
-                            device.update_state(json.loads(d["state"]))
+                            device.update_state(d["state"])
                         self.devices[device.device_id] = device
-                        self.device_attributes[device.device_id] = d.get("attributes", [])
+                        self.device_attributes[device.device_id] = tuple(KEY_TABLE.intern(key) for key in d.get("attributes", []))
+                        self._index_topic(device)
                     except Exception as e:
                         logger.error(f"Błąd inicjalizacji urządzenia {d.get('id')}: {e}")
 
@@ -154,32 +336,201 @@ class DeviceManager:
             self.groups.clear()
             for g in groups_data:
                 self.groups[g['id']] = g
+            self._groups_version += 1
+        with self._event_lock:
+            self._seq += 1
 
         logger.info(f"Wczytano {len(self.devices)} urządzeń i {len(self.groups)} grup.")
 
-    def save_device_to_db(self, device: BaseDevice, save_config: bool = False):
-        device_data = {
+    def save_device_to_db(self, device: BaseDevice, save_config: bool = False, keys=None):
+        """
+        Zapisuje urządzenie do bazy. Bez save_config zapisywane są tylko klucze stanu z 'keys'
+        (domyślnie cały stan). W trybie write-behind klucze są jedynie oznaczane jako zmienione
+        i trafiają do bazy przy najbliższym zrzucie (flush_states).
+        """
+        if(save_config):
+            self.db_manager.save_device_state(device.device_id, dict(device.state), save_config=True, device_data=self._device_row(device))
+            return
+        keys = set(device.state) if keys is None else set(keys)
+        if(self.write_behind):
+            with self._lock:
+                self._dirty_devices.setdefault(device.device_id, set()).update(keys)
+                dirty_count = len(self._dirty_devices)
+            if(dirty_count >= config.DB_FLUSH_MAX_DIRTY):
+                self._request_flush()
+            return
+        state = device.state
+        self._write_db(self.db_manager.save_device_state, device.device_id, {key: state[key] for key in keys if(key in state)})
+
+    def _device_row(self, device: BaseDevice) -> dict:
+        return {
             "id": device.device_id,
             "name": device.name,
             "topic": device.topic,
             "type": device.__class__.__name__.replace("Device", "").lower(),
-            "attributes": self.device_attributes.get(device.device_id, [])
+            "attributes": list(self.device_attributes.get(device.device_id, ())),
+            "state": dict(device.state),
         }
-        self.db_manager.save_device_state(device.device_id, device.state, save_config=save_config, device_data=device_data)
+
+    def apply_device_sync(self, devices: list[BaseDevice], removed_ids: list[str] = ()) -> dict:
+        """
+        Stosuje wynik synchronizacji z Zigbee2MQTT: dodaje lub aktualizuje 'devices' i usuwa 'removed_ids'
+        (również z grup). Wszystkie zmiany trafiają do bazy w jednej transakcji.
+        Zwraca liczbę dodanych, zaktualizowanych i usuniętych urządzeń.
+        """
+        events = []
+        inserts, updates, removed = [], [], []
+        with self._lock:
+            for new_device in devices:
+                existing_device = self.devices.get(new_device.device_id)
+                if(not existing_device):
+                    self.devices[new_device.device_id] = new_device
+                    self.device_attributes[new_device.device_id] = ()
+                    self._index_topic(new_device)
+                    inserts.append(self._device_row(new_device))
+                    events.append(("device_added", {"device": self._device_data(new_device)}))
+                    logger.info(f"Dodano nowe urządzenie: {new_device.name}")
+                    continue
+                device_data = self._update_existing_device(existing_device, new_device, persist=False)
+                if(device_data):
+                    updates.append((device_data["name"], device_data["topic"], device_data["type"], device_data["id"]))
+                    events.append(("device_updated", {"device": device_data}))
+            for device_id in removed_ids:
+                device = self.devices.pop(device_id, None)
+                if(device is None):
+                    continue
+                self._unindex_topic(device)
+                self.device_attributes.pop(device_id, None)
+                self._dirty_devices.pop(device_id, None)
+                for group in self.groups.values():
+                    if(device_id in group['members']):
+                        group['members'].remove(device_id)
+                        self._groups_version += 1
+                removed.append(device_id)
+                events.append(("device_removed", {"device_id": device_id}))
+                logger.info(f"Usunięto urządzenie nieobecne w Zigbee2MQTT: {device.name} ({device_id})")
+        if(inserts or updates or removed):
+            self._write_db(self.db_manager.apply_device_sync, inserts, updates, removed)
+        for event_type, data in events:
+            self._emit(event_type, **data)
+        return {"added": len(inserts), "updated": len(updates), "removed": len(removed)}
+
+    def start_db_writer(self):
+        """
+        Tryb asyncio: zapisy wywoływane przy obsłudze wiadomości (stan bez write-behind, nowe atrybuty,
+        synchronizacja urządzeń) trafiają do jednego wątku zapisu zamiast blokować pętlę zdarzeń.
+        Jeden wątek zachowuje kolejność zapisów.
+        """
+        if(self._db_writer is None):
+            self._db_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+    def stop_db_writer(self):
+        """
+        Czeka na wykonanie zleconych zapisów; kolejne zapisy wykonywane są od razu w wątku wywołującym.
+        """
+        writer, self._db_writer = self._db_writer, None
+        if(writer):
+            writer.shutdown(wait=True)
+
+    def _write_db(self, method, *args):
+        writer = self._db_writer
+        if(writer is None):
+            method(*args)
+            return
+        writer.submit(self._run_db_write, method, args)
+
+    @staticmethod
+    def _run_db_write(method, args):
+        try:
+            method(*args)
+        except Exception as e:
+            logger.error(f"Błąd zapisu do bazy ({method.__name__}): {e}")
+
+    def _request_flush(self):
+        """
+        Budzi wątek (lub zadanie asyncio) zapisu. Bez żadnego z nich zapis wykonywany jest od razu.
+        """
+        if(self._async_flush_wake):
+            self._async_flush_wake.set()
+        elif(self._flush_thread and self._flush_thread.is_alive()):
+            self._flush_wake.set()
+        else:
+            self.flush_states()
+
+    def flush_states(self) -> int:
+        """
+        Zapisuje stany wszystkich zmienionych urządzeń w jednej transakcji.
+        Zwraca liczbę zapisanych urządzeń.
+        """
+        with self._flush_lock:
+            with self._lock:
+                dirty = self._dirty_devices
+                self._dirty_devices = {}
+                states = []
+                for device_id, keys in dirty.items():
+                    device = self.devices.get(device_id)
+                    if(device is not None):
+                        state = device.state
+                        states.append((device_id, {key: state[key] for key in keys if(key in state)}))
+            if(not states):
+                return 0
+            try:
+                self.db_manager.save_device_states(states)
+            except Exception as e:
+                logger.error(f"Błąd zbiorczego zapisu stanów ({len(states)} urządzeń): {e}")
+                with self._lock:
+                    for device_id, state in states:
+                        self._dirty_devices.setdefault(device_id, set()).update(state)
+                return 0
+        logger.debug(f"Zapisano zbiorczo stany {len(states)} urządzeń.")
+        return len(states)
+
+    def start_flush_loop(self):
+        if(not self.write_behind or (self._flush_thread and self._flush_thread.is_alive())):
+            return
+        self._stop_event.clear()
+        self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+        logger.info(f"Uruchomiono wątek zapisu stanów (co {config.DB_FLUSH_INTERVAL_SECONDS}s).")
+
+    def stop_flush_loop(self):
+        """
+        Zatrzymuje wątek zapisu i zrzuca do bazy wszystkie oczekujące stany.
+        """
+        self._stop_event.set()
+        self._flush_wake.set()
+        if(self._flush_thread and self._flush_thread.is_alive()):
+            self._flush_thread.join(timeout=5)
+            logger.info("Zatrzymano wątek zapisu stanów.")
+        self.stop_db_writer()
+        self.flush_states()
+
+    def _flush_loop(self):
+        while(not self._stop_event.is_set()):
+            self._flush_wake.wait(config.DB_FLUSH_INTERVAL_SECONDS)
+            self._flush_wake.clear()
+            self.flush_states()
+
+    async def run_flush_loop_async(self):
+        """
+        Odpowiednik wątku zapisu dla trybu asyncio. Sam zapis do SQLite wykonywany jest w wątku zapisu
+        (start_db_writer) lub w puli wątków, aby nie blokować pętli zdarzeń.
+        """
+        if(not self.write_behind):
+            return
+        loop = asyncio.get_running_loop()
+        self._async_flush_wake = LoopEvent(loop)
+        logger.info(f"Uruchomiono zadanie zapisu stanów (co {config.DB_FLUSH_INTERVAL_SECONDS}s, tryb asyncio).")
+        try:
+            while(True):
+                await self._async_flush_wake.wait(config.DB_FLUSH_INTERVAL_SECONDS)
+                await loop.run_in_executor(self._db_writer, self.flush_states)
+        finally:
+            self._async_flush_wake = None
 
     def get_devices_data(self) -> list[dict]:
-        data = []
-        with self._lock:
-            for device in self.devices.values():
-                data.append({
-                    "id": device.device_id,
-                    "name": device.name,
-                    "type": device.__class__.__name__.replace("Device", "").lower(),
-                    "topic": device.topic,
-                    "state": device.state,
-                    "available_keys": self.device_attributes.get(device.device_id, [])
-                })
-        return data
+        with self._lock:
+            return [self._device_data(device) for device in self.devices.values()]
     
     def add_device_to_group(self, group_id: str, device_id: str) -> bool:
         """
@@ -192,8 +543,9 @@ class DeviceManager:
                 return False
             if(device_id not in group['members']):
                 group['members'].append(device_id)
+                self._groups_version += 1
                 logger.info(f"Dodano urządzenie {device_id} do grupy {group_id}")
-                self.db_manager.add_group(group['id'], group['name'], group['members'])
+                self.db_manager.add_group_member(group_id, device_id)
                 return True
             return True
 
@@ -206,8 +558,9 @@ class DeviceManager:
             if(not group): return False
             if(device_id in group['members']):
                 group['members'].remove(device_id)
+                self._groups_version += 1
                 logger.info(f"Usunięto urządzenie {device_id} z grupy {group_id}")
-                self.db_manager.add_group(group['id'], group['name'], group['members'])
+                self.db_manager.remove_group_member(group_id, device_id)
                 return True
             return False
         
@@ -220,24 +573,41 @@ class DeviceManager:
             
             if(not existing_device):
                 self.devices[new_device.device_id] = new_device
-                self.device_attributes[new_device.device_id] = []
+                self.device_attributes[new_device.device_id] = ()
+                self._index_topic(new_device)
                 self.save_device_to_db(new_device, save_config=True)
                 logger.info(f"Dodano nowe urządzenie: {new_device.name}")
-                return
-            needs_update = False
-            
-            if(type(existing_device) != type(new_device)):
-                logger.info(f"Zmiana typu urządzenia {new_device.name}: {type(existing_device).__name__} -> {type(new_device).__name__}")
-                new_device.state = existing_device.state
-                self.devices[new_device.device_id] = new_device
-                needs_update = True
+                device_data = self._device_data(new_device)
+            else:
+                device_data = self._update_existing_device(existing_device, new_device)
+        if(device_data):
+            self._emit("device_added" if(not existing_device) else "device_updated", device=device_data)
+
+    def _update_existing_device(self, existing_device: BaseDevice, new_device: BaseDevice, persist: bool = True) -> dict | None:
+        """
+        Aktualizuje typ, nazwę i topic istniejącego urządzenia. Wywoływane pod blokadą.
+        Zwraca dane urządzenia, jeśli coś się zmieniło. Przy persist=False zapis do bazy wykonuje wywołujący.
+        """
+        needs_update = False
+        self._unindex_topic(existing_device)
+        
+        if(type(existing_device) != type(new_device)):
+            logger.info(f"Zmiana typu urządzenia {new_device.name}: {type(existing_device).__name__} -> {type(new_device).__name__}")
+            new_device.state = existing_device.state
+            self.devices[new_device.device_id] = new_device
+            needs_update = True
+        
+        if(existing_device.name != new_device.name or existing_device.topic != new_device.topic):
+            existing_device.name = new_device.name
+            existing_device.topic = new_device.topic
+            needs_update = True
+
+        self._index_topic(self.devices[new_device.device_id])
             
-            if(existing_device.name != new_device.name or existing_device.topic != new_device.topic):
-                existing_device.name = new_device.name
-                existing_device.topic = new_device.topic
-                needs_update = True
-                
-            if(needs_update):
+        if(needs_update):
+            if(persist):
                 dev_type_str = new_device.__class__.__name__.replace("Device", "").lower()
                 self.db_manager.update_device_metadata(new_device.device_id, new_device.name, new_device.topic, dev_type_str)
-                logger.info(f"Zaktualizowano metadane urządzenia: {new_device.name}")
\ No newline at end of file
+            logger.info(f"Zaktualizowano metadane urządzenia: {new_device.name}")
+            return self._device_data(self.devices[new_device.device_id])
+        return None
\ No newline at end of file
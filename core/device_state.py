@@ -0,0 +1,189 @@
+import sys
+import threading
+from array import array
+from collections.abc import MutableMapping
+from typing import Any, Iterator
+
+# Atrybuty liczbowe raportowane przez większość urządzeń Zigbee. Każdy ma stały indeks,
+# a wartości przechowywane są w tablicy liczb stanu zamiast we wpisach słownika.
+NUMERIC_KEYS = (
+    "brightness", "color_temp", "power", "voltage", "current", "energy",
+    "temperature", "humidity", "pressure", "illuminance", "battery", "linkquality",
+)
+
+class KeyTable:
+    """
+    Wspólna dla wszystkich urządzeń tablica nazw atrybutów. Każda nazwa jest internowana,
+    więc tysiące urządzeń raportujących np. 'state' przechowują referencję do jednego obiektu str.
+    """
+    def __init__(self, numeric_keys: tuple = NUMERIC_KEYS):
+        self.numeric_keys = tuple(sys.intern(key) for key in numeric_keys)
+        self.numeric_index = {key: index for index, key in enumerate(self.numeric_keys)}
+        self._keys: dict[str, str] = {key: key for key in self.numeric_keys}
+        self._lock = threading.Lock()
+
+    def intern(self, key: str) -> str:
+        interned = self._keys.get(key)
+        if(interned is None):
+            with self._lock:
+                interned = self._keys.setdefault(key, sys.intern(key))
+        return interned
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+KEY_TABLE = KeyTable()
+
+# Pula blokad współdzielona przez wszystkie stany, wybierana według id(obiektu). Osobna blokada
+# na instancję kosztowałaby kilkadziesiąt bajtów na urządzenie; RLock chroni przed zakleszczeniem,
+# gdy ten sam wątek dotyka dwóch stanów trafiających do jednej blokady.
+LOCK_STRIPES = 64
+_STATE_LOCKS = tuple(threading.RLock() for _ in range(LOCK_STRIPES))
+
+def _rank(mask: int, index: int) -> int:
+    """
+    Pozycja wartości w tablicy liczb: liczba obecnych atrybutów liczbowych o niższym indeksie.
+    """
+    return bin(mask & ((1 << index) - 1)).count("1")
+
+class DeviceState(MutableMapping):
+    """
+    Zwarty stan urządzenia o interfejsie słownika. Znane atrybuty liczbowe (NUMERIC_KEYS) trafiają
+    do tablicy array('d'), uporządkowane według stałego indeksu klucza; maski bitowe zapisują,
+    które z nich są obecne i które były liczbami całkowitymi. Pozostałe wartości trzymane są
+    w płaskiej liście [klucz, wartość, ...] z internowanymi kluczami - urządzenia mają ich zwykle
+    kilka, więc lista jest mniejsza od słownika, a wyszukiwanie liniowe nie ma znaczenia.
+    Stan jest czytany przez API i wątki reguł w trakcie zapisu z wątków MQTT, a zmiana wartości liczbowej
+    to kilka kroków (tablica i obie maski), więc każdy dostęp odbywa się pod blokadą z puli _STATE_LOCKS.
+    """
+    __slots__ = ("_numbers", "_present", "_ints", "_other")
+
+    def __init__(self, initial: dict | None = None):
+        self._numbers: array | None = None
+        self._present = 0
+        self._ints = 0
+        self._other: list | None = None
+        if(initial):
+            self.update(initial)
+
+    @property
+    def _lock(self):
+        return _STATE_LOCKS[id(self) % LOCK_STRIPES]
+
+    def _other_index(self, key: str) -> int:
+        other = self._other
+        if(other is not None):
+            for position in range(0, len(other), 2):
+                if(other[position] == key):
+                    return position
+        return -1
+
+    def __getitem__(self, key: str) -> Any:
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> Any:
+        index = KEY_TABLE.numeric_index.get(key)
+        if(index is not None and self._present >> index & 1):
+            value = self._numbers[_rank(self._present, index)]
+            return int(value) if(self._ints >> index & 1) else value
+        position = self._other_index(key)
+        if(position < 0):
+            raise KeyError(key)
+        return self._other[position + 1]
+
+    def __setitem__(self, key: str, value: Any):
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key: str, value: Any):
+        index = KEY_TABLE.numeric_index.get(key)
+        if(index is not None):
+            if(isinstance(value, (int, float)) and not isinstance(value, bool) and (not isinstance(value, int) or abs(value) < 2 ** 53)):
+                self._set_number(index, value)
+                self._remove_other(key)
+                return
+            self._remove_number(index)
+        position = self._other_index(key)
+        if(position >= 0):
+            self._other[position + 1] = value
+        elif(self._other is None):
+            self._other = [KEY_TABLE.intern(key), value]
+        else:
+            self._other += (KEY_TABLE.intern(key), value)
+
+    def _set_number(self, index: int, value: float):
+        bit = 1 << index
+        rank = _rank(self._present, index)
+        if(self._present & bit):
+            self._numbers[rank] = value
+        elif(self._numbers is None):
+            self._numbers = array("d", (value,))
+        else:
+            self._numbers.insert(rank, value)
+        self._present |= bit
+        self._ints = (self._ints | bit) if(isinstance(value, int)) else (self._ints & ~bit)
+
+    def _remove_number(self, index: int) -> bool:
+        bit = 1 << index
+        if(not self._present & bit):
+            return False
+        del self._numbers[_rank(self._present, index)]
+        self._present &= ~bit
+        self._ints &= ~bit
+        return True
+
+    def _remove_other(self, key: str) -> bool:
+        position = self._other_index(key)
+        if(position < 0):
+            return False
+        del self._other[position:position + 2]
+        return True
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            index = KEY_TABLE.numeric_index.get(key)
+            if(index is not None and self._remove_number(index)):
+                return
+            if(not self._remove_other(key)):
+                raise KeyError(key)
+
+    def _keys(self) -> list[str]:
+        present = self._present
+        keys = [key for index, key in enumerate(KEY_TABLE.numeric_keys) if(present >> index & 1)] if(present) else []
+        if(self._other):
+            keys += self._other[0::2]
+        return keys
+
+    def __iter__(self) -> Iterator[str]:
+        # Iteracja po migawce kluczy - równoległy zapis nie przerywa jej ani nie zmienia w trakcie.
+        with self._lock:
+            keys = self._keys()
+        return iter(keys)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return bin(self._present).count("1") + (len(self._other) // 2 if self._other else 0)
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            index = KEY_TABLE.numeric_index.get(key)
+            if(index is not None and self._present >> index & 1):
+                return True
+            return self._other_index(key) >= 0
+
+    def update(self, other=(), **kwargs):
+        items = list(other.items() if(hasattr(other, "items")) else other) + list(kwargs.items())
+        with self._lock:
+            for key, value in items:
+                self._set(key, value)
+
+    def copy(self) -> dict:
+        with self._lock:
+            return {key: self._get(key) for key in self._keys()}
+
+    def items(self):
+        return self.copy().items()
+
+    def __repr__(self) -> str:
+        return f"DeviceState({self.copy()!r})"
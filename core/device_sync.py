@@ -0,0 +1,108 @@
+import hashlib
+import json
+import threading
+import logging
+
+from .devices_types import SocketDevice, SensorDevice, LightDevice
+import config
+
+logger = logging.getLogger(__name__)
+
+def determine_device_type(definition: dict) -> type:
+    """
+    Analizuje definicję urządzenia z Zigbee2MQTT i zwraca odpowiednią klasę Pythona.
+    """
+    if(not definition or "exposes" not in definition):
+        return SocketDevice
+
+    exposes = definition.get("exposes", [])
+    features = []
+
+    for item in exposes:
+        if(item.get("type") == "light"):
+            features.append("light")
+        if(item.get("name") in ["state", "switch"]):
+            features.append("switch")
+        if(item.get("features")):
+            for sub in item.get("features"):
+                if(sub.get("name") == "state"): features.append("switch")
+                if(sub.get("name") in ["brightness", "color_xy", "color_temp"]): features.append("light")
+    if("light" in features):
+        return LightDevice
+    if("switch" in features):
+        return SocketDevice
+    return SensorDevice
+
+class DeviceSyncEngine:
+    """
+    Synchronizuje urządzenia z listą 'zigbee2mqtt/bridge/devices'.
+    Każdy wpis jest haszowany, więc niezmienione urządzenia są pomijane; typ urządzenia
+    jest zapamiętywany per producent/model (lub per definicja, gdy ich brak).
+    Zmiany trafiają do DeviceManager.apply_device_sync - w bazie jako jedna transakcja.
+    """
+    def __init__(self, device_manager, remove_missing: bool = config.DEVICE_SYNC_REMOVE_MISSING):
+        self.device_manager = device_manager
+        self.remove_missing = remove_missing
+        self._entry_hashes: dict[str, str] = {}
+        self._type_cache: dict[tuple, type] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(value) -> str:
+        return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+    def device_class_for(self, definition: dict) -> type:
+        if(definition and definition.get("vendor") and definition.get("model")):
+            key = (definition["vendor"], definition["model"])
+        else:
+            key = ("definition", self._digest(definition))
+        device_class = self._type_cache.get(key)
+        if(device_class is None):
+            device_class = determine_device_type(definition)
+            self._type_cache[key] = device_class
+        return device_class
+
+    def sync(self, payload: list) -> dict:
+        """
+        Przetwarza listę urządzeń z mostka. Zwraca liczbę dodanych, zaktualizowanych,
+        usuniętych i pominiętych (niezmienionych) urządzeń.
+        """
+        with self._lock:
+            changed, seen, hashes = [], set(), {}
+            complete = False
+            skipped = 0
+            for dev_data in payload:
+                if(dev_data.get("type") == "Coordinator"):
+                    complete = True
+                    continue
+                ieee_address = dev_data.get("ieee_address")
+                friendly_name = dev_data.get("friendly_name")
+                if(not ieee_address or not friendly_name):
+                    continue
+                seen.add(ieee_address)
+                definition = dev_data.get("definition")
+                entry_hash = self._digest([friendly_name, definition])
+                hashes[ieee_address] = entry_hash
+                if(self._entry_hashes.get(ieee_address) == entry_hash and self.device_manager.get_device(ieee_address)):
+                    skipped += 1
+                    continue
+                DeviceClass = self.device_class_for(definition)
+                changed.append(DeviceClass(
+                    device_id=ieee_address,
+                    name=friendly_name,
+                    topic=f"zigbee2mqtt/{friendly_name}"
+                ))
+
+            removed = []
+            # Usuwamy tylko urządzenia, które wcześniej przyszły z mostka (urządzenia dodane ręcznie przez API
+            # zostają, nawet z ID w formie adresu IEEE), i tylko na podstawie pełnej listy (z koordynatorem).
+            if(self.remove_missing and complete):
+                removed = [device_id for device_id in self._entry_hashes if(device_id not in seen)]
+            elif(not complete):
+                # Niepełna lista nie mówi nic o brakujących urządzeniach - pamiętamy je do następnej synchronizacji.
+                hashes = {**self._entry_hashes, **hashes}
+
+            result = self.device_manager.apply_device_sync(changed, removed)
+            self._entry_hashes = hashes
+            result["skipped"] = skipped
+            return result
@@ -1,39 +1,80 @@
 import logging
-from typing import Any, Optional, Dict
+from typing import Any, Optional
+
+from .device_state import DeviceState
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+def _same_value(current: Any, new: Any) -> bool:
+    # Porównanie z typem: zmiana 1 -> True lub 1 -> 1.0 też jest zmianą stanu.
+    return current is not _MISSING and type(current) is type(new) and current == new
+
 class BaseDevice:
     """
     Klasa bazowa dla wszystkich urządzeń Smart Home.
     """
+    __slots__ = ("device_id", "name", "topic", "state")
+
     def __init__(self, device_id: str, name: str, topic: str):
         self.device_id = device_id
         self.name = name
         self.topic = topic
-        self.state: Dict[str, Any] = {"state": "UNKNOWN"} 
+        self.state = DeviceState({"state": "UNKNOWN"})
 
-    def update_state(self, payload: dict):
+    def update_state(self, payload: dict) -> list[str]:
         """
         Aktualizuje stan urządzenia na podstawie wiadomości z MQTT.
+        Zwraca klucze, których wartość faktycznie się zmieniła (pusta lista, gdy raport powtarza stan).
         """
         if(payload and isinstance(payload, dict)):
-            self.state.update(payload)
-            logger.info(f"[{self.__class__.__name__}] {self.name} ({self.device_id}): Zaktualizowano stan -> {self.state}")
-        else:
-            logger.warning(f"[{self.__class__.__name__}] {self.name}: Otrzymano pusty lub nieprawidłowy payload.")
+            state = self.state
+            changed = [key for key, value in payload.items() if(not _same_value(state.get(key, _MISSING), value))]
+            for key in changed:
+                state[key] = payload[key]
+            if(changed):
+                logger.debug("[%s] %s (%s): Zaktualizowano stan -> %s", self.__class__.__name__, self.name, self.device_id, changed,
+                             extra={"device_id": self.device_id, "sampled": True})
+            return changed
+        logger.warning(f"[{self.__class__.__name__}] {self.name}: Otrzymano pusty lub nieprawidłowy payload.")
+        return []
+
+    def build_action_payload(self, action: str, value: Optional[Any] = None) -> Optional[dict]:
+        """
+        Zwraca payload komendy dla akcji lub None, jeśli akcja jest nieobsługiwana. Do zaimplementowania w klasach potomnych.
+        """
+        raise NotImplementedError("Metoda build_action_payload musi być zaimplementowana w typie urządzenia")
 
-    def perform_action(self, mqtt_client, action: str, value: Optional[Any] = None):
+    def perform_action(self, mqtt_client, action: str, value: Optional[Any] = None) -> Optional[dict]:
         """
-        Wysyła akcję do urządzenia. Do zaimplementowania w klasach potomnych.
+        Wysyła akcję do urządzenia. Zwraca wysłany payload lub None, jeśli akcja jest nieobsługiwana.
         """
-        raise NotImplementedError("Metoda perform_action musi być zaimplementowana w typie urządzenia")
+        payload = self.build_action_payload(action, value)
+        if(payload is None):
+            return None
+        self.publish_command(mqtt_client, payload, action)
+        return payload
+
+    def publish_command(self, mqtt_client, payload: dict, action: str = "") -> bool:
+        """
+        Publikuje gotowy payload komendy na temacie '{topic}/set'.
+        """
+        try:
+            mqtt_client.publish(f"{self.topic}/set", payload)
+            logger.info(f"[{self.__class__.__name__}] {self.name}: Akcja '{action}' wysłana -> {payload}", extra={"device_id": self.device_id})
+            return True
+        except Exception as e:
+            logger.error(f"[{self.__class__.__name__}] Błąd publikacji MQTT dla {self.name}: {e}")
+            return False
 
 class LightDevice(BaseDevice):
     """
     Obsługa akcji dla żarówek (ON/OFF, jasność, kolor).
     """
-    def perform_action(self, mqtt_client, action: str, value: Optional[Any] = None):
+    __slots__ = ()
+
+    def build_action_payload(self, action: str, value: Optional[Any] = None) -> Optional[dict]:
         payload = {}
         if(action == "turn_on"):
             payload["state"] = "ON"
@@ -45,42 +86,36 @@ class LightDevice(BaseDevice):
                 payload["brightness"] = max(0, min(254, level))
             except (TypeError, ValueError):
                 logger.error(f"[LightDevice] Błąd: Nieprawidłowa wartość jasności ({value}) dla urządzenia {self.name}.")
-                return
+                return None
         elif(action == "set_color"):
             if(isinstance(value, str)):
                 payload["color"] = {"hex": value}
             else:
                 logger.error(f"[LightDevice] Błąd: Wartość koloru musi być łańcuchem HEX dla urządzenia {self.name}.")
-                return
+                return None
         else:
             logger.warning(f"[LightDevice] Nieznana akcja: {action} dla urządzenia {self.name}.")
-            return
-
-        try:
-            mqtt_client.publish(f"{self.topic}/set", payload)
-            logger.info(f"[LightDevice] {self.name}: Akcja '{action}' wysłana -> {payload}")
-        except Exception as e:
-            logger.error(f"[LightDevice] Błąd publikacji MQTT dla {self.name}: {e}")
+            return None
+        return payload
 
 class SocketDevice(BaseDevice):
     """
     Obsługa akcji dla gniazdek (ON/OFF).
     """
-    def perform_action(self, mqtt_client, action: str, value: Optional[Any] = None):
+    __slots__ = ()
+
+    def build_action_payload(self, action: str, value: Optional[Any] = None) -> Optional[dict]:
         if(action in ["turn_on", "turn_off"]):
-            payload = {"state": "ON" if(action == "turn_on") else "OFF"}
-            try:
-                mqtt_client.publish(f"{self.topic}/set", payload)
-                logger.info(f"[SocketDevice] {self.name}: Akcja '{action}' wysłana -> {payload}")
-            except Exception as e:
-                logger.error(f"[SocketDevice] Błąd publikacji MQTT dla {self.name}: {e}")
-        else:
-            logger.warning(f"[SocketDevice] Nieobsługiwana akcja dla gniazdka: {action}.")
+            return {"state": "ON" if(action == "turn_on") else "OFF"}
+        logger.warning(f"[SocketDevice] Nieobsługiwana akcja dla gniazdka: {action}.")
+        return None
 
 class SensorDevice(BaseDevice):
     """
     Klasa dla czujników. Nie wykonuje akcji sterujących.
     """
-    def perform_action(self, mqtt_client, action: str, value: Optional[Any] = None):
+    __slots__ = ()
+
+    def build_action_payload(self, action: str, value: Optional[Any] = None) -> Optional[dict]:
         logger.debug(f"[SensorDevice] {self.name}: Otrzymano żądanie akcji '{action}'. Ignorowanie, ponieważ to czujnik.")
-        return
\ No newline at end of file
+        return None
\ No newline at end of file
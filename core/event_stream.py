@@ -0,0 +1,74 @@
+import asyncio
+import json
+import threading
+import logging
+
+import config
+
+logger = logging.getLogger(__name__)
+
+def format_sse(event: str, data: str, event_id: int | None = None) -> str:
+    """
+    Formatuje pojedynczą wiadomość Server-Sent Events.
+    """
+    prefix = f"id: {event_id}\n" if(event_id is not None) else ""
+    return f"{prefix}event: {event}\ndata: {data}\n\n"
+
+class EventSubscription:
+    """
+    Kolejka zdarzeń jednego klienta strumienia. Żyje w pętli asyncio serwera API.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def put(self, seq: int, message: str):
+        """
+        Wywoływane w pętli asyncio. Przy przepełnieniu klient dostanie nową migawkę zamiast zaległych zmian.
+        """
+        try:
+            self.queue.put_nowait((seq, message))
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    def drain(self):
+        while(not self.queue.empty()):
+            self.queue.get_nowait()
+        self.overflowed = False
+
+class EventBroadcaster:
+    """
+    Przekazuje zdarzenia DeviceManager (z dowolnego wątku) do klientów strumienia SSE.
+    Każde zdarzenie jest serializowane raz, niezależnie od liczby klientów.
+    """
+    def __init__(self, queue_size: int = config.EVENT_STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscriptions: list[EventSubscription] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, loop: asyncio.AbstractEventLoop) -> EventSubscription:
+        subscription = EventSubscription(loop, self.queue_size)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    @property
+    def client_count(self) -> int:
+        return len(self._subscriptions)
+
+    def publish(self, event: dict):
+        subscriptions = self._subscriptions
+        if(not subscriptions):
+            return
+        message = format_sse(event["type"], json.dumps(event), event["seq"])
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event["seq"], message)
+            except RuntimeError:
+                logger.debug("Pętla klienta strumienia zdarzeń została zamknięta. Usuwanie subskrypcji.")
+                self.unsubscribe(subscription)
@@ -0,0 +1,162 @@
+import json
+import threading
+import logging
+from typing import Any, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+Z2M_BRIDGE_REQUEST = "zigbee2mqtt/bridge/request/group"
+
+class GroupExecutor:
+    """
+    Wykonuje akcje na grupach urządzeń. Payload jest budowany i serializowany raz na typ urządzenia,
+    a komendy dla wszystkich członków są publikowane jedną serią, bez pośrednich blokad i logów.
+    Przy włączonym Z2M_NATIVE_GROUPS grupa jest odwzorowywana na grupę Zigbee2MQTT i, gdy jej skład
+    się zgadza, komenda trafia do wszystkich urządzeń jedną transmisją radiową.
+    Stan grup po stronie Zigbee2MQTT pochodzi z tematu 'zigbee2mqtt/bridge/groups'.
+    """
+    def __init__(self, device_manager, native_groups: bool = config.Z2M_NATIVE_GROUPS, prefix: str = config.Z2M_GROUP_PREFIX):
+        self.device_manager = device_manager
+        self.native_groups = native_groups
+        self.prefix = prefix
+        self._native_members: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+        self._mqtt_client = None
+
+    def native_name(self, group_id: str) -> str:
+        return f"{self.prefix}{group_id}"
+
+    def resolve_members(self, group_id: str) -> list:
+        """
+        Zwraca urządzenia grupy, rozwijając grupy zagnieżdżone. Każde urządzenie występuje raz, cykle są pomijane.
+        """
+        dm = self.device_manager
+        devices, seen, pending = [], set(), [group_id]
+        with dm._lock:
+            while(pending):
+                target_id = pending.pop()
+                if(target_id in seen):
+                    continue
+                seen.add(target_id)
+                group = dm.groups.get(target_id)
+                if(group):
+                    pending.extend(reversed(group.get("members", [])))
+                elif(target_id in dm.devices):
+                    devices.append(dm.devices[target_id])
+        return devices
+
+    def execute(self, mqtt_client, group_id: str, action: str, value: Optional[Any] = None) -> bool:
+        self._mqtt_client = mqtt_client
+        devices = self.resolve_members(group_id)
+        payloads: dict[type, Optional[tuple[dict, str]]] = {}
+        batches: dict[str, list] = {}
+        for device in devices:
+            device_class = type(device)
+            if(device_class not in payloads):
+                payload = device.build_action_payload(action, value)
+                payloads[device_class] = (payload, json.dumps(payload)) if(payload is not None) else None
+            built = payloads[device_class]
+            if(built is not None):
+                batches.setdefault(built[1], []).append(device)
+        if(not batches):
+            logger.info(f"Akcja grupowa '{action}' na {group_id}: brak urządzeń obsługujących akcję.")
+            return True
+        self._track_members(mqtt_client, batches, {payload_str: payload for payload, payload_str in filter(None, payloads.values())})
+
+        if(self.native_groups and len(batches) == 1 and self._is_native_ready(group_id, devices)):
+            payload_str = next(iter(batches))
+            mqtt_client.publish_many([(f"zigbee2mqtt/{self.native_name(group_id)}/set", payload_str)])
+            logger.info(f"Akcja grupowa '{action}' na {group_id}: wysłano jedną komendę do grupy Zigbee2MQTT -> {payload_str}")
+            return True
+
+        messages = [(f"{device.topic}/set", payload_str) for payload_str, members in batches.items() for device in members]
+        sent = mqtt_client.publish_many(messages)
+        logger.info(f"Akcja grupowa '{action}' na {group_id}: wysłano {sent} komend.")
+        if(self.native_groups):
+            self.sync_group(mqtt_client, group_id, devices)
+        return True
+
+    def _track_members(self, mqtt_client, batches: dict[str, list], payloads: dict[str, dict]):
+        """
+        Rejestruje komendę każdego członka grupy w śledzeniu potwierdzeń (przed publikacją), aby zastąpiła
+        oczekującą komendę urządzenia - inaczej ponowienie starszej komendy cofnęłoby akcję grupową.
+        Ponowienie wysyła komendę już bezpośrednio do urządzenia.
+        """
+        commands = self.device_manager.commands
+        for payload_str, members in batches.items():
+            for device in members:
+                message = [(f"{device.topic}/set", payload_str)]
+                commands.track(device.device_id, message[0][0], payloads[payload_str],
+                               lambda message=message: mqtt_client.publish_many(message))
+
+    @staticmethod
+    def _is_zigbee(device) -> bool:
+        return device.topic.startswith("zigbee2mqtt/") and device.device_id.startswith("0x")
+
+    def _is_native_ready(self, group_id: str, devices: list) -> bool:
+        with self._lock:
+            native = self._native_members.get(group_id)
+        return native is not None and all(self._is_zigbee(d) for d in devices) and native == {d.device_id for d in devices}
+
+    def sync_group(self, mqtt_client, group_id: str, devices: Optional[list] = None):
+        """
+        Wysyła do Zigbee2MQTT żądania utworzenia grupy i wyrównania jej składu.
+        Grupy z urządzeniami spoza Zigbee nie są odwzorowywane.
+        """
+        devices = self.resolve_members(group_id) if devices is None else devices
+        if(not devices or not all(self._is_zigbee(d) for d in devices)):
+            return
+        name = self.native_name(group_id)
+        desired = {d.device_id for d in devices}
+        with self._lock:
+            current = self._native_members.get(group_id)
+            self._native_members[group_id] = desired
+        requests = []
+        if(current is None):
+            requests.append((f"{Z2M_BRIDGE_REQUEST}/add", json.dumps({"friendly_name": name})))
+            current = set()
+        requests += [(f"{Z2M_BRIDGE_REQUEST}/members/add", json.dumps({"group": name, "device": ieee})) for ieee in sorted(desired - current)]
+        requests += [(f"{Z2M_BRIDGE_REQUEST}/members/remove", json.dumps({"group": name, "device": ieee})) for ieee in sorted(current - desired)]
+        if(len(requests) > 0):
+            mqtt_client.publish_many(requests)
+            logger.info(f"Synchronizacja grupy Zigbee2MQTT '{name}': wysłano {len(requests)} żądań.")
+
+    def forget(self, group_id: str):
+        """
+        Usuwa odwzorowanie usuniętej grupy (i samą grupę w Zigbee2MQTT).
+        """
+        with self._lock:
+            native = self._native_members.pop(group_id, None)
+        if(native is not None and self._mqtt_client):
+            self._mqtt_client.publish_many([(f"{Z2M_BRIDGE_REQUEST}/remove", json.dumps({"id": self.native_name(group_id)}))])
+
+    def handle_bridge_groups(self, payload: list):
+        """
+        Aktualizuje znany skład naszych grup na podstawie listy grup z Zigbee2MQTT.
+        """
+        if(not isinstance(payload, list)):
+            return
+        native = {}
+        for group in payload:
+            name = group.get("friendly_name", "")
+            if(name.startswith(self.prefix)):
+                native[name[len(self.prefix):]] = {m.get("ieee_address") for m in group.get("members", [])}
+        with self._lock:
+            self._native_members = native
+        logger.debug("Odebrano listę grup Zigbee2MQTT: %d odwzorowanych grup.", len(native))
+
+    def handle_bridge_response(self, topic: str, payload: dict):
+        """
+        Przy błędzie żądania grupy odwzorowanie jest porzucane - do czasu ponownej synchronizacji
+        akcje na tej grupie są wysyłane do każdego urządzenia osobno.
+        """
+        if(not isinstance(payload, dict) or payload.get("status") != "error"):
+            return
+        data = payload.get("data") or {}
+        name = data.get("group") or data.get("friendly_name") or data.get("id") or ""
+        if(isinstance(name, str) and name.startswith(self.prefix)):
+            with self._lock:
+                self._native_members.pop(name[len(self.prefix):], None)
+        logger.warning(f"Zigbee2MQTT odrzucił żądanie {topic}: {payload.get('error')}")
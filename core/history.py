@@ -0,0 +1,245 @@
+import asyncio
+import threading
+import logging
+import time
+from typing import Optional
+
+from .database import DatabaseManager
+from .device_manager import IGNORED_ATTRIBUTE_KEYS
+from .async_runtime import LoopEvent
+import config
+
+logger = logging.getLogger(__name__)
+
+# Rozdzielczości agregatów: nazwa -> długość przedziału w sekundach.
+ROLLUP_RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+RESOLUTION_RAW = "raw"
+
+class HistoryManager:
+    """
+    Przechowuje historię liczbowych odczytów urządzeń (np. temperatura, moc).
+    Odczyty są buforowane w pamięci i zapisywane zbiorczo w jednej transakcji razem
+    z agregatami (liczba, suma, min, max) dla przedziałów 1 min, 1 h i 1 dzień.
+    Tabele i zapytania należą do DatabaseManager (schemat wersjonowany razem z resztą bazy).
+
+    Do historii trafiają zdarzenia zmiany stanu - raport z niezmienioną wartością nie jest zapisywany.
+    Dlatego średnia agregatu jest ważona czasem: odczyt obowiązuje do następnego odczytu tej serii
+    (najdłużej HISTORY_MAX_HOLD_SECONDS), a 'count' to liczba zmian, nie liczba raportów.
+    Po restarcie ważenie zaczyna się od pierwszego nowego odczytu.
+    """
+    def __init__(self, db_manager: DatabaseManager,
+                 flush_interval: float = config.HISTORY_FLUSH_INTERVAL_SECONDS,
+                 batch_size: int = config.HISTORY_BATCH_SIZE,
+                 retention_days: Optional[dict] = None,
+                 max_hold: float = config.HISTORY_MAX_HOLD_SECONDS):
+        self.db_manager = db_manager
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention_days = config.HISTORY_RETENTION_DAYS if retention_days is None else retention_days
+        self.max_hold_ms = int(max_hold * 1000)
+        self._series: dict[tuple[str, str], int] = db_manager.get_history_series()
+        # Ostatni zapisany odczyt serii (ts w ms, wartość) - początek przedziału, w którym obowiązuje.
+        self._last: dict[tuple[str, str], tuple[int, float]] = {}
+        self._buffer: list[tuple] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._async_wake: Optional[LoopEvent] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_prune = 0.0
+
+    def record(self, device_id: str, state: dict, timestamp: Optional[float] = None):
+        """
+        Buforuje liczbowe wartości ze stanu urządzenia. Wartości logiczne i tekstowe są pomijane.
+        """
+        ts = int((timestamp if timestamp is not None else time.time()) * 1000)
+        readings = [(device_id, key, float(value), ts) for key, value in state.items()
+                    if(key not in IGNORED_ATTRIBUTE_KEYS and isinstance(value, (int, float)) and not isinstance(value, bool))]
+        if(not readings):
+            return
+        with self._lock:
+            self._buffer.extend(readings)
+            full = len(self._buffer) >= self.batch_size
+        if(full):
+            self._wake.set()
+            if(self._async_wake):
+                self._async_wake.set()
+
+    def on_device_event(self, event: dict):
+        """
+        Słuchacz zdarzeń DeviceManager - zapisuje w historii każdą zmianę stanu.
+        """
+        if(event["type"] == "state"):
+            self.record(event["device_id"], event["state"])
+
+    @staticmethod
+    def _bucket(rollups: dict, key: tuple, value: float) -> list:
+        agg = rollups.get(key)
+        if(agg is None):
+            # [samples, value_sum, value_min, value_max, weighted_sum, weighted_seconds]
+            agg = rollups[key] = [0, 0.0, value, value, 0.0, 0.0]
+        return agg
+
+    def _hold(self, rollups: dict, series: tuple, value: float, start_ms: int, end_ms: int):
+        """
+        Dolicza do agregatów czas, przez który obowiązywała wartość (od start_ms do end_ms), dzieląc go między przedziały.
+        """
+        end_ms = min(end_ms, start_ms + self.max_hold_ms)
+        for resolution in ROLLUP_RESOLUTIONS.values():
+            width = resolution * 1000
+            bucket = start_ms - start_ms % width
+            while(bucket < end_ms):
+                seconds = (min(end_ms, bucket + width) - max(start_ms, bucket)) / 1000
+                agg = self._bucket(rollups, (*series, resolution, bucket // 1000), value)
+                agg[2] = min(agg[2], value)
+                agg[3] = max(agg[3], value)
+                agg[4] += value * seconds
+                agg[5] += seconds
+                bucket += width
+
+    def flush(self) -> int:
+        """
+        Zapisuje zbuforowane odczyty i aktualizuje agregaty w jednej transakcji. Zwraca liczbę zapisanych odczytów.
+        """
+        with self._flush_lock:
+            with self._lock:
+                readings, self._buffer = self._buffer, []
+            if(not readings):
+                return 0
+            last_before = dict(self._last)
+            raw_rows = {}
+            rollups: dict[tuple, list] = {}
+            for device_id, key, value, ts in readings:
+                series = (device_id, key)
+                raw_rows[(device_id, key, ts)] = value
+                seconds = ts // 1000
+                for resolution in ROLLUP_RESOLUTIONS.values():
+                    agg = self._bucket(rollups, (device_id, key, resolution, seconds - seconds % resolution), value)
+                    agg[0] += 1
+                    agg[1] += value
+                    agg[2] = min(agg[2], value)
+                    agg[3] = max(agg[3], value)
+                last = self._last.get(series)
+                if(last is not None and last[0] < ts):
+                    self._hold(rollups, series, last[1], last[0], ts)
+                if(last is None or last[0] <= ts):
+                    self._last[series] = (ts, value)
+            try:
+                created = self.db_manager.save_history([(*key, value) for key, value in raw_rows.items()],
+                                                       [(*key, *agg) for key, agg in rollups.items()], self._series)
+            except Exception as e:
+                logger.error(f"Błąd zapisu historii odczytów ({len(readings)} wartości): {e}")
+                self._last = last_before
+                with self._lock:
+                    self._buffer = readings + self._buffer
+                return 0
+            if(created):
+                self._series.update(created)
+            return len(raw_rows)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """
+        Usuwa dane starsze niż okres przechowywania danej rozdzielczości. Zwraca liczbę usuniętych wierszy.
+        """
+        now = now if now is not None else time.time()
+        raw_days = self.retention_days.get(RESOLUTION_RAW)
+        raw_cutoff = int((now - raw_days * 86400) * 1000) if(raw_days is not None) else None
+        rollup_cutoffs = {resolution: int(now - self.retention_days[name] * 86400)
+                          for name, resolution in ROLLUP_RESOLUTIONS.items() if(self.retention_days.get(name) is not None)}
+        removed = self.db_manager.prune_history(list(self._series.values()), raw_cutoff, rollup_cutoffs)
+        if(removed):
+            logger.info(f"Usunięto {removed} przeterminowanych wpisów historii.")
+        return removed
+
+    def get_keys(self, device_id: str) -> list[str]:
+        with self._lock:
+            buffered = {key for buffered_device, key, _, _ in self._buffer if(buffered_device == device_id)}
+        return sorted(buffered.union(key for (series_device, key) in self._series if(series_device == device_id)))
+
+    def choose_resolution(self, start: float, end: float, max_points: int = config.HISTORY_MAX_POINTS) -> str:
+        """
+        Dobiera najdrobniejszą rozdzielczość, przy której zakres mieści się w limicie punktów
+        (dla danych surowych zakładany jest najwyżej jeden odczyt na sekundę).
+        """
+        span = max(0.0, end - start)
+        if(span <= max_points):
+            return RESOLUTION_RAW
+        for name, resolution in ROLLUP_RESOLUTIONS.items():
+            if(span / resolution <= max_points):
+                return name
+        return "1d"
+
+    def query(self, device_id: str, key: str, start: float, end: float, resolution: Optional[str] = None) -> Optional[dict]:
+        """
+        Zwraca historię jednej wartości w zakresie [start, end] (sekundy unixowe)
+        lub None, jeśli urządzenie nie ma takiej serii. Zapytanie niczego nie zapisuje: dane surowe
+        są uzupełniane odczytami z bufora, a agregaty obejmują odczyty zapisane do ostatniego flush().
+        """
+        series_id = self._series.get((device_id, key))
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        with self._lock:
+            buffered = {ts: value for buffered_device, buffered_key, value, ts in self._buffer
+                        if(buffered_device == device_id and buffered_key == key and start_ms <= ts <= end_ms)}
+        if(series_id is None and not buffered):
+            return None
+        resolution = resolution or self.choose_resolution(start, end)
+        if(resolution == RESOLUTION_RAW):
+            rows = dict(self.db_manager.get_history_raw(series_id, start_ms, end_ms)) if(series_id is not None) else {}
+            rows.update(buffered)
+            points = [{"ts": ts / 1000, "value": rows[ts]} for ts in sorted(rows)]
+        else:
+            seconds = ROLLUP_RESOLUTIONS[resolution]
+            rows = self.db_manager.get_history_rollups(series_id, seconds, int(start) - int(start) % seconds, int(end)) if(series_id is not None) else []
+            points = [{"ts": bucket, "avg": weighted_sum / weighted_seconds if(weighted_seconds > 0) else total / samples,
+                       "min": low, "max": high, "count": samples}
+                      for bucket, samples, total, low, high, weighted_sum, weighted_seconds in rows if(samples or weighted_seconds)]
+        return {"device_id": device_id, "key": key, "resolution": resolution, "points": points}
+
+    def start(self):
+        if(self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="history-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Uruchomiono zapis historii odczytów (co {self.flush_interval}s).")
+
+    def stop(self):
+        """
+        Zatrzymuje wątek zapisu i zrzuca do bazy wszystkie zbuforowane odczyty.
+        """
+        self._stop_event.set()
+        self._wake.set()
+        if(self._thread and self._thread.is_alive()):
+            self._thread.join(timeout=5)
+            logger.info("Zatrzymano zapis historii odczytów.")
+        self.flush()
+
+    def _flush_loop(self):
+        while(not self._stop_event.is_set()):
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush_and_prune()
+
+    async def run_async(self):
+        """
+        Odpowiednik wątku zapisu dla trybu asyncio - zapis do SQLite wykonywany jest w puli wątków.
+        """
+        loop = asyncio.get_running_loop()
+        self._async_wake = LoopEvent(loop)
+        logger.info(f"Uruchomiono zadanie zapisu historii odczytów (co {self.flush_interval}s, tryb asyncio).")
+        try:
+            while(True):
+                await self._async_wake.wait(self.flush_interval)
+                await loop.run_in_executor(None, self._flush_and_prune)
+        finally:
+            self._async_wake = None
+
+    def _flush_and_prune(self):
+        self.flush()
+        if(time.monotonic() - self._last_prune >= config.HISTORY_PRUNE_INTERVAL_SECONDS):
+            self._last_prune = time.monotonic()
+            try:
+                self.prune()
+            except Exception as e:
+                logger.error(f"Błąd usuwania przeterminowanej historii: {e}")
@@ -0,0 +1,299 @@
+import asyncio
+import threading
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+
+import config
+from .async_runtime import LoopEvent
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE = "coalesce"
+
+class _Shard:
+    """
+    Kolejka jednego wątku roboczego. Wpisy to listy [topic, payload, kontekst], aby można je było scalać w miejscu.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.queue: deque = deque()
+        self.pending: dict[str, list] = {}
+        self.cond = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+
+class MessagePipeline:
+    """
+    Oddziela odbiór wiadomości MQTT (wątek sieciowy paho) od ich przetwarzania.
+    Wiadomości trafiają do ograniczonych kolejek, podzielonych według klucza (ID urządzenia),
+    dzięki czemu kolejność wiadomości jednego urządzenia jest zachowana, a wolny zapis
+    nie blokuje pętli MQTT ani wiadomości innych urządzeń.
+    Opcjonalny 'router' zwraca dla topicu parę (klucz podziału, kontekst) - kontekst (np. rozwiązane
+    urządzenie) jest przekazywany do handlera jako trzeci argument, więc topic jest rozwiązywany tylko raz.
+    """
+    def __init__(self, handler: Callable[..., None], router: Optional[Callable[[str], tuple[Any, Any]]] = None,
+                 workers: int = config.MQTT_WORKERS, queue_size: int = config.MQTT_QUEUE_SIZE,
+                 overflow_policy: str = config.MQTT_OVERFLOW_POLICY):
+        if(overflow_policy not in (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)):
+            raise ValueError(f"Nieznana polityka przepełnienia kolejki: {overflow_policy}")
+        self.handler = handler
+        self.router = router
+        self.overflow_policy = overflow_policy
+        workers = max(1, workers)
+        self._shards = [_Shard(max(1, queue_size // workers)) for _ in range(workers)]
+        self._running = False
+        self._metrics_lock = threading.Lock()
+        self._enqueued = 0
+        self._processed = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._errors = 0
+
+    def submit(self, topic: str, payload: Any):
+        """
+        Umieszcza wiadomość w kolejce. Wywoływane z wątku sieciowego MQTT - nigdy nie blokuje.
+        """
+        if(self.router):
+            key, context = self.router(topic)
+        else:
+            key, context = topic, None
+        shard = self._shards[hash(key) % len(self._shards)]
+        dropped = coalesced = False
+        with shard.cond:
+            if(len(shard.queue) >= shard.maxsize):
+                pending = shard.pending.get(topic)
+                if(self.overflow_policy == OVERFLOW_COALESCE and pending and isinstance(pending[1], dict) and isinstance(payload, dict)):
+                    pending[1].update(payload)
+                    coalesced = True
+                else:
+                    oldest = shard.queue.popleft()
+                    if(shard.pending.get(oldest[0]) is oldest):
+                        del shard.pending[oldest[0]]
+                    dropped = True
+            if(not coalesced):
+                entry = [topic, payload, context]
+                shard.queue.append(entry)
+                shard.pending[topic] = entry
+                shard.cond.notify()
+
+        with self._metrics_lock:
+            if(coalesced):
+                self._coalesced += 1
+            else:
+                self._enqueued += 1
+            if(dropped):
+                self._dropped += 1
+                dropped_total = self._dropped
+        if(dropped and (dropped_total == 1 or dropped_total % 1000 == 0)):
+            logger.warning(f"Kolejka wiadomości MQTT przepełniona. Odrzucono łącznie {dropped_total} najstarszych wiadomości.")
+
+    def start(self):
+        if(self._running):
+            return
+        self._running = True
+        for index, shard in enumerate(self._shards):
+            shard.thread = threading.Thread(target=self._worker_loop, args=(shard,), name=f"mqtt-worker-{index}", daemon=True)
+            shard.thread.start()
+        logger.info(f"Uruchomiono potok wiadomości MQTT: {len(self._shards)} wątków, polityka przepełnienia '{self.overflow_policy}'.")
+
+    def stop(self, timeout: float = 5):
+        """
+        Zatrzymuje wątki robocze po opróżnieniu kolejek.
+        """
+        self._running = False
+        for shard in self._shards:
+            with shard.cond:
+                shard.cond.notify_all()
+        for shard in self._shards:
+            if(shard.thread and shard.thread.is_alive()):
+                shard.thread.join(timeout=timeout)
+        logger.info("Zatrzymano potok wiadomości MQTT.")
+
+    def _worker_loop(self, shard: _Shard):
+        while(True):
+            with shard.cond:
+                while(not shard.queue and self._running):
+                    shard.cond.wait()
+                if(not shard.queue):
+                    return
+                entry = shard.queue.popleft()
+                if(shard.pending.get(entry[0]) is entry):
+                    del shard.pending[entry[0]]
+            try:
+                if(self.router):
+                    self.handler(entry[0], entry[1], entry[2])
+                else:
+                    self.handler(entry[0], entry[1])
+                with self._metrics_lock:
+                    self._processed += 1
+            except Exception as e:
+                with self._metrics_lock:
+                    self._errors += 1
+                logger.error(f"Błąd przetwarzania wiadomości z topicu {entry[0]}: {e}")
+
+    def get_metrics(self) -> dict:
+        depths = [len(shard.queue) for shard in self._shards]
+        with self._metrics_lock:
+            return {
+                "workers": len(self._shards),
+                "overflow_policy": self.overflow_policy,
+                "queue_depth": sum(depths),
+                "queue_depth_per_worker": depths,
+                "queue_capacity": sum(shard.maxsize for shard in self._shards),
+                "enqueued": self._enqueued,
+                "processed": self._processed,
+                "dropped": self._dropped,
+                "coalesced": self._coalesced,
+                "errors": self._errors,
+            }
+
+class UpdateCoalescer:
+    """
+    Scala serie raportów tego samego topicu w oknie czasowym w jedną zmianę stanu,
+    zanim trafią do aktualizacji urządzenia, bazy i reguł.
+    Okno ustawiane jest per urządzenie (ID) lub per typ urządzenia.
+    Jeśli nowa wartość zmieniłaby wynik warunku reguły względem wartości oczekującej,
+    oczekujący stan jest najpierw przetwarzany, aby reguły zobaczyły każde przejście.
+    Blokada chroni jedynie słownik oczekujących stanów - przetwarzanie odbywa się bez niej.
+    Kolejność w obrębie topicu zapewnia zbiór topiców w trakcie przetwarzania: na topic
+    przetwarzany przez inny wątek czeka się tylko przy wiadomościach tego samego topicu.
+    """
+    def __init__(self, handler: Callable[[Any, str, dict], None], windows: Optional[dict[str, float]] = None,
+                 transition_check: Optional[Callable[[str, dict, dict], bool]] = None):
+        self.handler = handler
+        self.windows = config.COALESCE_WINDOWS if windows is None else windows
+        self.transition_check = transition_check
+        self._pending: dict[str, list] = {}
+        self._in_flight: set[str] = set()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._async_wake: Optional[LoopEvent] = None
+        self.merged = 0
+
+    def window_for(self, device) -> float:
+        window = self.windows.get(device.device_id)
+        if(window is None):
+            window = self.windows.get(device.__class__.__name__.replace("Device", "").lower(), 0)
+        return window
+
+    def submit(self, device, topic: str, payload: Any) -> bool:
+        """
+        Przyjmuje wiadomość do scalenia. Zwraca False, jeśli wiadomość należy przetworzyć od razu
+        (urządzenie nie ma okna scalania lub payload nie jest słownikiem) - wcześniejszy oczekujący
+        stan tego topicu jest wtedy przetwarzany najpierw, aby nie zmienić kolejności wiadomości.
+        """
+        window = self.window_for(device)
+        if(window <= 0):
+            return False
+        flushed = None
+        with self._cond:
+            while(topic in self._in_flight):
+                self._cond.wait()
+            pending = self._pending.get(topic)
+            if(not isinstance(payload, dict)):
+                if(pending):
+                    flushed = self._take(topic)
+            elif(pending and self.transition_check and self.transition_check(device.device_id, pending[2], payload)):
+                flushed = self._take(topic)
+                pending = None
+            if(isinstance(payload, dict)):
+                if(pending):
+                    pending[2].update(payload)
+                    self.merged += 1
+                else:
+                    self._pending[topic] = [time.monotonic() + window, device, dict(payload)]
+                    self._cond.notify_all()
+                    if(self._async_wake):
+                        self._async_wake.set()
+        if(flushed):
+            self._process_and_release(topic, flushed)
+        return isinstance(payload, dict)
+
+    def _take(self, topic: str) -> list:
+        """
+        Wyjmuje oczekujący stan topicu i oznacza topic jako przetwarzany. Wywoływane pod blokadą.
+        """
+        self._in_flight.add(topic)
+        return self._pending.pop(topic)
+
+    def _process_and_release(self, topic: str, entry: list):
+        try:
+            self._process(topic, entry)
+        finally:
+            with self._cond:
+                self._in_flight.discard(topic)
+                self._cond.notify_all()
+
+    def start(self):
+        if(self._running):
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._flush_loop, name="update-coalescer", daemon=True)
+        self._thread.start()
+        logger.info(f"Uruchomiono scalanie aktualizacji dla: {self.windows}")
+
+    def stop(self):
+        """
+        Zatrzymuje wątek i przetwarza wszystkie oczekujące stany.
+        """
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if(self._thread and self._thread.is_alive()):
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def flush(self):
+        """
+        Przetwarza wszystkie oczekujące stany, niezależnie od końca ich okien.
+        """
+        self._flush_due(None)
+
+    def _flush_due(self, now: Optional[float]):
+        with self._cond:
+            due = [topic for topic, entry in self._pending.items() if((now is None or entry[0] <= now) and topic not in self._in_flight)]
+            entries = [(topic, self._take(topic)) for topic in due]
+        for topic, entry in entries:
+            self._process_and_release(topic, entry)
+
+    def _next_timeout(self) -> Optional[float]:
+        """
+        Czas do końca najbliższego okna scalania (None - brak oczekujących stanów). Wywoływane pod blokadą.
+        """
+        deadlines = [entry[0] for topic, entry in self._pending.items() if(topic not in self._in_flight)]
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def _flush_loop(self):
+        while(self._running):
+            self._flush_due(time.monotonic())
+            with self._cond:
+                if(not self._running):
+                    break
+                timeout = self._next_timeout()
+                if(timeout is None or timeout > 0):
+                    self._cond.wait(timeout)
+
+    async def run_async(self):
+        """
+        Odpowiednik wątku scalania dla trybu asyncio: okna są zamykane w pętli zdarzeń,
+        w której przychodzą wiadomości, więc handler nie jest wywoływany poza nią.
+        """
+        self._async_wake = LoopEvent(asyncio.get_running_loop())
+        logger.info(f"Uruchomiono scalanie aktualizacji dla: {self.windows} (tryb asyncio)")
+        try:
+            while(True):
+                self._flush_due(time.monotonic())
+                with self._cond:
+                    timeout = self._next_timeout()
+                await self._async_wake.wait(timeout)
+        finally:
+            self._async_wake = None
+
+    def _process(self, topic: str, entry: list):
+        try:
+            self.handler(entry[1], topic, entry[2])
+        except Exception as e:
+            logger.error(f"Błąd przetwarzania scalonej wiadomości z topicu {topic}: {e}")
@@ -1,10 +1,11 @@
 import paho.mqtt.client as mqtt
+import asyncio
 import json
 import logging
 import sys
-import time
 
 import config 
+from .async_runtime import AsyncioMqttLoop
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +21,7 @@ class MQTT_Client:
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         self.connected = False
+        self._async_loop: AsyncioMqttLoop = None
 
     def connect(self, BROKER_ADDRESS: str = config.BROKER_ADDRESS, BROKER_PORT: int = config.BROKER_PORT):
         """
@@ -37,6 +39,23 @@ class MQTT_Client:
             logger.critical(f"KRYTYCZNY BŁĄD łączenia z brokerem MQTT: {e}. Zamykanie systemu.")
             sys.exit(1)
 
+    def connect_in_loop(self, loop: asyncio.AbstractEventLoop, BROKER_ADDRESS: str = config.BROKER_ADDRESS, BROKER_PORT: int = config.BROKER_PORT):
+        """
+        Łączy się z brokerem w trybie asyncio: gniazdo obsługuje pętla zdarzeń 'loop', bez wątku paho.
+        """
+        if(config.MQTT_USERNAME and config.MQTT_PASSWORD):
+            self.client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
+            logger.info(f"Skonfigurowano autoryzację MQTT dla użytkownika: {config.MQTT_USERNAME}")
+
+        logger.info(f"Próba połączenia z brokerem {BROKER_ADDRESS}:{BROKER_PORT} (tryb asyncio)...")
+        self._async_loop = AsyncioMqttLoop(loop, self.client)
+        try:
+            self.client.connect(BROKER_ADDRESS, BROKER_PORT, 60)
+        except Exception as e:
+            logger.critical(f"KRYTYCZNY BŁĄD łączenia z brokerem MQTT: {e}. Zamykanie systemu.")
+            sys.exit(1)
+        self._async_loop.start()
+
     def on_connect(self, client, userdata, flags, rc, properties=None):
         """
         Callback wywoływany po próbie połączenia.
@@ -95,16 +114,37 @@ class MQTT_Client:
                  logger.error(f"Nieznany typ payloadu do publikacji: {type(payload)}.")
                  return
             self.client.publish(topic, payload_str)
-            logger.info(f"Wysłano: {topic} -> {payload_str}")
+            logger.debug("Wysłano: %s -> %s", topic, payload_str)
         except Exception as e:
             logger.error(f"Błąd publikacji MQTT na {topic}: {e}")
 
+    def publish_many(self, messages: list[tuple[str, str]]) -> int:
+        """
+        Publikuje serię gotowych (już zserializowanych) wiadomości jedna po drugiej,
+        bez logowania każdej z osobna. Zwraca liczbę wysłanych wiadomości.
+        """
+        if(not self.connected):
+            logger.warning(f"Próba publikacji {len(messages)} wiadomości przy braku połączenia MQTT. Pominięto.")
+            return 0
+        sent = 0
+        for topic, payload_str in messages:
+            try:
+                self.client.publish(topic, payload_str)
+                sent += 1
+            except Exception as e:
+                logger.error(f"Błąd publikacji MQTT na {topic}: {e}")
+        logger.debug("Wysłano serię %d wiadomości.", sent)
+        return sent
+
     def disconnect(self):
         """
         Rozłącza klienta MQTT i zatrzymuje pętlę.
         """
         try:
-            self.client.loop_stop()
+            if(self._async_loop):
+                self._async_loop.stop()
+            else:
+                self.client.loop_stop()
             self.client.disconnect()
             logger.info("Rozłączono klienta MQTT.")
         except Exception as e:
@@ -0,0 +1,184 @@
+import operator
+import threading
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+OPERATORS: dict[str, Callable[[Any, Any], bool]] = {
+    "eq": operator.eq,
+    "neq": operator.ne,
+    "gt": operator.gt,
+    "lt": operator.lt,
+    "gte": operator.ge,
+    "lte": operator.le,
+}
+
+NUMERIC_OPERATORS = {"gt", "lt", "gte", "lte"}
+
+# Sposoby łączenia warunków w wyzwalaczu złożonym (type = "compound").
+COMPOUND_MODES = ("all", "any")
+
+_MISSING = object()
+
+class RuleValidationError(ValueError):
+    """
+    Zgłaszany, gdy definicja reguły jest niepoprawna i nie może zostać skompilowana.
+    """
+
+class CompiledRule:
+    """
+    Reguła przygotowana do szybkiej ewaluacji: operator, klucz i wartość porównania
+    są rozwiązane raz, przy dodawaniu reguły, a nie przy każdej wiadomości.
+    'lock' chroni decyzję o wyzwoleniu reguły (sprawdzenie zatrzasku i timera, zaplanowanie lub wykonanie),
+    podejmowaną równolegle przez wątki MQTT i wątek timerów.
+    """
+    __slots__ = ("rule_id", "rule", "trigger_type", "device_id", "key", "compare", "value", "release_value", "time", "condition",
+                 "action", "debounce", "min_interval", "lock")
+
+    def __init__(self, rule: dict, trigger_type: str, action: dict, device_id: Optional[str] = None, key: Optional[str] = None,
+                 compare: Optional[Callable[[Any, Any], bool]] = None, value: Any = None, time: Optional[str] = None,
+                 condition: Optional[tuple] = None, release_value: Any = None, debounce: float = 0, min_interval: float = 0):
+        self.rule_id = rule["id"]
+        self.rule = rule
+        self.trigger_type = trigger_type
+        self.device_id = device_id
+        self.key = key
+        self.compare = compare
+        self.value = value
+        self.time = time
+        self.condition = condition
+        self.release_value = release_value
+        self.action = action
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.lock = threading.RLock()
+
+    def matches(self, state: dict, held: bool = False) -> bool:
+        """
+        Sprawdza warunek reguły stanowej dla podanego stanu urządzenia. Dla warunku już spełnionego
+        (held=True) z histerezą porównanie odbywa się z progiem zwolnienia, przesuniętym o szerokość histerezy.
+        """
+        current_value = state.get(self.key, _MISSING)
+        if(current_value is _MISSING):
+            return False
+        threshold = self.release_value if(held and self.release_value is not None) else self.value
+        try:
+            return self.compare(current_value, threshold)
+        except TypeError:
+            return False
+
+def release_value(op: str, value: Any, hysteresis: float) -> Any:
+    """
+    Próg, poniżej (dla 'gt'/'gte') lub powyżej (dla 'lt'/'lte') którego spełniony warunek przestaje być spełniony.
+    """
+    if(not hysteresis):
+        return None
+    return value - hysteresis if(op in ("gt", "gte")) else value + hysteresis
+
+def _coerce_number(value: Any) -> float | int:
+    if(isinstance(value, bool)):
+        raise RuleValidationError(f"Wartość logiczna {value} nie może być porównywana operatorem liczbowym.")
+    if(isinstance(value, (int, float))):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RuleValidationError(f"Wartość '{value}' nie jest liczbą.")
+
+def _compile_state_condition(trigger: dict) -> tuple:
+    """
+    Sprawdza warunek stanowy {device_id, key, operator, value[, hysteresis]} i zwraca krotkę
+    ("cond", device_id, key, operator, value, hysteresis) z wartością porównania przygotowaną dla operatora.
+    """
+    device_id = trigger.get("device_id")
+    key = trigger.get("key")
+    op = trigger.get("operator")
+    if(not device_id or not key):
+        raise RuleValidationError("Wyzwalacz stanowy wymaga pól 'device_id' i 'key'.")
+    if(op not in OPERATORS):
+        raise RuleValidationError(f"Nieznany operator: '{op}'. Dozwolone: {', '.join(OPERATORS)}.")
+    if("value" not in trigger):
+        raise RuleValidationError("Wyzwalacz stanowy wymaga pola 'value'.")
+
+    value = trigger["value"]
+    if(op in NUMERIC_OPERATORS):
+        value = _coerce_number(value)
+    hysteresis = _coerce_non_negative(trigger.get("hysteresis"), "hysteresis")
+    if(hysteresis and op not in NUMERIC_OPERATORS):
+        raise RuleValidationError(f"Histereza wymaga operatora liczbowego ({', '.join(sorted(NUMERIC_OPERATORS))}).")
+    return ("cond", device_id, key, op, value, hysteresis)
+
+def _coerce_non_negative(value: Any, field: str) -> float:
+    """
+    Sprawdza nieujemną wartość liczbową opcji reguły (debounce, min_interval, hysteresis). Brak wartości to 0.
+    """
+    if(value is None):
+        return 0
+    value = _coerce_number(value)
+    if(value < 0):
+        raise RuleValidationError(f"Pole '{field}' nie może być ujemne.")
+    return value
+
+def _check_time(value: Any, description: str) -> str:
+    try:
+        datetime.strptime(str(value), "%H:%M")
+    except ValueError:
+        raise RuleValidationError(f"Niepoprawna godzina {description}: '{value}' (oczekiwano HH:MM).")
+    return str(value)
+
+def _compile_condition(node: Any) -> tuple:
+    """
+    Kompiluje węzeł warunku złożonego do krotki:
+    ("all"|"any", (węzły...)), ("window", od, do) lub ("cond", device_id, key, operator, value).
+    Grupa z jednym warunkiem jest zastępowana samym warunkiem.
+    """
+    if(not isinstance(node, dict)):
+        raise RuleValidationError("Warunek reguły musi być obiektem.")
+    modes = [mode for mode in COMPOUND_MODES if(mode in node)]
+    if(len(modes) > 1):
+        raise RuleValidationError("Warunek może zawierać tylko jedno z pól 'all' lub 'any'.")
+    if(modes):
+        children = node[modes[0]]
+        if(not isinstance(children, list) or not children):
+            raise RuleValidationError(f"Pole '{modes[0]}' musi być niepustą listą warunków.")
+        compiled = tuple(_compile_condition(child) for child in children)
+        return compiled[0] if(len(compiled) == 1) else (modes[0], compiled)
+    if("time_window" in node):
+        window = node["time_window"]
+        if(not isinstance(window, dict)):
+            raise RuleValidationError("Pole 'time_window' musi być obiektem z polami 'from' i 'to'.")
+        start = _check_time(window.get("from"), "początku okna czasowego")
+        end = _check_time(window.get("to"), "końca okna czasowego")
+        if(start == end):
+            raise RuleValidationError("Okno czasowe musi mieć różne godziny początku i końca.")
+        return ("window", start, end)
+    return _compile_state_condition(node)
+
+def compile_rule(rule: dict) -> CompiledRule:
+    """
+    Kompiluje definicję reguły (słownik z API/bazy danych) do obiektu CompiledRule.
+    Zgłasza RuleValidationError, jeśli reguła jest niekompletna lub niepoprawna.
+    """
+    if(not rule.get("id")):
+        raise RuleValidationError("Reguła musi mieć ID.")
+    trigger = rule.get("trigger")
+    action = rule.get("action")
+    if(not isinstance(trigger, dict)):
+        raise RuleValidationError("Wyzwalacz reguły musi być obiektem.")
+    if(not isinstance(action, dict) or not action.get("device_id") or not action.get("command")):
+        raise RuleValidationError("Akcja reguły wymaga pól 'device_id' i 'command'.")
+
+    options = {"debounce": _coerce_non_negative(rule.get("debounce"), "debounce"),
+               "min_interval": _coerce_non_negative(rule.get("min_interval"), "min_interval")}
+
+    if(trigger.get("type") == "time"):
+        target_time = _check_time(trigger.get("time"), "wyzwalacza czasowego")
+        return CompiledRule(rule, "time", action, time=target_time, **options)
+
+    if(trigger.get("type") == "compound"):
+        if(not any(mode in trigger for mode in COMPOUND_MODES)):
+            raise RuleValidationError("Wyzwalacz złożony wymaga pola 'all' lub 'any'.")
+        return CompiledRule(rule, "compound", action, condition=_compile_condition(trigger), **options)
+
+    _, device_id, key, op, value, hysteresis = _compile_state_condition(trigger)
+    return CompiledRule(rule, "state", action, device_id=device_id, key=key, compare=OPERATORS[op], value=value,
+                        release_value=release_value(op, value, hysteresis), **options)
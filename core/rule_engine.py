@@ -1,14 +1,25 @@
+import asyncio
 import json
 import threading
 import time
 from datetime import datetime
+from types import MappingProxyType
 import logging
 
 import config 
 from .database import DatabaseManager
+from .rule_compiler import CompiledRule, RuleValidationError, compile_rule
+from .rule_network import RuleNetwork
+from .time_scheduler import TimeScheduler
+from .timer_wheel import TimerWheel
+from .async_runtime import LoopEvent
+from .action_dispatcher import ActionDispatcher
 
 logger = logging.getLogger(__name__)
 
+# Klucz wpisu harmonogramu dla granicy okna czasowego reguł złożonych: (WINDOW_BOUNDARY, "HH:MM").
+WINDOW_BOUNDARY = "window"
+
 class RulesEngine:
     """
     Moduł do zarządzania i wykonywania logiki automatyzacji (reguł).
@@ -16,12 +27,29 @@ class RulesEngine:
     def __init__(self, db_manager: DatabaseManager):
         self.rules: list[dict] = []
         self.rule_states: dict[str, dict] = {} 
+        self._compiled: dict[str, CompiledRule] = {}
+        self._rules_by_device = MappingProxyType({})
+        self._rules_by_key = MappingProxyType({})
+        self._time_rules: tuple = ()
+        self._network = RuleNetwork(self._device_state)
+        self._version = 0
+        self._rules_json_cache: tuple[int, bytes] | None = None
         self.device_manager = None
         self.mqtt_client = None
         self.db_manager: DatabaseManager = db_manager
+        self._scheduler = TimeScheduler(grace_seconds=config.TIME_RULE_GRACE_SECONDS)
+        # Timery debounce i odroczonych (min_interval) akcji - kluczem jest ID reguły.
+        self._timers = TimerWheel(tick=config.RULE_TIMER_TICK_SECONDS, slots=config.RULE_TIMER_SLOTS)
         self._time_thread = None
         self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._async_wake: LoopEvent = None
         self._lock = threading.Lock()
+        # Wykonywanie akcji wyzwolonych reguł (równolegle dla różnych urządzeń docelowych).
+        self.actions = ActionDispatcher(self._execute_action)
+        # ID reguł, których stan wykonania zmienił się od ostatniego zapisu do bazy.
+        self._dirty_states: set[str] = set()
+        self._last_state_flush = time.monotonic()
 
     def setup(self, device_manager, mqtt_client):
         self.device_manager = device_manager
@@ -32,16 +60,108 @@ class RulesEngine:
         with self._lock:
             try:
                 self.rules = self.db_manager.get_all_rules_data()
-                self.rule_states = {r['id']: {'last_triggered': datetime.min, 'is_active': False} for r in self.rules if 'id' in r}
+                persisted = self.db_manager.get_rule_states()
+                self.rule_states = {r['id']: self._restore_state(persisted.get(r['id'])) for r in self.rules if 'id' in r}
+                self._dirty_states.clear()
+                self._compiled = {}
+                self._network.clear()
+                for rule in self.rules:
+                    try:
+                        compiled = compile_rule(rule)
+                    except RuleValidationError as e:
+                        logger.error(f"Pominięto niepoprawną regułę ID={rule.get('id')} z bazy danych: {e}")
+                        continue
+                    self._compiled[rule['id']] = compiled
+                    if(compiled.trigger_type == "compound" and rule.get("active", True)):
+                        self._add_to_network(compiled)
+                self._rebuild_index()
+                self._scheduler.rebuild(self._schedule_entries())
+                self._notify_wake()
                 logger.info(f"Wczytano {len(self.rules)} reguł z bazy danych.")
             except Exception as e:
                 logger.error(f"Błąd wczytywania reguł z bazy danych: {e}")
 
+    @staticmethod
+    def _restore_state(saved: dict | None) -> dict:
+        if(not saved):
+            return {'last_triggered': datetime.min, 'is_active': False}
+        last_triggered = datetime.fromtimestamp(saved['last_triggered']) if(saved['last_triggered'] is not None) else datetime.min
+        return {'last_triggered': last_triggered, 'is_active': saved['is_active']}
+
+    def flush_rule_states(self) -> int:
+        """
+        Zapisuje zmienione stany wykonania reguł w jednej transakcji. Zwraca liczbę zapisanych reguł.
+        """
+        with self._lock:
+            dirty, self._dirty_states = self._dirty_states, set()
+            rows = []
+            for rule_id in dirty:
+                rule_state = self.rule_states.get(rule_id)
+                if(rule_state is None):
+                    continue
+                last_triggered = rule_state['last_triggered']
+                rows.append((rule_id, last_triggered.timestamp() if(last_triggered != datetime.min) else None, rule_state['is_active']))
+            self._last_state_flush = time.monotonic()
+        if(not rows):
+            return 0
+        try:
+            self.db_manager.save_rule_states(rows)
+        except Exception as e:
+            logger.error(f"Błąd zapisu stanów reguł ({len(rows)} reguł): {e}")
+            with self._lock:
+                self._dirty_states.update(row[0] for row in rows)
+            return 0
+        return len(rows)
+
+    def _mark_dirty(self, rule_id: str) -> bool:
+        """
+        Oznacza stan reguły do zapisu. Zwraca True, jeśli był to pierwszy niezapisany stan -
+        wywołujący budzi wtedy pętlę reguł (po zwolnieniu blokady), aby zapis nastąpił
+        po RULE_STATE_FLUSH_INTERVAL_SECONDS, a nie dopiero po TIME_CHECK_INTERVAL_SECONDS.
+        Wywoływane pod blokadą.
+        """
+        first = not self._dirty_states
+        self._dirty_states.add(rule_id)
+        return first
+
+    def _state_flush_due(self) -> bool:
+        return bool(self._dirty_states) and time.monotonic() - self._last_state_flush >= config.RULE_STATE_FLUSH_INTERVAL_SECONDS
+
     def get_rules(self) -> list[dict]:
         with self._lock:
             return list(self.rules)
 
+    @property
+    def version(self) -> int:
+        """
+        Wersja listy reguł - rośnie przy każdym dodaniu, usunięciu i wczytaniu reguł.
+        """
+        return self._version
+
+    def get_rules_json(self) -> tuple[int, bytes]:
+        """
+        Zwraca (wersja, zserializowana odpowiedź /rules), budowaną ponownie tylko po zmianie reguł.
+        """
+        cached = self._rules_json_cache
+        if(cached and cached[0] == self._version):
+            return cached
+        with self._lock:
+            cached = (self._version, json.dumps({"rules": self.rules}).encode("utf-8"))
+        self._rules_json_cache = cached
+        return cached
+
+    def validate_rule(self, rule: dict):
+        """
+        Sprawdza poprawność definicji reguły. Zgłasza RuleValidationError z opisem błędu.
+        """
+        compile_rule(rule)
+
     def add_rule(self, rule: dict) -> bool:
+        try:
+            compiled = compile_rule(rule)
+        except RuleValidationError as e:
+            logger.warning(f"Odrzucono niepoprawną regułę ID={rule.get('id')}: {e}")
+            return False
         with self._lock:
             if(rule.get("id") in self.rule_states):
                  logger.warning(f"Reguła ID {rule.get('id')} już istnieje. Pominięto dodanie.")
@@ -50,6 +170,16 @@ class RulesEngine:
                 self.db_manager.add_rule(rule)
                 self.rules.append(rule)
                 self.rule_states[rule['id']] = {'last_triggered': datetime.min, 'is_active': False}
+                self._compiled[rule['id']] = compiled
+                self._rebuild_index()
+                if(compiled.trigger_type == "time" and rule.get("active", True)):
+                    self._scheduler.schedule(compiled.rule_id, compiled.time)
+                    self._notify_wake()
+                elif(compiled.trigger_type == "compound" and rule.get("active", True)):
+                    self._add_to_network(compiled)
+                    for boundary in self._network.boundary_times():
+                        self._scheduler.schedule((WINDOW_BOUNDARY, boundary), boundary)
+                    self._notify_wake()
                 logger.info(f"Dodano regułę ID={rule.get('id')} do bazy danych.")
                 return True
             except Exception as e:
@@ -62,102 +192,248 @@ class RulesEngine:
             with self._lock:
                 self.rules = [r for r in self.rules if r.get("id") != rule_id]
                 self.rule_states.pop(rule_id, None)
+                self._dirty_states.discard(rule_id)
+                self._compiled.pop(rule_id, None)
+                self._network.remove(rule_id)
+                self._timers.cancel(rule_id)
+                self._rebuild_index()
+                # Przebudowa z bieżącej sieci usuwa też granice okien czasowych, z których korzystała tylko ta reguła.
+                self._scheduler.rebuild(self._schedule_entries())
             logger.info(f"Usunięto regułę ID={rule_id} z bazy danych i pamięci.")
             return True
         return False
 
-    def evaluate_state_change_rules(self, device_id: str):
+    def _device_state(self, device_id: str):
+        device = self.device_manager.devices.get(device_id) if(self.device_manager) else None
+        return device.state if(device) else None
+
+    def _add_to_network(self, compiled: CompiledRule):
+        """
+        Dodaje regułę złożoną do sieci warunków. Warunek spełniony już w chwili dodania
+        nie wyzwala akcji - reguła reaguje dopiero na kolejne przejście w stan spełniony.
+        Wywoływane pod blokadą.
+        """
+        self._network.add(compiled.rule_id, compiled.condition)
+        satisfied = self._network.is_satisfied(compiled.rule_id)
+        if(self.rule_states[compiled.rule_id]['is_active'] != satisfied):
+            self.rule_states[compiled.rule_id]['is_active'] = satisfied
+            self._dirty_states.add(compiled.rule_id)
+
+    def _schedule_entries(self) -> dict:
+        """
+        Wpisy harmonogramu: reguły czasowe oraz granice okien czasowych reguł złożonych.
+        """
+        entries = {compiled.rule_id: compiled.time for compiled in self._time_rules}
+        entries.update({(WINDOW_BOUNDARY, boundary): boundary for boundary in self._network.boundary_times()})
+        return entries
+
+    def _rebuild_index(self):
+        """
+        Buduje indeksy aktywnych, skompilowanych reguł: device_id -> krotka reguł,
+        (device_id, klucz stanu) -> krotka reguł oraz krotkę reguł czasowych.
+        Reguły złożone nie trafiają do indeksów - obsługuje je sieć warunków (RuleNetwork).
+        Wywoływane pod blokadą przy każdej zmianie listy reguł. Indeksy są niemutowalne
+        i podmieniane w całości, więc ścieżka obsługi wiadomości czyta je bez blokady i bez kopiowania.
+        """
+        by_device: dict[str, list] = {}
+        by_key: dict[tuple[str, str], list] = {}
+        time_rules = []
+        for rule in self.rules:
+            compiled = self._compiled.get(rule.get("id"))
+            if(not compiled or not rule.get("active", True)):
+                continue
+            if(compiled.trigger_type == "time"):
+                time_rules.append(compiled)
+            elif(compiled.trigger_type != "compound"):
+                by_device.setdefault(compiled.device_id, []).append(compiled)
+                by_key.setdefault((compiled.device_id, compiled.key), []).append(compiled)
+        self._rules_by_device = MappingProxyType({device_id: tuple(rules) for device_id, rules in by_device.items()})
+        self._rules_by_key = MappingProxyType({index_key: tuple(rules) for index_key, rules in by_key.items()})
+        self._time_rules = tuple(time_rules)
+        self._version += 1
+
+    def rules_for_change(self, device_id: str, changed_keys=None) -> tuple:
+        """
+        Zwraca reguły urządzenia, których warunek zależy od któregoś ze zmienionych kluczy
+        (bez 'changed_keys' - wszystkie reguły urządzenia).
+        """
+        if(changed_keys is None):
+            return self._rules_by_device.get(device_id, ())
+        by_key = self._rules_by_key
+        rules = ()
+        for key in changed_keys:
+            key_rules = by_key.get((device_id, key))
+            if(key_rules):
+                rules = key_rules if(not rules) else rules + key_rules
+        return rules
+
+    def evaluate_state_change_rules(self, device_id: str, changed_keys=None):
+        """
+        Sprawdza reguły stanowe urządzenia. Jeśli podano 'changed_keys', sprawdzane są
+        tylko reguły odwołujące się do tych kluczy.
+        """
         if(not self.device_manager):
             return
+        rules = self.rules_for_change(device_id, changed_keys)
+        in_network = self._network.watches(device_id)
+        if(not rules and not in_network):
+            return
+        device = self.device_manager.devices.get(device_id)
+        if(not device):
+            return
 
-        with self._lock:
-            rules_snapshot = list(self.rules)
+        state = device.state
+        with self.actions.batch():
+            for compiled in rules:
+                self._apply_condition(compiled, compiled.matches(state, held=self._is_held(compiled.rule_id)))
+            if(in_network):
+                self._apply_network_results(self._network.on_state_change(device_id, state.keys() if changed_keys is None else changed_keys, state))
+
+    def _apply_network_results(self, results: list):
+        for rule_id, satisfied in results:
+            compiled = self._compiled.get(rule_id)
+            if(compiled):
+                self._apply_condition(compiled, satisfied)
+
+    def _is_held(self, rule_id: str) -> bool:
+        """
+        Czy warunek reguły jest uznawany za spełniony (reguła wyzwolona lub oczekuje na timer) - wtedy obowiązuje próg histerezy.
+        """
+        rule_state = self.rule_states.get(rule_id)
+        return bool(rule_state and rule_state['is_active']) or self._timers.pending(rule_id)
 
-        for rule in rules_snapshot:
-            if(rule.get("active", True) and rule.get("trigger", {}).get("device_id") == device_id):
-                if(self._check_condition(rule)):
-                    self._handle_rule_trigger(rule)
+    def _apply_condition(self, compiled: CompiledRule, satisfied: bool):
+        """
+        Wyzwala regułę przy przejściu warunku w stan spełniony i kasuje zatrzask, gdy warunek przestaje być spełniony.
+        Przy 'debounce' wyzwolenie następuje dopiero, gdy warunek utrzyma się przez podany czas;
+        zanik warunku w tym czasie anuluje oczekujące wyzwolenie.
+        """
+        rule_id = compiled.rule_id
+        with compiled.lock:
+            rule_state = self.rule_states.get(rule_id)
+            is_active = bool(rule_state and rule_state['is_active'])
+            if(satisfied):
+                if(is_active or self._timers.pending(rule_id)):
+                    return
+                if(compiled.debounce > 0):
+                    self._schedule_timer(rule_id, compiled.debounce)
+                    logger.debug("Reguła ID=%s spełniona - wyzwolenie po %ss, jeśli warunek się utrzyma.", rule_id, compiled.debounce)
                 else:
-                    with self._lock:
-                        rule_id = rule.get('id')
-                        if(rule_id in self.rule_states and self.rule_states[rule_id]['is_active']):
-                             self.rule_states[rule_id]['is_active'] = False
-                             logger.info(f"Reguła ID={rule_id} przestała być spełniona. Zresetowano stan.")
-    
-    def evaluate_time_rules(self, current_minute: str):
-        with self._lock:
-            rules_snapshot = list(self.rules)
-        now = datetime.now()
-        current_full_timestamp = now.strftime("%Y-%m-%d %H:%M")
-        for rule in rules_snapshot:
-            cond = rule.get("trigger", {})
-            if(rule.get("active", True) and cond.get("type") == "time"):
-                target_time = cond.get("time")
-                rule_id = rule['id']
+                    self._fire(compiled)
+                return
+            if(self._timers.cancel(rule_id)):
+                logger.debug("Reguła ID=%s przestała być spełniona - anulowano oczekujące wyzwolenie.", rule_id)
+            if(is_active):
                 with self._lock:
-                    last_run = self.rule_states[rule_id]['last_triggered']
-                    last_run_str = last_run.strftime("%Y-%m-%d %H:%M")
-                    if(last_run_str == current_full_timestamp):
-                        logger.debug(f"Pominięto regułę czasową ID={rule_id}: już wyzwolona dzisiaj o tej godzinie.")
-                        continue
-                    if(self.rule_states[rule_id]['is_active'] and target_time != current_minute):
-                         self.rule_states[rule_id]['is_active'] = False
-                if(target_time == current_minute):
-                    logger.info(f"Reguła czasowa spełniona ID={rule_id} ({target_time})")
-                    self._handle_rule_trigger(rule)
-
-    def _check_condition(self, rule: dict) -> bool:
-        trigger = rule.get("trigger", {})
-        device_id = trigger.get("device_id")
-        key = trigger.get("key")
-        op = trigger.get("operator")
-        val = trigger.get("value")
-        device = self.device_manager.devices.get(device_id)
+                    rule_state['is_active'] = False
+                    wake = self._mark_dirty(rule_id)
+                if(wake):
+                    self._notify_wake()
+                logger.info(f"Reguła ID={rule_id} przestała być spełniona. Zresetowano stan.")
 
-        if(not device or key not in device.state):
-            return False
+    def _schedule_timer(self, rule_id: str, delay: float):
+        self._timers.schedule(rule_id, delay, lambda: self._on_rule_timer(rule_id))
+        self._notify_wake()
 
-        current_value = device.state.get(key)
-        rule_id = rule['id']
-        
-        with self._lock:
-            is_already_active = (rule_id in self.rule_states and self.rule_states[rule_id]['is_active'])
+    def _fire(self, compiled: CompiledRule):
+        """
+        Wykonuje akcję reguły, o ile od poprzedniego wyzwolenia (last_triggered) minęło co najmniej 'min_interval' sekund.
+        W przeciwnym razie wyzwolenie jest odkładane do końca tego okresu.
+        """
+        with compiled.lock:
+            if(compiled.min_interval > 0):
+                rule_state = self.rule_states.get(compiled.rule_id)
+                last_triggered = rule_state['last_triggered'] if(rule_state) else datetime.min
+                remaining = compiled.min_interval - (datetime.now() - last_triggered).total_seconds()
+                if(remaining > 0):
+                    self._schedule_timer(compiled.rule_id, remaining)
+                    logger.info(f"Reguła ID={compiled.rule_id}: akcja odłożona o {remaining:.1f}s (min_interval={compiled.min_interval}s).")
+                    return
+            self._handle_rule_trigger(compiled)
 
-        if(is_already_active):
-            return False
+    def _on_rule_timer(self, rule_id: str):
+        """
+        Timer debounce lub odroczonej akcji wygasł: reguła jest wyzwalana, jeśli jej warunek nadal jest spełniony.
+        """
+        compiled = self._compiled.get(rule_id)
+        if(compiled is None):
+            return
+        with compiled.lock:
+            if(not self._timers.pending(rule_id) and self._still_satisfied(compiled)):
+                self._fire(compiled)
 
-        try:
-            condition_met = False
-            if(op == "eq"): condition_met = (current_value == val)
-            elif(op == "neq"): condition_met = (current_value != val)
-            elif(op == "gt"): condition_met = (current_value > val)
-            elif(op == "lt"): condition_met = (current_value < val)
-            elif(op == "gte"): condition_met = (current_value >= val)
-            elif(op == "lte"): condition_met = (current_value <= val)
-            return condition_met
-        except (TypeError, ValueError) as e:
-            logger.error(f"Błąd porównania wartości w regule ID={rule.get('id')}: {e}")
-            return False
+    def _still_satisfied(self, compiled: CompiledRule) -> bool:
+        if(compiled.trigger_type == "state"):
+            state = self._device_state(compiled.device_id)
+            return state is not None and compiled.matches(state, held=True)
+        if(compiled.trigger_type == "compound"):
+            return self._network.is_satisfied(compiled.rule_id)
+        return True
+
+    def run_due_timers(self, now: float | None = None):
+        """
+        Obsługuje wygasłe timery debounce i odroczonych akcji ('now' w czasie monotonicznym).
+        """
+        with self.actions.batch():
+            for rule_id, callback in self._timers.advance(now):
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Błąd obsługi timera reguły ID={rule_id}: {e}")
+    
+    def is_transition(self, device_id: str, previous: dict, current: dict) -> bool:
+        """
+        Sprawdza, czy zmiana wartości z 'previous' na 'current' zmienia wynik warunku
+        którejkolwiek reguły tego urządzenia (dla kluczy obecnych w obu słownikach).
+        """
+        for compiled in self.rules_for_change(device_id, current.keys()):
+            if(compiled.key in previous):
+                if(compiled.matches(previous) != compiled.matches(current)):
+                    return True
+        return self._network.watches(device_id) and self._network.is_transition(device_id, previous, current)
 
-    def _handle_rule_trigger(self, rule: dict):
-        rule_id = rule['id']
+    def run_due_time_rules(self, now: datetime | None = None):
+        """
+        Wyzwala reguły czasowe, których zaplanowany moment właśnie nadszedł, i przelicza okna czasowe
+        reguł złożonych (granice okien są w harmonogramie tylko po to, by obudzić pętlę o właściwej porze).
+        """
+        now = now or datetime.now()
+        with self.actions.batch():
+            for rule_id in self._scheduler.pop_due(now):
+                if(isinstance(rule_id, tuple)):
+                    continue
+                compiled = self._compiled.get(rule_id)
+                if(not compiled):
+                    continue
+                logger.info(f"Reguła czasowa spełniona ID={rule_id} ({compiled.time})")
+                self._fire(compiled)
+            self._apply_network_results(self._network.refresh_time(now))
+
+    def _handle_rule_trigger(self, compiled: CompiledRule):
+        rule_id = compiled.rule_id
         with self._lock:
             if(rule_id not in self.rule_states):
                  self.rule_states[rule_id] = {'last_triggered': datetime.min, 'is_active': False}
             self.rule_states[rule_id]['last_triggered'] = datetime.now()
             self.rule_states[rule_id]['is_active'] = True
-        
-        action = rule.get("action")
+            wake = self._mark_dirty(rule_id)
+        if(wake):
+            self._notify_wake()
+
+        action = compiled.action
         if(action):
             device_id = action.get("device_id")
             command = action.get("command")
             value = action.get("value")
-            if(device_id and command and self.device_manager and self.mqtt_client):
+            if(self.device_manager and self.mqtt_client):
                 logger.info(f"Wykonuję akcję z reguły ID={rule_id} na {device_id}: {command} (value={value})")
-                self.device_manager.perform_action(self.mqtt_client, device_id, command, value)
+                self.actions.submit(rule_id, device_id, command, value)
             else:
                 logger.error(f"Błąd: Nie można wykonać akcji w regule ID={rule_id}.")
 
+    def _execute_action(self, device_id: str, command: str, value):
+        self.device_manager.perform_action(self.mqtt_client, device_id, command, value)
+
     def start_time_loop(self):
         if(self._time_thread and self._time_thread.is_alive()):
             return
@@ -168,13 +444,62 @@ class RulesEngine:
 
     def stop_time_loop(self):
         self._stop_event.set()
+        self._wake_event.set()
         if(self._time_thread and self._time_thread.is_alive()):
             self._time_thread.join(timeout=2) 
             logger.info("Zatrzymano wątek reguł czasowych.")
+        self.flush_rule_states()
+
+    def _notify_wake(self):
+        """
+        Budzi pętlę reguł czasowych (wątek lub zadanie asyncio) po zmianie harmonogramu.
+        """
+        self._wake_event.set()
+        if(self._async_wake):
+            self._async_wake.set()
 
     def _time_loop(self):
+        clock = [time.time(), time.monotonic()]
         while(not self._stop_event.is_set()):
-            now = datetime.now()
-            current_minute = now.strftime("%H:%M")
-            self.evaluate_time_rules(current_minute)
-            time.sleep(config.TIME_CHECK_INTERVAL_SECONDS)
\ No newline at end of file
+            timeout = self._time_step(clock)
+            if(self._state_flush_due()):
+                self.flush_rule_states()
+            self._wake_event.wait(timeout)
+            self._wake_event.clear()
+
+    async def run_time_loop_async(self):
+        """
+        Odpowiednik wątku reguł czasowych dla trybu asyncio - działa jako zadanie w pętli zdarzeń.
+        """
+        self._async_wake = LoopEvent(asyncio.get_running_loop())
+        logger.info("Uruchomiono zadanie reguł czasowych (tryb asyncio).")
+        clock = [time.time(), time.monotonic()]
+        try:
+            loop = asyncio.get_running_loop()
+            while(True):
+                timeout = self._time_step(clock)
+                if(self._state_flush_due()):
+                    await loop.run_in_executor(None, self.flush_rule_states)
+                await self._async_wake.wait(timeout)
+        finally:
+            self._async_wake = None
+
+    def _time_step(self, clock: list) -> float:
+        """
+        Wykonuje zaległe reguły czasowe i timery reguł, po czym zwraca czas snu: dokładnie do najbliższego
+        zaplanowanego wyzwolenia lub timera, ale nie dłużej niż TIME_CHECK_INTERVAL_SECONDS,
+        aby wykryć skok zegara systemowego i przeliczyć harmonogram.
+        'clock' to para [czas systemowy, czas monotoniczny] z poprzedniego kroku.
+        """
+        wall, mono = time.time(), time.monotonic()
+        if(abs((wall - clock[0]) - (mono - clock[1])) > config.TIME_RULE_GRACE_SECONDS):
+            logger.warning("Wykryto skok zegara systemowego. Przeliczanie harmonogramu reguł czasowych.")
+            self._scheduler.rebuild(self._schedule_entries())
+        clock[0], clock[1] = wall, mono
+
+        self.run_due_time_rules()
+        self.run_due_timers()
+        timeouts = [t for t in (self._scheduler.seconds_until_next(), self._timers.seconds_until_next()) if t is not None]
+        if(self._dirty_states):
+            timeouts.append(max(0.0, config.RULE_STATE_FLUSH_INTERVAL_SECONDS - (time.monotonic() - self._last_state_flush)))
+        return min(timeouts + [config.TIME_CHECK_INTERVAL_SECONDS])
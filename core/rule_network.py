@@ -0,0 +1,294 @@
+import json
+import threading
+import logging
+from datetime import datetime
+from typing import Any, Callable, Iterable, Mapping, Optional
+
+from .rule_compiler import OPERATORS, release_value
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+def _minutes(hhmm: str) -> int:
+    hour, minute = (int(part) for part in hhmm.split(":"))
+    return hour * 60 + minute
+
+class _Node:
+    """
+    Węzeł sieci warunków. Przechowuje bieżący wynik warunku ('value'), węzły nadrzędne,
+    które od niego zależą, reguły, dla których jest korzeniem, oraz licznik odwołań.
+    """
+    __slots__ = ("signature", "value", "parents", "rules", "refs")
+
+    def __init__(self, signature: tuple):
+        self.signature = signature
+        self.value = False
+        self.parents: list["_JoinNode"] = []
+        self.rules: list[str] = []
+        self.refs = 0
+
+class _AlphaNode(_Node):
+    """
+    Pojedynczy warunek na stanie urządzenia (device_id, key, operator, value). Przy histerezie
+    spełniony warunek jest porównywany z progiem zwolnienia.
+    """
+    __slots__ = ("device_id", "key", "compare", "operand", "release")
+
+    def __init__(self, signature: tuple, device_id: str, key: str, op: str, operand: Any, hysteresis: float = 0):
+        super().__init__(signature)
+        self.device_id = device_id
+        self.key = key
+        self.compare = OPERATORS[op]
+        self.operand = operand
+        self.release = release_value(op, operand, hysteresis)
+
+    def evaluate(self, state: Optional[Mapping]) -> bool:
+        if(state is None):
+            return False
+        current = state.get(self.key, _MISSING)
+        if(current is _MISSING):
+            return False
+        threshold = self.release if(self.value and self.release is not None) else self.operand
+        try:
+            return bool(self.compare(current, threshold))
+        except TypeError:
+            return False
+
+class _WindowNode(_Node):
+    """
+    Okno czasowe [od, do) w ciągu doby; okno może przechodzić przez północ (np. 22:00-06:00).
+    """
+    __slots__ = ("start", "end", "start_minute", "end_minute")
+
+    def __init__(self, signature: tuple, start: str, end: str):
+        super().__init__(signature)
+        self.start = start
+        self.end = end
+        self.start_minute = _minutes(start)
+        self.end_minute = _minutes(end)
+
+    def evaluate(self, now: datetime) -> bool:
+        minute = now.hour * 60 + now.minute
+        if(self.start_minute < self.end_minute):
+            return self.start_minute <= minute < self.end_minute
+        return minute >= self.start_minute or minute < self.end_minute
+
+class _JoinNode(_Node):
+    """
+    Koniunkcja ('all') lub alternatywa ('any') węzłów podrzędnych. Zamiast przeglądać
+    wszystkie dzieci przy każdej zmianie, węzeł liczy, ile z nich jest spełnionych.
+    """
+    __slots__ = ("mode", "children", "true_count")
+
+    def __init__(self, signature: tuple, mode: str, children: tuple):
+        super().__init__(signature)
+        self.mode = mode
+        self.children = children
+        self.true_count = sum(1 for child in children if child.value)
+        self.value = self.compute()
+
+    def compute(self) -> bool:
+        if(self.mode == "all"):
+            return self.true_count == len(self.children)
+        return self.true_count > 0
+
+class RuleNetwork:
+    """
+    Współdzielona sieć warunków reguł złożonych (w stylu Rete). Identyczne warunki
+    i identyczne grupy warunków różnych reguł są jednym węzłem, więc przy zmianie stanu
+    każdy warunek jest sprawdzany raz, a zmiana jego wyniku jest przekazywana w górę
+    tylko do węzłów, które od niego zależą. Dodanie reguły tworzy jedynie brakujące węzły.
+
+    Sieć zwraca reguły, których wynik mógł się zmienić, razem z bieżącym wynikiem -
+    o wyzwoleniu akcji decyduje RulesEngine.
+    """
+    def __init__(self, state_lookup: Callable[[str], Optional[Mapping]], clock: Callable[[], datetime] = datetime.now):
+        self.state_lookup = state_lookup
+        self.clock = clock
+        self._nodes: dict[tuple, _Node] = {}
+        self._alpha_index: dict[tuple[str, str], list[_AlphaNode]] = {}
+        self._devices: dict[str, int] = {}
+        self._windows: list[_WindowNode] = []
+        self._roots: dict[str, _Node] = {}
+        self._lock = threading.Lock()
+        # Liczba sprawdzeń pojedynczych warunków (do pomiarów i testów).
+        self.evaluations = 0
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def watches(self, device_id: str) -> bool:
+        return device_id in self._devices
+
+    def boundary_times(self) -> set[str]:
+        """
+        Godziny (HH:MM), o których zmienia się wynik któregoś z okien czasowych.
+        """
+        with self._lock:
+            return {edge for window in self._windows for edge in (window.start, window.end)}
+
+    def add(self, rule_id: str, condition: tuple):
+        """
+        Dodaje regułę ze skompilowanym warunkiem (zob. rule_compiler._compile_condition).
+        Wynik nowych węzłów liczony jest od razu z bieżącego stanu urządzeń i zegara.
+        """
+        with self._lock:
+            if(rule_id in self._roots):
+                self._release(self._roots.pop(rule_id), rule_id)
+            root = self._intern(condition, self.clock())
+            root.rules.append(rule_id)
+            self._roots[rule_id] = root
+
+    def remove(self, rule_id: str):
+        with self._lock:
+            root = self._roots.pop(rule_id, None)
+            if(root is not None):
+                self._release(root, rule_id)
+
+    def clear(self):
+        with self._lock:
+            self._nodes.clear()
+            self._alpha_index.clear()
+            self._devices.clear()
+            self._windows = []
+            self._roots.clear()
+
+    def is_satisfied(self, rule_id: str) -> bool:
+        root = self._roots.get(rule_id)
+        return bool(root and root.value)
+
+    def _intern(self, condition: tuple, now: datetime) -> _Node:
+        """
+        Zwraca węzeł warunku (istniejący lub nowy) i zapisuje w nim odwołanie w imieniu wywołującego.
+        """
+        kind = condition[0]
+        if(kind == "cond"):
+            _, device_id, key, op, operand, hysteresis = condition
+            signature = ("cond", device_id, key, op, json.dumps(operand, sort_keys=True), hysteresis)
+        elif(kind == "window"):
+            signature = condition
+        else:
+            children = {}
+            for child_condition in condition[1]:
+                child = self._intern(child_condition, now)
+                if(id(child) in children):
+                    self._release(child)
+                else:
+                    children[id(child)] = child
+            signature = (kind, frozenset(children))
+        node = self._nodes.get(signature)
+        if(node is not None):
+            if(kind in ("all", "any")):
+                # Węzły podrzędne zostały już policzone przy tworzeniu istniejącego węzła.
+                for child in children.values():
+                    self._release(child)
+            return self._ref(node)
+
+        if(kind == "cond"):
+            node = _AlphaNode(signature, device_id, key, op, operand, hysteresis)
+            node.value = node.evaluate(self.state_lookup(device_id))
+            self.evaluations += 1
+            self._alpha_index.setdefault((device_id, key), []).append(node)
+            self._devices[device_id] = self._devices.get(device_id, 0) + 1
+        elif(kind == "window"):
+            node = _WindowNode(signature, condition[1], condition[2])
+            node.value = node.evaluate(now)
+            self._windows.append(node)
+        else:
+            node = _JoinNode(signature, kind, tuple(children.values()))
+            for child in node.children:
+                child.parents.append(node)
+        self._nodes[signature] = node
+        return self._ref(node)
+
+    @staticmethod
+    def _ref(node: _Node) -> _Node:
+        node.refs += 1
+        return node
+
+    def _release(self, node: _Node, rule_id: Optional[str] = None):
+        """
+        Zwalnia odwołanie do węzła; nieużywany węzeł jest usuwany razem z odwołaniami do jego dzieci.
+        """
+        if(rule_id is not None):
+            node.rules.remove(rule_id)
+        node.refs -= 1
+        if(node.refs > 0):
+            return
+        del self._nodes[node.signature]
+        if(isinstance(node, _AlphaNode)):
+            index_key = (node.device_id, node.key)
+            alphas = self._alpha_index[index_key]
+            alphas.remove(node)
+            if(not alphas):
+                del self._alpha_index[index_key]
+            self._devices[node.device_id] -= 1
+            if(not self._devices[node.device_id]):
+                del self._devices[node.device_id]
+        elif(isinstance(node, _WindowNode)):
+            self._windows.remove(node)
+        else:
+            for child in node.children:
+                child.parents.remove(node)
+                self._release(child)
+
+    def on_state_change(self, device_id: str, changed_keys: Iterable[str], state: Mapping) -> list[tuple[str, bool]]:
+        """
+        Sprawdza warunki zależne od zmienionych kluczy urządzenia i przekazuje zmiany wyników w górę sieci.
+        Zwraca listę (rule_id, czy warunek reguły jest spełniony) dla reguł, których wynik się zmienił.
+        """
+        index = self._alpha_index
+        with self._lock:
+            flipped = []
+            for key in changed_keys:
+                for node in index.get((device_id, key), ()):
+                    self.evaluations += 1
+                    value = node.evaluate(state)
+                    if(value != node.value):
+                        node.value = value
+                        flipped.append(node)
+            return self._propagate(flipped)
+
+    def refresh_time(self, now: Optional[datetime] = None) -> list[tuple[str, bool]]:
+        """
+        Przelicza okna czasowe (wywoływane o godzinach z boundary_times) i przekazuje zmiany w górę sieci.
+        """
+        now = now or self.clock()
+        with self._lock:
+            flipped = []
+            for node in self._windows:
+                value = node.evaluate(now)
+                if(value != node.value):
+                    node.value = value
+                    flipped.append(node)
+            return self._propagate(flipped)
+
+    def _propagate(self, flipped: list[_Node]) -> list[tuple[str, bool]]:
+        roots = {}
+        pending = [(node, node.value) for node in flipped]
+        while(pending):
+            node, value = pending.pop()
+            for rule_id in node.rules:
+                roots[rule_id] = node
+            for parent in node.parents:
+                parent.true_count += 1 if(value) else -1
+                parent_value = parent.compute()
+                if(parent_value != parent.value):
+                    parent.value = parent_value
+                    pending.append((parent, parent_value))
+        # Wynik końcowy: węzeł mógł zmienić się dwukrotnie w jednym przebiegu (np. dwa klucze jednej wiadomości).
+        return [(rule_id, node.value) for rule_id, node in roots.items()]
+
+    def is_transition(self, device_id: str, previous: Mapping, current: Mapping) -> bool:
+        """
+        Sprawdza, czy zmiana wartości z 'previous' na 'current' zmienia wynik któregoś warunku urządzenia.
+        """
+        index = self._alpha_index
+        for key in current:
+            if(key not in previous):
+                continue
+            for node in index.get((device_id, key), ()):
+                if(node.evaluate(previous) != node.evaluate(current)):
+                    return True
+        return False
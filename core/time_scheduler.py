@@ -0,0 +1,94 @@
+import heapq
+import itertools
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+def next_occurrence(target_time: str, now: datetime) -> datetime:
+    """
+    Zwraca najbliższy moment (ściśle po 'now'), w którym zegar wskaże godzinę HH:MM.
+    """
+    hour, minute = (int(part) for part in target_time.split(":"))
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if(candidate <= now):
+        candidate += timedelta(days=1)
+    return candidate
+
+class TimeScheduler:
+    """
+    Kolejka priorytetowa (kopiec) najbliższych wyzwoleń reguł czasowych.
+    Usunięte lub przeplanowane wpisy są unieważniane leniwie przy zdejmowaniu z kopca.
+    """
+    def __init__(self, grace_seconds: float = 60):
+        self.grace = timedelta(seconds=grace_seconds)
+        self._heap: list[tuple] = []
+        self._entries: dict[str, tuple] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def schedule(self, rule_id: str, target_time: str, now: Optional[datetime] = None):
+        """
+        Planuje (lub przeplanowuje) regułę na najbliższe wystąpienie godziny HH:MM.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            self._push(rule_id, target_time, next_occurrence(target_time, now))
+
+    def unschedule(self, rule_id: str):
+        with self._lock:
+            self._entries.pop(rule_id, None)
+
+    def rebuild(self, rules: dict[str, str], now: Optional[datetime] = None):
+        """
+        Buduje kopiec od nowa dla słownika rule_id -> HH:MM.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            self._heap = []
+            self._entries = {}
+            for rule_id, target_time in rules.items():
+                self._push(rule_id, target_time, next_occurrence(target_time, now))
+
+    def pop_due(self, now: Optional[datetime] = None) -> list[str]:
+        """
+        Zdejmuje reguły, których czas wyzwolenia minął, i planuje je na kolejny dzień.
+        Wyzwolenia spóźnione o więcej niż okres tolerancji (np. po skoku zegara przy
+        synchronizacji NTP) są pomijane, a reguła jest jedynie przeplanowywana.
+        """
+        now = now or datetime.now()
+        due = []
+        with self._lock:
+            while(self._heap and self._heap[0][0] <= now):
+                fire_at, seq, rule_id = heapq.heappop(self._heap)
+                entry = self._entries.get(rule_id)
+                if(not entry or entry[1] != seq):
+                    continue
+                target_time = entry[2]
+                if(now - fire_at > self.grace):
+                    logger.warning(f"Pominięto spóźnione wyzwolenie reguły czasowej ID={rule_id} ({fire_at:%Y-%m-%d %H:%M}).")
+                else:
+                    due.append(rule_id)
+                self._push(rule_id, target_time, next_occurrence(target_time, now))
+        return due
+
+    def seconds_until_next(self, now: Optional[datetime] = None) -> Optional[float]:
+        """
+        Zwraca liczbę sekund do najbliższego wyzwolenia lub None, gdy nic nie jest zaplanowane.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            while(self._heap):
+                fire_at, seq, rule_id = self._heap[0]
+                entry = self._entries.get(rule_id)
+                if(entry and entry[1] == seq):
+                    return max(0.0, (fire_at - now).total_seconds())
+                heapq.heappop(self._heap)
+        return None
+
+    def _push(self, rule_id: str, target_time: str, fire_at: datetime):
+        seq = next(self._counter)
+        self._entries[rule_id] = (fire_at, seq, target_time)
+        heapq.heappush(self._heap, (fire_at, seq, rule_id))
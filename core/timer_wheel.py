@@ -0,0 +1,115 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+from typing import Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+class TimerWheel:
+    """
+    Koło czasowe (hashed timing wheel) dla krótkich opóźnień reguł: debounce i minimalnych odstępów akcji.
+    Czas jest dzielony na takty o długości 'tick'; timer trafia do przegródki odpowiadającej taktowi
+    wygaśnięcia, a dłuższe opóźnienia czekają wymaganą liczbę pełnych obrotów koła.
+    Dodanie, przeplanowanie i anulowanie timera kosztuje O(1), niezależnie od liczby timerów
+    (plus O(log n) na kopiec terminów, z którego odczytywany jest czas do najbliższego timera).
+    Każdy klucz (np. ID reguły) ma najwyżej jeden aktywny timer.
+    """
+    def __init__(self, tick: float = 0.25, slots: int = 512, clock: Callable[[], float] = time.monotonic):
+        self.tick = tick
+        self.slots = slots
+        self.clock = clock
+        self._wheel: list[dict] = [{} for _ in range(slots)]
+        # klucz -> (numer przegródki, takt wygaśnięcia)
+        self._timers: dict[Hashable, tuple[int, int]] = {}
+        # Kopiec (takt wygaśnięcia, nr kolejny, klucz). Wpisy anulowanych i przeplanowanych timerów
+        # są usuwane leniwie - przy odczycie najbliższego terminu albo przy przebudowie kopca.
+        self._deadlines: list[tuple[int, int, Hashable]] = []
+        self._sequence = itertools.count()
+        self._current_tick = self._tick_of(clock())
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def _tick_of(self, moment: float) -> int:
+        return int(moment // self.tick)
+
+    def pending(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[], Any], now: Optional[float] = None):
+        """
+        Planuje (lub przeplanowuje) wywołanie 'callback' po 'delay' sekundach.
+        Timer wygasa najwcześniej na początku taktu następującego po upływie opóźnienia.
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            self._cancel(key)
+            due_tick = max(self._tick_of(now + delay) + (1 if delay > 0 else 0), self._current_tick + 1)
+            slot = due_tick % self.slots
+            self._wheel[slot][key] = (due_tick, callback)
+            self._timers[key] = (slot, due_tick)
+            if(len(self._deadlines) > 2 * len(self._timers) + 64):
+                self._deadlines = [(due, next(self._sequence), timer_key) for timer_key, (_, due) in self._timers.items()]
+                heapq.heapify(self._deadlines)
+            else:
+                heapq.heappush(self._deadlines, (due_tick, next(self._sequence), key))
+
+    def cancel(self, key: Hashable) -> bool:
+        """
+        Anuluje timer. Zwraca True, jeśli timer był zaplanowany.
+        """
+        with self._lock:
+            return self._cancel(key)
+
+    def _cancel(self, key: Hashable) -> bool:
+        entry = self._timers.pop(key, None)
+        if(entry is None):
+            return False
+        del self._wheel[entry[0]][key]
+        return True
+
+    def advance(self, now: Optional[float] = None) -> list[tuple[Hashable, Callable[[], Any]]]:
+        """
+        Przesuwa koło do chwili 'now' i zwraca wygasłe timery jako pary (klucz, callback).
+        Wywołania wykonuje wywołujący, już bez blokady koła.
+        """
+        now = self.clock() if now is None else now
+        target_tick = self._tick_of(now)
+        expired = []
+        with self._lock:
+            if(target_tick <= self._current_tick):
+                return expired
+            if(not self._timers):
+                self._current_tick = target_tick
+                return expired
+            # Po długiej przerwie wystarczy jeden pełny obrót - każda przegródka zostanie odwiedzona.
+            first_tick = max(self._current_tick + 1, target_tick - self.slots + 1)
+            for tick in range(first_tick, target_tick + 1):
+                bucket = self._wheel[tick % self.slots]
+                if(not bucket):
+                    continue
+                for key, (due_tick, callback) in list(bucket.items()):
+                    if(due_tick <= target_tick):
+                        del bucket[key]
+                        del self._timers[key]
+                        expired.append((key, callback))
+            self._current_tick = target_tick
+        return expired
+
+    def seconds_until_next(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Zwraca liczbę sekund do wygaśnięcia najbliższego timera lub None, gdy żaden nie jest zaplanowany.
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            deadlines = self._deadlines
+            while(deadlines):
+                due_tick, _, key = deadlines[0]
+                timer = self._timers.get(key)
+                if(timer is not None and timer[1] == due_tick):
+                    return max(0.0, due_tick * self.tick - now)
+                heapq.heappop(deadlines)
+        return None
@@ -1,15 +1,98 @@
 const API_URL = "";
 let currentDetailId = null;
+let currentDetailSource = 'devices';
 let currentGroupDetails = null;
 let currentRules = []; 
 let currentGroups = [];
 let currentEditRuleId = null;
 let currentDevices = [];
+let deviceStream = null;
+let deviceStreamReady = false;
 
 document.addEventListener('DOMContentLoaded', () => {
+    connectDeviceStream();
     loadPage('devices');
 });
 
+// --- Strumień zmian stanu urządzeń (SSE) ---
+
+function connectDeviceStream() {
+    if(!window.EventSource) return;
+    deviceStream = new EventSource(`${API_URL}/events`);
+
+    deviceStream.addEventListener('snapshot', (e) => {
+        const data = JSON.parse(e.data);
+        currentDevices = data.devices || [];
+        deviceStreamReady = true;
+        refreshVisibleDeviceViews(null);
+    });
+    deviceStream.addEventListener('state', (e) => {
+        const data = JSON.parse(e.data);
+        const device = currentDevices.find(d => d.id === data.device_id);
+        if(!device) return;
+        device.state = Object.assign(device.state || {}, data.state);
+        refreshVisibleDeviceViews(device.id);
+    });
+    deviceStream.addEventListener('device_attributes', (e) => {
+        const data = JSON.parse(e.data);
+        const device = currentDevices.find(d => d.id === data.device_id);
+        if(device) device.available_keys = data.available_keys;
+    });
+    deviceStream.addEventListener('device_added', (e) => upsertStreamDevice(JSON.parse(e.data).device));
+    deviceStream.addEventListener('device_updated', (e) => upsertStreamDevice(JSON.parse(e.data).device));
+    deviceStream.addEventListener('device_removed', (e) => {
+        const data = JSON.parse(e.data);
+        currentDevices = currentDevices.filter(d => d.id !== data.device_id);
+        refreshVisibleDeviceViews(null);
+    });
+    // EventSource sam wznawia połączenie; po wznowieniu serwer wysyła nową migawkę.
+    deviceStream.onerror = () => { deviceStreamReady = false; };
+}
+
+function upsertStreamDevice(device) {
+    const index = currentDevices.findIndex(d => d.id === device.id);
+    if(index >= 0) currentDevices[index] = device;
+    else currentDevices.push(device);
+    refreshVisibleDeviceViews(null);
+}
+
+async function getDevices() {
+    if(deviceStreamReady) return currentDevices;
+    const res = await fetch(`${API_URL}/devices`);
+    const data = await res.json();
+    currentDevices = data.devices || [];
+    return currentDevices;
+}
+
+function isViewVisible(viewId) {
+    const el = document.getElementById(viewId);
+    return el && !el.classList.contains('d-none');
+}
+
+function refreshVisibleDeviceViews(deviceId) {
+    if(isViewVisible('view-devices')) {
+        if(deviceId) {
+            const device = currentDevices.find(d => d.id === deviceId);
+            const oldCard = document.getElementById(`device-card-${deviceId}`);
+            if(device && oldCard) {
+                const detailsOpen = !document.getElementById(`tech-data-${deviceId}`)?.classList.contains('d-none');
+                const newCard = createDeviceListCard(device);
+                if(detailsOpen) newCard.querySelector(`#tech-data-${deviceId}`).classList.remove('d-none');
+                oldCard.replaceWith(newCard);
+                return;
+            }
+        }
+        renderDevicesList();
+    }
+    if(isViewVisible('view-device-details') && currentDetailId && (!deviceId || deviceId === currentDetailId)) {
+        const device = currentDevices.find(d => d.id === currentDetailId);
+        if(device) renderDeviceDetailState(device, currentDetailSource);
+    }
+    if(isViewVisible('view-group-details') && currentGroupDetails && (!deviceId || currentGroupDetails.members.includes(deviceId))) {
+        renderGroupMembers(currentGroupDetails, currentDevices);
+    }
+}
+
 function loadPage(pageName) {
     document.querySelectorAll('.nav-link').forEach(el => el.classList.remove('active'));
     const activeLink = document.querySelector(`[onclick="loadPage('${pageName}')"]`);
@@ -54,10 +137,8 @@ function loadPage(pageName) {
 
 async function showDeviceDetails(deviceId, source = 'devices') {
     try {
-        if(currentDevices.length === 0) {
-            const res = await fetch(`${API_URL}/devices`);
-            const data = await res.json();
-            currentDevices = data.devices || [];
+        if(currentDevices.length === 0 || !deviceStreamReady) {
+            await getDevices();
         }
         if(currentGroups.length === 0) {
             const res = await fetch(`${API_URL}/groups`);
@@ -66,6 +147,7 @@ async function showDeviceDetails(deviceId, source = 'devices') {
         }
 
         currentDetailId = deviceId;
+        currentDetailSource = source;
         const device = currentDevices.find(d => d.id === deviceId);
         if(!device) return;
         const backBtn = document.getElementById('btn-device-back');
@@ -87,29 +169,7 @@ async function showDeviceDetails(deviceId, source = 'devices') {
         document.getElementById('detail-id').innerText = device.id;
         document.getElementById('detail-new-name-input').value = device.name;
 
-        const attrList = document.getElementById('detail-attributes');
-        attrList.innerHTML = '';
-        if(device.state) {
-            for (const [key, value] of Object.entries(device.state)) {
-                if(typeof value === 'object') continue;
-                const li = document.createElement('li');
-                li.className = 'list-group-item d-flex justify-content-between align-items-center';
-                li.innerHTML = `${key} <span class="badge bg-secondary rounded-pill">${value}</span>`;
-                attrList.appendChild(li);
-            }
-        }
-        const controls = document.getElementById('detail-controls');
-        controls.innerHTML = '';
-        if(device.type === 'socket' || device.type === 'light') {
-            const btn = document.createElement('button');
-            const isOn = device.state && device.state.state === 'ON';
-            btn.className = `btn w-100 btn-lg ${isOn ? 'btn-danger' : 'btn-success'}`;
-            btn.innerText = isOn ? 'WYŁĄCZ' : 'WŁĄCZ';
-            btn.onclick = function() { toggleDevice(device.id, device.state?.state, true, source); };
-            controls.appendChild(btn);
-        } else {
-            controls.innerHTML = '<p class="text-muted">Brak dostępnych akcji sterujących.</p>';
-        }
+        renderDeviceDetailState(device, source);
         const groupsListEl = document.getElementById('device-groups-list');
         groupsListEl.innerHTML = '';
         const memberOfGroups = currentGroups.filter(g => g.members.includes(deviceId));
@@ -144,86 +204,119 @@ async function showDeviceDetails(deviceId, source = 'devices') {
     }
 }
 
+function renderDeviceDetailState(device, source) {
+    const attrList = document.getElementById('detail-attributes');
+    attrList.innerHTML = '';
+    if(device.state) {
+        for (const [key, value] of Object.entries(device.state)) {
+            if(typeof value === 'object') continue;
+            const li = document.createElement('li');
+            li.className = 'list-group-item d-flex justify-content-between align-items-center';
+            li.innerHTML = `${key} <span class="badge bg-secondary rounded-pill">${value}</span>`;
+            attrList.appendChild(li);
+        }
+    }
+    const controls = document.getElementById('detail-controls');
+    controls.innerHTML = '';
+    if(device.type === 'socket' || device.type === 'light') {
+        const btn = document.createElement('button');
+        const isOn = device.state && device.state.state === 'ON';
+        btn.className = `btn w-100 btn-lg ${isOn ? 'btn-danger' : 'btn-success'}`;
+        btn.innerText = isOn ? 'WYŁĄCZ' : 'WŁĄCZ';
+        btn.onclick = function() { toggleDevice(device.id, device.state?.state, true, source); };
+        controls.appendChild(btn);
+    } else {
+        controls.innerHTML = '<p class="text-muted">Brak dostępnych akcji sterujących.</p>';
+    }
+}
+
 async function fetchAndDisplayDevices() {
     const listContainer = document.getElementById('devices-list');
-    listContainer.innerHTML = '<div class="col-12 text-center py-5"><div class="spinner-border"></div></div>';
+    if(!deviceStreamReady) {
+        listContainer.innerHTML = '<div class="col-12 text-center py-5"><div class="spinner-border"></div></div>';
+    }
 
     try {
-        const response = await fetch(`${API_URL}/devices`);
-        const data = await response.json();
-        currentDevices = data.devices;
-        listContainer.innerHTML = '';
+        await getDevices();
+        renderDevicesList();
+    } catch (error) { 
+        console.error("Błąd:", error); 
+        listContainer.innerHTML = '<div class="alert alert-danger">Nie udało się załadować urządzeń.</div>';
+    }
+}
 
-        if(currentDevices.length === 0) {
-            listContainer.innerHTML = '<div class="col-12 text-center text-muted">Brak urządzeń.</div>';
-            return;
-        }
+function renderDevicesList() {
+    const listContainer = document.getElementById('devices-list');
+    listContainer.innerHTML = '';
 
-        currentDevices.forEach(device => {
-            const col = document.createElement('div');
-            col.className = 'col-md-4 col-sm-6';
-            
-            let icon = 'fa-question';
-            let colorClass = 'text-secondary';
-            const state = device.state?.state || 'UNKNOWN';
-
-            if(device.type === 'socket') icon = 'fa-plug';
-            else if(device.type === 'light') icon = 'fa-lightbulb';
-            else if(device.type === 'sensor') icon = 'fa-temperature-half';
-
-            if(state === 'ON') colorClass = 'text-warning';
-            let techDataHtml = '<ul class="list-unstyled mb-0 small text-muted">';
-            if (device.state) {
-                for (const [key, value] of Object.entries(device.state)) {
-                    if (typeof value !== 'object') {
-                        techDataHtml += `<li><strong>${key}:</strong> ${value}</li>`;
-                    }
-                }
+    if(currentDevices.length === 0) {
+        listContainer.innerHTML = '<div class="col-12 text-center text-muted">Brak urządzeń.</div>';
+        return;
+    }
+    currentDevices.forEach(device => listContainer.appendChild(createDeviceListCard(device)));
+}
+
+function createDeviceListCard(device) {
+    const col = document.createElement('div');
+    col.className = 'col-md-4 col-sm-6';
+    col.id = `device-card-${device.id}`;
+    
+    let icon = 'fa-question';
+    let colorClass = 'text-secondary';
+    const state = device.state?.state || 'UNKNOWN';
+
+    if(device.type === 'socket') icon = 'fa-plug';
+    else if(device.type === 'light') icon = 'fa-lightbulb';
+    else if(device.type === 'sensor') icon = 'fa-temperature-half';
+
+    if(state === 'ON') colorClass = 'text-warning';
+    let techDataHtml = '<ul class="list-unstyled mb-0 small text-muted">';
+    if (device.state) {
+        for (const [key, value] of Object.entries(device.state)) {
+            if (typeof value !== 'object') {
+                techDataHtml += `<li><strong>${key}:</strong> ${value}</li>`;
             }
-            techDataHtml += '</ul>';
-            const collapseId = `tech-data-${device.id}`;
+        }
+    }
+    techDataHtml += '</ul>';
+    const collapseId = `tech-data-${device.id}`;
 
-            col.innerHTML = `
-                <div class="card h-100 device-card shadow-sm">
-                    <div class="card-body">
-                        <!-- GÓRNA CZĘŚĆ -->
-                        <div class="d-flex align-items-center mb-2">
-                            <div class="me-3 text-center" style="width: 50px;">
-                                <i class="fa-solid ${icon} fa-2x ${colorClass}"></i>
-                            </div>
-                            <div class="flex-grow-1" style="cursor: pointer;" onclick="showDeviceDetails('${device.id}')">
-                                <h5 class="card-title mb-0 text-truncate" title="${device.name}">${device.name}</h5>
-                                <small class="text-muted">${state}</small>
-                            </div>
-                            <div class="ms-2">
-                                ${device.type !== 'sensor' ? `
-                                <button class="btn btn-outline-primary btn-sm" onclick="event.stopPropagation(); toggleDevice('${device.id}', '${state}', false)">
-                                    <i class="fa-solid fa-power-off"></i>
-                                </button>` : ''}
-                            </div>
-                        </div>
+    col.innerHTML = `
+        <div class="card h-100 device-card shadow-sm">
+            <div class="card-body">
+                <!-- GÓRNA CZĘŚĆ -->
+                <div class="d-flex align-items-center mb-2">
+                    <div class="me-3 text-center" style="width: 50px;">
+                        <i class="fa-solid ${icon} fa-2x ${colorClass}"></i>
+                    </div>
+                    <div class="flex-grow-1" style="cursor: pointer;" onclick="showDeviceDetails('${device.id}')">
+                        <h5 class="card-title mb-0 text-truncate" title="${device.name}">${device.name}</h5>
+                        <small class="text-muted">${state}</small>
+                    </div>
+                    <div class="ms-2">
+                        ${device.type !== 'sensor' ? `
+                        <button class="btn btn-outline-primary btn-sm" onclick="event.stopPropagation(); toggleDevice('${device.id}', '${state}', false)">
+                            <i class="fa-solid fa-power-off"></i>
+                        </button>` : ''}
+                    </div>
+                </div>
 
-                        <!-- DOLNA CZĘŚĆ: Przycisk rozwijania -->
-                        <div class="border-top pt-2">
-                            <button class="btn btn-sm btn-link text-decoration-none p-0 w-100 text-start" 
-                                    onclick="event.stopPropagation(); toggleCardDetails('${collapseId}')">
-                                <i class="fa-solid fa-chevron-down me-1"></i> Dane techniczne
-                            </button>
-                            
-                            <!-- Ukryta treść -->
-                            <div id="${collapseId}" class="d-none mt-2 bg-light p-2 rounded">
-                                ${techDataHtml}
-                            </div>
-                        </div>
+                <!-- DOLNA CZĘŚĆ: Przycisk rozwijania -->
+                <div class="border-top pt-2">
+                    <button class="btn btn-sm btn-link text-decoration-none p-0 w-100 text-start" 
+                            onclick="event.stopPropagation(); toggleCardDetails('${collapseId}')">
+                        <i class="fa-solid fa-chevron-down me-1"></i> Dane techniczne
+                    </button>
+                    
+                    <!-- Ukryta treść -->
+                    <div id="${collapseId}" class="d-none mt-2 bg-light p-2 rounded">
+                        ${techDataHtml}
                     </div>
                 </div>
-            `;
-            listContainer.appendChild(col);
-        });
-    } catch (error) { 
-        console.error("Błąd:", error); 
-        listContainer.innerHTML = '<div class="alert alert-danger">Nie udało się załadować urządzeń.</div>';
-    }
+            </div>
+        </div>
+    `;
+    return col;
 }
 
 function toggleCardDetails(elementId) {
@@ -282,13 +375,12 @@ async function toggleDevice(deviceId, currentState, refreshDetails = false, sour
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ device_id: deviceId, action: action })
         });
+        // Przy aktywnym strumieniu nowy stan przyjdzie sam, gdy urządzenie go potwierdzi.
+        if(deviceStreamReady) return;
         setTimeout(() => {
             fetchAndDisplayDevices();
             if(refreshDetails) {
-                fetch(`${API_URL}/devices`).then(r => r.json()).then(d => {
-                    currentDevices = d.devices;
-                    showDeviceDetails(deviceId, sourceView);
-                });
+                getDevices().then(() => showDeviceDetails(deviceId, sourceView));
             }
         }, 500);
     } catch (e) { alert("Błąd: " + e); }
@@ -423,16 +515,15 @@ async function openAddGroupModal() {
     modal.show();
 
     try {
-        const res = await fetch(`${API_URL}/devices`);
-        const data = await res.json();
+        const devices = await getDevices();
         
         container.innerHTML = '';
-        if(data.devices.length === 0) {
+        if(devices.length === 0) {
             container.innerHTML = 'Brak urządzeń w systemie.';
             return;
         }
 
-        data.devices.forEach(dev => {
+        devices.forEach(dev => {
             const label = document.createElement('label');
             label.className = 'list-group-item d-flex gap-2';
             label.innerHTML = `
@@ -510,18 +601,16 @@ async function toggleGroup(groupId, action) {
 
 async function showGroupDetails(groupId, sourceView = 'groups', sourceId = null) {
     try {
-        const [resGroups, resDevices] = await Promise.all([
+        const [resGroups, allDevices] = await Promise.all([
             fetch(`${API_URL}/groups`),
-            fetch(`${API_URL}/devices`)
+            getDevices()
         ]);
         const dataGroups = await resGroups.json();
-        const dataDevices = await resDevices.json();
         
         const group = dataGroups.groups.find(g => g.id === groupId);
         if(!group) return;
 
         currentGroupDetails = group;
-        const allDevices = dataDevices.devices;
         const backBtn = document.getElementById('btn-group-back');
         const newBackBtn = backBtn.cloneNode(true);
 
@@ -540,20 +629,7 @@ async function showGroupDetails(groupId, sourceView = 'groups', sourceId = null)
         document.getElementById('g-btn-on').onclick = () => toggleGroup(group.id, 'turn_on');
         document.getElementById('g-btn-off').onclick = () => toggleGroup(group.id, 'turn_off');
 
-        const listContainer = document.getElementById('group-members-list');
-        listContainer.innerHTML = '';
-
-        if(group.members.length === 0) {
-            listContainer.innerHTML = '<div class="col-12 text-center text-muted p-4">Ta grupa jest pusta.</div>';
-        } else {
-            group.members.forEach(memberId => {
-                const deviceData = allDevices.find(d => d.id === memberId);
-                if(deviceData) {
-                    const card = createGroupMemberCard(deviceData, group.id);
-                    listContainer.appendChild(card);
-                }
-            });
-        }
+        renderGroupMembers(group, allDevices);
         document.getElementById('btn-add-rule-group').onclick = () => openAddRuleModal(groupId);
         await renderEmbeddedRules(groupId, 'group-rules-list', 'group_details');
         document.getElementById('view-device-details').classList.add('d-none');
@@ -563,6 +639,23 @@ async function showGroupDetails(groupId, sourceView = 'groups', sourceId = null)
     } catch(e) { console.error(e); alert("Błąd ładowania szczegółów grupy."); }
 }
 
+function renderGroupMembers(group, allDevices) {
+    const listContainer = document.getElementById('group-members-list');
+    listContainer.innerHTML = '';
+
+    if(group.members.length === 0) {
+        listContainer.innerHTML = '<div class="col-12 text-center text-muted p-4">Ta grupa jest pusta.</div>';
+        return;
+    }
+    group.members.forEach(memberId => {
+        const deviceData = allDevices.find(d => d.id === memberId);
+        if(deviceData) {
+            const card = createGroupMemberCard(deviceData, group.id);
+            listContainer.appendChild(card);
+        }
+    });
+}
+
 function createGroupMemberCard(device, groupId) {
     const col = document.createElement('div');
     col.className = 'col-md-6';
@@ -611,9 +704,7 @@ async function openAddMemberModal() {
     modal.show();
 
     try {
-        const res = await fetch(`${API_URL}/devices`);
-        const data = await res.json();
-        const allDevices = data.devices;
+        const allDevices = await getDevices();
         
         if(!currentGroupDetails || !currentGroupDetails.members) return;
         const available = allDevices.filter(d => !currentGroupDetails.members.includes(d.id));
@@ -680,17 +771,15 @@ async function fetchAndDisplayRules() {
     container.innerHTML = '<div class="spinner-border"></div>';
 
     try {
-        const [resRules, resDev, resGrp] = await Promise.all([
+        const [resRules, allDevices, resGrp] = await Promise.all([
             fetch(`${API_URL}/rules`),
-            fetch(`${API_URL}/devices`),
+            getDevices(),
             fetch(`${API_URL}/groups`)
         ]);
 
         const dataRules = await resRules.json();
-        const dataDev = await resDev.json();
         const dataGrp = await resGrp.json();
         currentRules = dataRules.rules || [];
-        const allDevices = dataDev.devices || [];
         const allGroups = dataGrp.groups || [];
         const getName = (id) => {
             const dev = allDevices.find(d => d.id === id);
@@ -748,15 +837,14 @@ async function openAddRuleModal(preFillTargetId = null) {
     modal.show();
 
     try {
-        const [resDev, resGrp] = await Promise.all([
-            fetch(`${API_URL}/devices`),
+        const [allDevices, resGrp] = await Promise.all([
+            getDevices(),
             fetch(`${API_URL}/groups`)
         ]);
         
-        const dataDev = await resDev.json();
         const dataGrp = await resGrp.json();
         
-        cachedDevicesForRules = dataDev.devices;
+        cachedDevicesForRules = allDevices;
         const groups = dataGrp.groups;
         
         const triggerSelect = document.getElementById('rule-trigger-device');
@@ -935,9 +1023,7 @@ async function showRuleDetails(ruleId, sourceView = 'rules', sourceId = null) {
             currentRules = data.rules || [];
         }
         if(currentDevices.length === 0) {
-            const res = await fetch(`${API_URL}/devices`);
-            const data = await res.json();
-            currentDevices = data.devices || [];
+            await getDevices();
         }
         if(currentGroups.length === 0) {
             const res = await fetch(`${API_URL}/groups`);
@@ -1155,9 +1241,7 @@ async function renderEmbeddedRules(targetId, listElementId, sourceView) {
             currentRules = data.rules || [];
         }
         if(currentDevices.length === 0) {
-            const res = await fetch(`${API_URL}/devices`);
-            const data = await res.json();
-            currentDevices = data.devices || [];
+            await getDevices();
         }
         if(currentGroups.length === 0) {
             const res = await fetch(`${API_URL}/groups`);
@@ -1,13 +1,201 @@
 import logging
 import logging.config
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
 import config
 
+class RingBufferHandler(logging.Handler):
+    """
+    Trzyma w pamięci ostatnie sformatowane wpisy logu, aby endpoint /logs nie musiał
+    czytać pliku. Każdy wpis dostaje kolejny numer, dzięki czemu tryb śledzenia
+    może pobierać tylko wpisy nowsze od ostatnio wysłanego.
+    """
+    def __init__(self, capacity: int = config.LOG_BUFFER_SIZE):
+        super().__init__()
+        self._entries: deque = deque(maxlen=capacity)
+        self._seq = 0
+        self._listeners: list[Callable[[dict], None]] = []
+        self._emitting = threading.local()
+
+    def emit(self, record: logging.LogRecord):
+        if(getattr(self._emitting, "active", False)):
+            return
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.lock:
+            self._seq += 1
+            entry = (self._seq, record.levelno, record.name, line)
+            self._entries.append(entry)
+            listeners = self._listeners
+        if(not listeners):
+            return
+        # Słuchacze mogą sami logować - blokada przed rekurencją w tym samym wątku.
+        self._emitting.active = True
+        try:
+            event = {"seq": entry[0], "type": "log", "level": record.levelname, "logger": record.name, "line": line}
+            for listener in listeners:
+                try:
+                    listener(event)
+                except Exception:
+                    pass
+        finally:
+            self._emitting.active = False
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        with self.lock:
+            self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener: Callable[[dict], None]):
+        with self.lock:
+            self._listeners = [l for l in self._listeners if l is not listener]
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def get_entries(self, lines: int = 50, level: Optional[int] = None, logger_name: Optional[str] = None,
+                    since: int = 0) -> list[tuple]:
+        """
+        Zwraca do 'lines' najnowszych wpisów (seq, levelno, logger, linia) spełniających filtry,
+        od najstarszego do najnowszego.
+        """
+        with self.lock:
+            entries = list(self._entries)
+        result = []
+        for entry in reversed(entries):
+            if(entry[0] <= since or len(result) >= lines):
+                break
+            if(matches_log_filters(entry[1], entry[2], level, logger_name)):
+                result.append(entry)
+        result.reverse()
+        return result
+
+class DeviceLogSampler(logging.Filter):
+    """
+    Ogranicza wpisy z gorącej ścieżki obsługi wiadomości (rekordy z extra={"device_id": ..., "sampled": True})
+    do jednego na 'interval' sekund dla urządzenia i loggera. Następny przepuszczony wpis podaje liczbę pominiętych.
+    Pozostałe wpisy, także jednorazowe wpisy INFO z device_id (np. wysłana komenda), oraz wpisy od WARNING wzwyż
+    przechodzą bez zmian. Filtr jest wołany z wielu wątków (MQTT, reguły, API) przed blokadą handlera,
+    więc stan próbkowania chroni własna blokada.
+    """
+    def __init__(self, interval: float = config.LOG_SAMPLE_INTERVAL_SECONDS):
+        super().__init__()
+        self.interval = interval
+        self._last: dict[tuple, float] = {}
+        self._suppressed: dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        device_id = getattr(record, "device_id", None)
+        if(device_id is None or not getattr(record, "sampled", False) or self.interval <= 0 or record.levelno >= logging.WARNING):
+            return True
+        key = (device_id, record.name)
+        now = time.monotonic()
+        with self._lock:
+            if(now - self._last.get(key, -self.interval) < self.interval):
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+        if(suppressed):
+            record.msg = f"{record.getMessage()} (pominięto {suppressed} podobnych wpisów)"
+            record.args = None
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, który nigdy nie blokuje wątku logującego - przy pełnej kolejce wpis jest odrzucany.
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def matches_log_filters(levelno: int, name: str, level: Optional[int], logger_name: Optional[str]) -> bool:
+    """
+    Filtr wpisów: minimalny poziom oraz logger (wraz z jego loggerami potomnymi).
+    """
+    if(level is not None and levelno < level):
+        return False
+    if(logger_name and name != logger_name and not name.startswith(logger_name + ".")):
+        return False
+    return True
+
+def tail_file(path: str, lines: int, block_size: int = 8192) -> list[str]:
+    """
+    Zwraca ostatnie N linii pliku, czytając go blokami od końca.
+    Koszt zależy od liczby żądanych linii, a nie od rozmiaru pliku.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while(position > 0 and data.count(b"\n") <= lines):
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    return [line.decode("utf-8", errors="replace") + "\n" for line in data.splitlines()[-lines:]] if(lines > 0) else []
+
+_log_buffer: Optional[RingBufferHandler] = None
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+def get_log_buffer() -> Optional[RingBufferHandler]:
+    """
+    Zwraca bufor ostatnich wpisów logu lub None, jeśli logowanie nie zostało skonfigurowane przez setup_logging.
+    """
+    return _log_buffer
+
+def stop_logging():
+    """
+    Zatrzymuje wątek zapisu logów po zapisaniu wszystkich wpisów z kolejki.
+    """
+    global _log_listener
+    if(_log_listener):
+        _log_listener.stop()
+        _log_listener = None
+
+def _install_queue(loggers: list[logging.Logger]):
+    """
+    Przenosi handlery podanych loggerów za kolejkę: wątki aplikacji tylko wkładają wpis
+    do kolejki, a formatowanie i zapis na konsolę/dysk wykonuje wątek QueueListener.
+    """
+    global _log_listener
+    handlers = []
+    for log in loggers:
+        for handler in log.handlers:
+            if(handler not in handlers):
+                handlers.append(handler)
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=config.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(DeviceLogSampler())
+    for log in loggers:
+        log.handlers = [queue_handler]
+    _log_listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+
 def setup_logging():
     """
     Konfiguruje system logowania:
     - Zapisuje komunikaty INFO i wyższe do pliku 'smart_home.log'.
     - Zapisuje komunikaty DEBUG i wyższe do konsoli (StreamHandler).
+    - Trzyma ostatnie wpisy w pamięci (RingBufferHandler) na potrzeby endpointu /logs.
+    Wszystkie handlery działają w osobnym wątku (QueueHandler/QueueListener).
     """
+    global _log_buffer
+    stop_logging()
     log_format = (
         "[%(asctime)s] "
         "[%(levelname)-8s] "
@@ -37,17 +225,22 @@ def setup_logging():
                 'backupCount': 5,
                 'level': config.LOG_LEVEL if hasattr(config, 'LOG_LEVEL') else logging.INFO,
             },
+            'memory': {
+                '()': RingBufferHandler,
+                'formatter': 'standard',
+                'level': logging.DEBUG,
+            },
         },
         'loggers': {
             # Logger główny
-            '': { 
-                'handlers': ['console', 'file'],
+            '': {
+                'handlers': ['console', 'file', 'memory'],
                 'level': logging.INFO,
                 'propagate': True
             },
             # Logger Paho-MQTT
             'paho-mqtt': {
-                'handlers': ['console', 'file'],
+                'handlers': ['console', 'file', 'memory'],
                 'level': logging.WARNING,
                 'propagate': False
             }
@@ -55,4 +248,7 @@ def setup_logging():
     }
 
     logging.config.dictConfig(logging_config)
-    logging.info("System logowania został zainicjalizowany.")
\ No newline at end of file
+    root = logging.getLogger()
+    _log_buffer = next((h for h in root.handlers if isinstance(h, RingBufferHandler)), None)
+    _install_queue([root, logging.getLogger('paho-mqtt')])
+    logging.info("System logowania został zainicjalizowany.")
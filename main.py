@@ -1,3 +1,4 @@
+import asyncio
 import signal
 import sys
 import time
@@ -5,14 +6,15 @@ import uvicorn
 import logging
 import threading
 import os 
-import json
 
 from core.mqtt_client import MQTT_Client
 from core.device_manager import DeviceManager
 from core.rule_engine import RulesEngine
 from core.database import DatabaseManager
-from core.devices_types import SocketDevice, SensorDevice, LightDevice 
-from logging_config import setup_logging
+from core.message_pipeline import MessagePipeline, UpdateCoalescer
+from core.history import HistoryManager
+from core.device_sync import DeviceSyncEngine
+from logging_config import setup_logging, stop_logging
 import config
 from api import app, setup_api 
 from fastapi.staticfiles import StaticFiles
@@ -22,59 +24,48 @@ logger = logging.getLogger(__name__)
 device_manager: DeviceManager = None
 rules_engine: RulesEngine = None
 mqtt_client: MQTT_Client = None
+db_manager: DatabaseManager = None
+message_pipeline: MessagePipeline = None
+update_coalescer: UpdateCoalescer = None
+history_manager: HistoryManager = None
+device_sync: DeviceSyncEngine = None
 
-def determine_device_type(definition: dict) -> type:
+def process_device_message(device, topic, payload):
     """
-    Analizuje definicję urządzenia z Zigbee2MQTT i zwraca odpowiednią klasę Pythona.
+    Aktualizuje stan urządzenia i sprawdza reguły zależne od tego urządzenia.
+    Raport, który nie zmienia żadnej istotnej wartości, nie trafia do reguł.
     """
-    if(not definition or "exposes" not in definition):
-        return SocketDevice
-
-    exposes = definition.get("exposes", [])
-    features = []
-    
-    for item in exposes:
-        if(item.get("type") == "light"):
-            features.append("light")
-        if(item.get("name") in ["state", "switch"]):
-            features.append("switch")
-        if(item.get("features")):
-            for sub in item.get("features"):
-                if(sub.get("name") == "state"): features.append("switch")
-                if(sub.get("name") in ["brightness", "color_xy", "color_temp"]): features.append("light")
-    if("light" in features):
-        return LightDevice
-    if("switch" in features):
-        return SocketDevice
-    return SensorDevice
+    changed = device_manager.update_device(topic, payload, device=device)
+    if(not changed):
+        return
+    logger.debug("Odebrano zmiany z %s (%s): %s", device.name, device.device_id, changed, extra={"device_id": device.device_id, "sampled": True})
+    rules_engine.evaluate_state_change_rules(device.device_id, changed)
 
 def on_message_callback(topic, payload):
     """
     Główny router wiadomości MQTT.
     """
-    device = device_manager.get_device_by_topic(topic)
+    handle_message(topic, payload, device_manager.get_device_by_topic(topic))
+
+def handle_message(topic, payload, device):
+    """
+    Obsługuje wiadomość z już rozwiązanym urządzeniem (None - topic nie należy do żadnego urządzenia).
+    """
     if(device):
-        logger.info(f"Odebrano dane z {device.name} ({device.device_id}).")
-        device_manager.update_device(topic, payload)
-        rules_engine.evaluate_state_change_rules(device.device_id) 
+        if(update_coalescer and update_coalescer.submit(device, topic, payload)):
+            return
+        process_device_message(device, topic, payload)
         return
     if(topic == "zigbee2mqtt/bridge/devices"):
         logger.info("Odebrano listę urządzeń z Zigbee2MQTT. Synchronizacja...")
         if(isinstance(payload, list)):
-            for dev_data in payload:
-                if(dev_data.get("type") == "Coordinator"):
-                    continue
-                ieee_address = dev_data.get("ieee_address")
-                friendly_name = dev_data.get("friendly_name")
-                definition = dev_data.get("definition")
-                DeviceClass = determine_device_type(definition)
-                new_device = DeviceClass(
-                    device_id=ieee_address,
-                    name=friendly_name,
-                    topic=f"zigbee2mqtt/{friendly_name}"
-                )
-                device_manager.update_or_create_device(new_device)
-        logger.info("Zakończono synchronizację urządzeń.")
+            result = device_sync.sync(payload)
+            logger.info(f"Zakończono synchronizację urządzeń: dodano {result['added']}, zaktualizowano {result['updated']}, "
+                        f"usunięto {result['removed']}, bez zmian {result['skipped']}.")
+    elif(topic == "zigbee2mqtt/bridge/groups"):
+        device_manager.group_executor.handle_bridge_groups(payload)
+    elif(topic.startswith("zigbee2mqtt/bridge/response/group/")):
+        device_manager.group_executor.handle_bridge_response(topic, payload)
     elif(topic == "zigbee2mqtt/bridge/event"):
         event_type = payload.get("type")
         if(event_type == "device_rename"):
@@ -84,20 +75,64 @@ def on_message_callback(topic, payload):
             logger.info(f"Wykryto zmianę nazwy w Z2M: {old_name} -> {new_name}. Żądam odświeżenia listy...")
             mqtt_client.publish("zigbee2mqtt/bridge/request/devices/get", {})
 
-def run_api_server():
-    logger.info(f"Uruchomienie serwera API na http://{config.API_HOST}:{config.API_PORT}")
+def route_message(topic: str) -> tuple:
+    """
+    Rozwiązuje urządzenie raz, w wątku sieciowym MQTT. Zwraca klucz podziału wiadomości
+    między wątki robocze (ID urządzenia lub sam topic) i urządzenie, przekazywane do handle_message.
+    """
+    device = device_manager.get_device_by_topic(topic)
+    return (device.device_id if device else topic, device)
+
+def mount_frontend():
     if(os.path.exists(config.FRONTEND_DIR)):
         app.mount("/", StaticFiles(directory=config.FRONTEND_DIR, html=True), name="frontend")
         logger.info(f"Serwowanie aplikacji webowej z: {config.FRONTEND_DIR}")
     else:
         logger.warning(f"Nie znaleziono folderu frontend w: {config.FRONTEND_DIR}")
 
+def run_api_server():
+    logger.info(f"Uruchomienie serwera API na http://{config.API_HOST}:{config.API_PORT}")
+    mount_frontend()
+
     try:
         uvicorn.run(app, host=config.API_HOST, port=config.API_PORT, log_level="info")
     except Exception as e:
         logger.critical(f"KRYTYCZNY BŁĄD uruchomienia serwera Uvicorn/FastAPI: {e}")
         shutdown()
 
+async def run_async():
+    """
+    Tryb asyncio: gniazdo MQTT, reguły czasowe, zapis stanów i serwer API dzielą jedną pętlę zdarzeń.
+    Wiadomości MQTT są przetwarzane bezpośrednio w pętli, a zapisy do SQLite wykonuje osobny wątek zapisu;
+    SIGINT/SIGTERM najpierw zatrzymuje serwer Uvicorn.
+    """
+    loop = asyncio.get_running_loop()
+    device_manager.start_db_writer()
+    tasks = [
+        loop.create_task(rules_engine.run_time_loop_async()),
+        loop.create_task(device_manager.run_flush_loop_async()),
+        loop.create_task(device_manager.commands.run_async()),
+    ]
+    if(history_manager):
+        tasks.append(loop.create_task(history_manager.run_async()))
+    if(update_coalescer):
+        tasks.append(loop.create_task(update_coalescer.run_async()))
+
+    mqtt_client.on_message_callback = on_message_callback
+    mqtt_client.connect_in_loop(loop, BROKER_ADDRESS=config.BROKER_ADDRESS, BROKER_PORT=config.BROKER_PORT)
+
+    logger.info(f"Uruchomienie serwera API na http://{config.API_HOST}:{config.API_PORT} (tryb asyncio)")
+    mount_frontend()
+    server = uvicorn.Server(uvicorn.Config(app, host=config.API_HOST, port=config.API_PORT, log_level="info"))
+    try:
+        await server.serve()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Rozłączenie jeszcze w działającej pętli - paho zdejmuje wtedy gniazdo z selektora.
+        mqtt_client.disconnect()
+
 def shutdown(signal_received=None, frame=None):
     logger.critical("Otrzymano sygnał zakończenia (SIGINT/SIGTERM). Zatrzymywanie systemu...")
     if(rules_engine):
@@ -105,12 +140,43 @@ def shutdown(signal_received=None, frame=None):
             rules_engine.stop_time_loop()
         except Exception as e:
             logger.error(f"Błąd zatrzymywania pętli czasowej: {e}")
+        try:
+            rules_engine.actions.stop()
+        except Exception as e:
+            logger.error(f"Błąd zatrzymywania wykonywania akcji reguł: {e}")
     if(mqtt_client):
         try:
             mqtt_client.disconnect()
         except Exception as e:
             logger.error(f"Błąd rozłączania MQTT: {e}")
+    if(message_pipeline):
+        try:
+            message_pipeline.stop()
+        except Exception as e:
+            logger.error(f"Błąd zatrzymywania potoku wiadomości: {e}")
+    if(update_coalescer):
+        try:
+            update_coalescer.stop()
+        except Exception as e:
+            logger.error(f"Błąd zatrzymywania scalania aktualizacji: {e}")
+    if(device_manager):
+        try:
+            device_manager.commands.stop()
+        except Exception as e:
+            logger.error(f"Błąd zatrzymywania śledzenia komend: {e}")
+        try:
+            device_manager.stop_flush_loop()
+        except Exception as e:
+            logger.error(f"Błąd zapisu stanów urządzeń: {e}")
+    if(history_manager):
+        try:
+            history_manager.stop()
+        except Exception as e:
+            logger.error(f"Błąd zapisu historii odczytów: {e}")
+    if(db_manager):
+        db_manager.close()
     logger.info("Zamykanie procesów. System zatrzymany.")
+    stop_logging()
     os._exit(0)
 
 def check_and_create_data_dir():
@@ -129,13 +195,39 @@ if(__name__ == "__main__"):
     mqtt_client = MQTT_Client() 
     device_manager = DeviceManager(db_manager=db_manager) 
     rules_engine = RulesEngine(db_manager=db_manager) 
+    device_sync = DeviceSyncEngine(device_manager)
     
     rules_engine.setup(device_manager, mqtt_client)
-    mqtt_client.on_message_callback = on_message_callback
+    if(config.HISTORY_ENABLED):
+        history_manager = HistoryManager(db_manager=db_manager)
+        device_manager.add_listener(history_manager.on_device_event)
+        if(not config.ASYNC_MODE):
+            history_manager.start()
+    if(config.COALESCE_WINDOWS):
+        update_coalescer = UpdateCoalescer(handler=process_device_message, transition_check=rules_engine.is_transition)
+        if(not config.ASYNC_MODE):
+            update_coalescer.start()
+    if(config.ASYNC_MODE):
+        setup_api(device_manager, rules_engine, mqtt_client, None, history_manager)
+        # Uvicorn przywraca te handlery po zatrzymaniu serwera i ponawia na nich odebrany sygnał.
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+        asyncio.run(run_async())
+        shutdown()
+
+    if(config.MQTT_WORKERS > 0):
+        message_pipeline = MessagePipeline(handler=handle_message, router=route_message)
+        message_pipeline.start()
+        mqtt_client.on_message_callback = message_pipeline.submit
+    else:
+        mqtt_client.on_message_callback = on_message_callback
 
+    rules_engine.actions.start()
     rules_engine.start_time_loop()
+    device_manager.start_flush_loop()
+    device_manager.commands.start()
     mqtt_client.connect(BROKER_ADDRESS=config.BROKER_ADDRESS, BROKER_PORT=config.BROKER_PORT)
-    setup_api(device_manager, rules_engine, mqtt_client)
+    setup_api(device_manager, rules_engine, mqtt_client, message_pipeline, history_manager)
     api_thread = threading.Thread(target=run_api_server, daemon=True)
     api_thread.start()
     
@@ -0,0 +1,67 @@
+import threading
+import time
+from core.action_dispatcher import ActionDispatcher
+
+def test_identical_commands_in_one_batch_are_executed_once():
+    executed = []
+    dispatcher = ActionDispatcher(lambda target, command, value: executed.append((target, command, value)), workers=0)
+
+    with dispatcher.batch():
+        dispatcher.submit("r1", "lamp", "turn_on", {"brightness": 100})
+        dispatcher.submit("r2", "lamp", "turn_on", {"brightness": 100})
+        dispatcher.submit("r3", "lamp", "turn_off")
+        assert executed == []
+
+    assert executed == [("lamp", "turn_on", {"brightness": 100}), ("lamp", "turn_off", None)]
+    metrics = dispatcher.get_metrics()
+    assert (metrics["submitted"], metrics["executed"], metrics["deduplicated"]) == (3, 2, 1)
+    assert metrics["latency_ms"]["samples"] == 2
+
+def test_actions_keep_order_per_target_and_run_in_parallel_across_targets():
+    executed = []
+    slow_started = threading.Event()
+    release_slow = threading.Event()
+
+    def executor(target, command, value):
+        if(target == "slow"):
+            slow_started.set()
+            release_slow.wait(timeout=5)
+        executed.append((target, value))
+
+    dispatcher = ActionDispatcher(executor, workers=4, queue_size=40)
+    # Cel "fast" nie może trafić do tego samego wątku co zablokowany "slow".
+    fast = next(t for t in (f"fast{i}" for i in range(100)) if hash(t) % 4 != hash("slow") % 4)
+    dispatcher.start()
+    try:
+        dispatcher.submit("r", "slow", "set", 1)
+        assert slow_started.wait(timeout=5)
+        dispatcher.submit("r", "slow", "set", 2)
+        for value in range(5):
+            dispatcher.submit("r", fast, "set", value)
+        deadline = time.monotonic() + 5
+        while(len(executed) < 5 and time.monotonic() < deadline):
+            time.sleep(0.01)
+        assert executed == [(fast, value) for value in range(5)]
+        release_slow.set()
+    finally:
+        release_slow.set()
+        dispatcher.stop()
+
+    assert [value for target, value in executed if target == "slow"] == [1, 2]
+    assert dispatcher.get_metrics()["executed"] == 7
+
+def test_failing_action_is_counted_and_does_not_stop_others():
+    executed = []
+
+    def executor(target, command, value):
+        if(target == "broken"):
+            raise RuntimeError("brak połączenia")
+        executed.append(target)
+
+    dispatcher = ActionDispatcher(executor, workers=0)
+    with dispatcher.batch():
+        dispatcher.submit("r1", "broken", "on")
+        dispatcher.submit("r2", "lamp", "on")
+
+    assert executed == ["lamp"]
+    assert dispatcher.get_metrics()["errors"] == 1
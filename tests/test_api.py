@@ -1,38 +1,32 @@
 import pytest
+import asyncio
 from fastapi.testclient import TestClient
 from api import app, setup_api
 from core.device_manager import DeviceManager
 from core.rule_engine import RulesEngine
 from core.mqtt_client import MQTT_Client
 from core.database import DatabaseManager
+from core.event_stream import EventBroadcaster
 import config
-import os
 
 # --- Konfiguracja Testowego API ---
-# Ten kod jest uruchamiany RAZ, gdy pytest importuje ten plik.
+# Menedżery i klient są tworzone RAZ dla całego pliku, na bazie w katalogu tymczasowym.
 
-TEST_DB_PATH = os.path.join(config.DATA_DIR, "test_smarthome.db")
+device_manager: DeviceManager = None
+client: TestClient = None
 
-# Usuwamy starą bazę testową na wypadek, gdyby istniała
-if os.path.exists(TEST_DB_PATH):
-    os.remove(TEST_DB_PATH)
-
-# POPRAWKA: Tworzymy jedną instancję DB Managera dla wszystkich testów w tym pliku
-test_db_manager = DatabaseManager(db_path=TEST_DB_PATH)
-
-# POPRAWKA: Tworzymy instancje menedżerów w nowy, poprawny sposób, wstrzykując zależność
-device_manager = DeviceManager(db_manager=test_db_manager)
-rules_engine = RulesEngine(db_manager=test_db_manager)
-mqtt_client = MQTT_Client()
-
-# Konfigurujemy zależności między menedżerami
-rules_engine.setup(device_manager, mqtt_client)
-
-# Wstrzykujemy gotowe, skonfigurowane instancje do aplikacji FastAPI
-setup_api(device_manager, rules_engine, mqtt_client)
-
-# Tworzymy klienta testowego, który będzie używany przez wszystkie testy
-client = TestClient(app)
+@pytest.fixture(scope="module", autouse=True)
+def api_instances(tmp_path_factory):
+    global device_manager, client
+    test_db_manager = DatabaseManager(db_path=str(tmp_path_factory.mktemp("api") / "test_smarthome.db"))
+    device_manager = DeviceManager(db_manager=test_db_manager)
+    rules_engine = RulesEngine(db_manager=test_db_manager)
+    mqtt_client = MQTT_Client()
+    rules_engine.setup(device_manager, mqtt_client)
+    setup_api(device_manager, rules_engine, mqtt_client)
+    client = TestClient(app)
+    yield
+    test_db_manager.close()
 
 # --- Testy Właściwe (te funkcje nie wymagają zmian) ---
 
@@ -64,20 +58,98 @@ def test_api_deleting_nonexistent_rule_returns_404():
 
 def test_api_adding_duplicate_rule_returns_409():
     """Sprawdza, czy próba dodania reguły o istniejącym ID zwraca błąd 409 (Conflict)."""
-    rule_payload = { "id": "duplicate_rule", "name": "N", "trigger": {}, "action": {}}
+    rule_payload = {
+        "id": "duplicate_rule", "name": "N",
+        "trigger": {"device_id": "d1", "key": "k", "operator": "eq", "value": "v"},
+        "action": {"device_id": "d2", "command": "c"}
+    }
     client.post("/rules", json=rule_payload)
     response2 = client.post("/rules", json=rule_payload)
     assert response2.status_code == 409
     client.delete("/rules/duplicate_rule") # Sprzątanie
 
+def test_api_malformed_rule_returns_400():
+    """Sprawdza, czy reguła z nieznanym operatorem jest odrzucana przy dodawaniu (400 Bad Request)."""
+    rule_payload = {
+        "id": "malformed_rule", "name": "N",
+        "trigger": {"device_id": "d1", "key": "k", "operator": "between", "value": 1},
+        "action": {"device_id": "d2", "command": "c"}
+    }
+    response = client.post("/rules", json=rule_payload)
+    assert response.status_code == 400
+    assert not any(r["id"] == "malformed_rule" for r in client.get("/rules").json()["rules"])
+
 def test_api_invalid_payload_returns_422():
     """Sprawdza, czy wysłanie niekompletnych danych (bez ID) zwraca błąd 422 (Unprocessable Entity)."""
     invalid_payload = {"name": "Reguła bez ID", "trigger": {}, "action": {}}
     response = client.post("/rules", json=invalid_payload)
     assert response.status_code == 422
 
+def test_api_action_wait_is_capped_and_reports_pending(monkeypatch):
+    """Oczekiwanie na potwierdzenie jest ograniczone niezależnie od ponowień - potem 202 ze statusem 'pending'."""
+    from core.devices_types import SocketDevice
+    monkeypatch.setattr(config, "COMMAND_WAIT_TIMEOUT_SECONDS", 0.05)
+    device_manager.add_device(SocketDevice("wait_plug", "Gniazdko", "zigbee2mqtt/wait_plug"))
+    try:
+        response = client.post("/devices/action?wait=true", json={"device_id": "wait_plug", "action": "turn_on"})
+        assert response.status_code == 202
+        assert response.json()["command"]["status"] == "pending"
+    finally:
+        device_manager.commands.on_report("wait_plug", {"state": "ON"})
+        device_manager.remove_device("wait_plug")
+
 def test_api_perform_action_on_nonexistent_device_returns_404():
     """Sprawdza, czy wykonanie akcji na nieistniejącym urządzeniu zwraca błąd 404."""
     action_payload = {"device_id": "ghost_device", "action": "turn_on"}
     response = client.post("/devices/action", json=action_payload)
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+def test_event_broadcaster_delivers_serialized_event_to_subscriber():
+    """Sprawdza, czy zdarzenie z wątku menedżera trafia do kolejki klienta strumienia w pętli asyncio."""
+
+    async def scenario():
+        broadcaster = EventBroadcaster(queue_size=10)
+        subscription = broadcaster.subscribe(asyncio.get_running_loop())
+        broadcaster.publish({"seq": 7, "type": "state", "device_id": "d1", "state": {"a": 1}})
+        seq, message = await asyncio.wait_for(subscription.queue.get(), timeout=1)
+        broadcaster.unsubscribe(subscription)
+        return seq, message, broadcaster.client_count
+
+    seq, message, clients_left = asyncio.run(scenario())
+    assert seq == 7
+    assert message.startswith("id: 7\nevent: state\ndata: ")
+    assert clients_left == 0
+
+def test_get_endpoints_return_etag_and_304_when_unchanged():
+    for path in ("/devices", "/groups", "/rules"):
+        response = client.get(path)
+        etag = response.headers["etag"]
+        assert response.status_code == 200
+
+        response_cached = client.get(path, headers={"If-None-Match": etag})
+        assert response_cached.status_code == 304
+        assert response_cached.headers["etag"] == etag
+
+def test_rules_etag_changes_after_mutation():
+    etag = client.get("/rules").headers["etag"]
+    rule_payload = {
+        "id": "etag_rule", "name": "Reguła ETag", "active": True,
+        "trigger": {"device_id": "d1", "key": "k", "operator": "eq", "value": "v"},
+        "action": {"device_id": "d2", "command": "c"}
+    }
+    client.post("/rules", json=rule_payload)
+
+    response = client.get("/rules", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert any(r["id"] == "etag_rule" for r in response.json()["rules"])
+    client.delete("/rules/etag_rule")
+
+def test_groups_json_is_cached_until_groups_change():
+    version, body = device_manager.get_groups_json()
+    assert device_manager.get_groups_json()[1] is body
+
+    device_manager.create_group("etag_group", "Grupa ETag", [])
+    new_version, new_body = device_manager.get_groups_json()
+    assert new_version > version
+    assert b"etag_group" in new_body
+    device_manager.delete_group("etag_group")
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import threading
+from core.async_runtime import LoopEvent
+from core.mqtt_client import MQTT_Client
+
+async def read_packet(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    header = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    while(True):
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if(not byte & 0x80):
+            break
+    return header, await reader.readexactly(length)
+
+def publish_packet(topic: str, payload: dict) -> bytes:
+    body = len(topic).to_bytes(2, "big") + topic.encode() + json.dumps(payload).encode()
+    return bytes([0x30, len(body)]) + body
+
+async def fake_broker(reader, writer):
+    """Minimalny broker MQTT: CONNACK, SUBACK i jedna wiadomość PUBLISH."""
+    await read_packet(reader)
+    writer.write(bytes([0x20, 0x02, 0x00, 0x00]))
+    header, body = await read_packet(reader)
+    assert header & 0xF0 == 0x80
+    writer.write(bytes([0x90, 0x03]) + body[:2] + bytes([0x00]))
+    writer.write(publish_packet("zigbee2mqtt/plug", {"power": 5}))
+    await writer.drain()
+    try:
+        await reader.read()
+    finally:
+        writer.close()
+
+def test_mqtt_messages_are_handled_on_the_event_loop_thread():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(fake_broker, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        received = loop.create_future()
+        client = MQTT_Client(on_message_callback=lambda topic, payload: received.set_result((topic, payload, threading.get_ident())))
+
+        client.connect_in_loop(loop, BROKER_ADDRESS="127.0.0.1", BROKER_PORT=port)
+        topic, payload, thread_id = await asyncio.wait_for(received, timeout=5)
+        client.disconnect()
+        server.close()
+        return topic, payload, thread_id
+
+    topic, payload, thread_id = asyncio.run(scenario())
+    assert topic == "zigbee2mqtt/plug"
+    assert payload == {"power": 5}
+    assert thread_id == threading.get_ident()
+
+def test_loop_event_can_be_set_from_another_thread():
+    async def scenario():
+        event = LoopEvent(asyncio.get_running_loop())
+        threading.Timer(0.05, event.set).start()
+        started = asyncio.get_running_loop().time()
+        await event.wait(timeout=5)
+        return asyncio.get_running_loop().time() - started
+
+    assert asyncio.run(scenario()) < 1
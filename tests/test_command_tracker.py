@@ -0,0 +1,88 @@
+import asyncio
+import threading
+from core.command_tracker import (CommandTracker, COMMAND_CONFIRMED, COMMAND_FAILED, COMMAND_PENDING,
+                                  COMMAND_SUPERSEDED, COMMAND_UNTRACKED)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_tracker(**options):
+    clock = FakeClock()
+    return CommandTracker(timeout=1, retries=2, backoff=2, clock=clock, **options), clock
+
+def test_matching_report_confirms_command_and_records_latency():
+    tracker, clock = make_tracker()
+    command = tracker.track("lamp", "zigbee2mqtt/lamp/set", {"state": "ON", "brightness": 120}, send=lambda: None)
+
+    clock.now += 0.2
+    tracker.on_report("lamp", {"state": "ON", "brightness": 80})
+    assert command.status == COMMAND_PENDING
+    clock.now += 0.1
+    tracker.on_report("lamp", {"state": "ON", "brightness": 120, "linkquality": 90})
+
+    assert command.wait(0) == COMMAND_CONFIRMED
+    assert round(command.latency, 3) == 0.3
+    metrics = tracker.get_metrics()
+    assert metrics["confirmed"] == 1 and metrics["pending"] == 0
+    assert metrics["latency_ms"]["lamp"]["last"] == 300.0
+
+def test_unconfirmed_command_is_retried_with_backoff_then_fails():
+    tracker, clock = make_tracker()
+    sent = []
+    command = tracker.track("plug", "zigbee2mqtt/plug/set", {"state": "OFF"}, send=lambda: sent.append(clock.now))
+
+    for _ in range(40):
+        clock.now += 0.25
+        tracker.run_due()
+
+    # Ponowienia po 1 s i po kolejnych 2 s (z dokładnością do taktu); po następnych 4 s komenda jest nieudana.
+    assert [round(moment - 1000, 2) for moment in sent] == [1.25, 3.5]
+    assert command.status == COMMAND_FAILED and command.attempts == 3
+    assert tracker.get_metrics()["retried"] == 2 and tracker.get_metrics()["failed"] == 1
+    assert tracker.pending("plug") is None
+
+def test_new_command_supersedes_pending_one():
+    tracker, clock = make_tracker()
+    first = tracker.track("plug", "t", {"state": "ON"}, send=lambda: None)
+    second = tracker.track("plug", "t", {"state": "OFF"}, send=lambda: None)
+
+    tracker.on_report("plug", {"state": "OFF"})
+
+    assert first.status == COMMAND_SUPERSEDED
+    assert second.status == COMMAND_CONFIRMED
+
+def test_command_without_reportable_values_is_not_tracked():
+    tracker, _ = make_tracker()
+    command = tracker.track("lamp", "t", {"color": {"hex": "#ff0000"}}, send=lambda: None)
+
+    assert command.wait(0) == COMMAND_UNTRACKED
+    assert len(tracker) == 0
+
+def test_numeric_values_are_confirmed_within_tolerance():
+    tracker, _ = make_tracker(tolerance=0.02, min_tolerance=1)
+    command = tracker.track("lamp", "t", {"brightness": 255, "color_temp": 370}, send=lambda: None)
+
+    tracker.on_report("lamp", {"brightness": 254, "color_temp": 360})
+    assert command.status == COMMAND_PENDING
+    tracker.on_report("lamp", {"color_temp": 366})
+    assert command.status == COMMAND_CONFIRMED
+
+def test_wait_async_is_resolved_from_another_thread():
+    tracker, _ = make_tracker()
+    command = tracker.track("plug", "t", {"state": "ON"}, send=lambda: None)
+
+    async def scenario():
+        asyncio.get_running_loop().call_later(0.05, lambda: threading.Thread(target=tracker.on_report, args=("plug", {"state": "ON"})).start())
+        return await command.wait_async(5)
+
+    assert asyncio.run(scenario()) == COMMAND_CONFIRMED
+
+def test_wait_async_returns_pending_after_timeout():
+    tracker, _ = make_tracker()
+    command = tracker.track("plug", "t", {"state": "ON"}, send=lambda: None)
+
+    assert asyncio.run(command.wait_async(0.01)) == COMMAND_PENDING
@@ -1,5 +1,8 @@
+import gc
 import pytest
-from core.database import DatabaseManager
+import sqlite3
+import threading
+from core.database import DatabaseManager, SCHEMA_VERSION
 
 @pytest.fixture
 def mem_db():
@@ -53,7 +56,7 @@ def test_save_new_device_with_config(mem_db):
     device = devices_from_db[0]
     assert device["id"] == "light_1"
     assert device["name"] == "Lampa Salon"
-    assert device["state"] == '{"state": "ON", "brightness": 150}' # Stan jest zapisywany jako JSON string
+    assert device["state"] == {"state": "ON", "brightness": 150} # Stan jest zapisywany per klucz w device_state
 
 def test_update_existing_device_state_only(mem_db):
     """Testuje aktualizację TYLKO STANU istniejącego urządzenia (operacja UPDATE)."""
@@ -61,7 +64,181 @@ def test_update_existing_device_state_only(mem_db):
     mem_db.save_device_state("d1", {"state": "OFF"}, save_config=True, device_data=device_data)
 
     mem_db.save_device_state("d1", {"state": "ON", "power": 12.5}, save_config=False)
+    mem_db.save_device_state("d1", {"power": 3}, save_config=False)
 
     device = mem_db.get_all_devices_data()[0]
     assert device["name"] == "Gniazdko" # Konfiguracja nie powinna się zmienić
-    assert device["state"] == '{"state": "ON", "power": 12.5}'
\ No newline at end of file
+    assert device["state"] == {"state": "ON", "power": 3} # Zapis częściowy nie usuwa pozostałych kluczy
+def test_save_device_states_in_batch(mem_db):
+    """Testuje zbiorczy zapis stanów wielu urządzeń (executemany w jednej transakcji)."""
+    for device_id in ("a", "b"):
+        device_data = {"id": device_id, "name": device_id, "topic": device_id, "type": "sensor"}
+        mem_db.save_device_state(device_id, {}, save_config=True, device_data=device_data)
+
+    mem_db.save_device_states([("a", {"temp": 1}), ("b", {"temp": 2})])
+
+    states = {d["id"]: d["state"] for d in mem_db.get_all_devices_data()}
+    assert states == {"a": {"temp": 1}, "b": {"temp": 2}}
+
+def test_file_database_uses_wal_and_connection_per_thread(tmp_path):
+    """Sprawdza tryb WAL oraz to, że każdy wątek dostaje własne połączenie."""
+    db = DatabaseManager(db_path=str(tmp_path / "wal.db"))
+    main_conn = db._get_connection()
+    assert main_conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+
+    other = {}
+    worker = threading.Thread(target=lambda: other.setdefault("conn", db._get_connection()))
+    worker.start()
+    worker.join()
+
+    assert other["conn"] is not main_conn
+    assert db._get_connection() is main_conn
+    db.close()
+
+def test_thread_connection_is_closed_when_thread_ends(tmp_path):
+    """Połączenia krótkotrwałych wątków (pule wykonawców) są zamykane razem z wątkiem."""
+    db = DatabaseManager(db_path=str(tmp_path / "threads.db"))
+    db._get_connection()
+
+    def worker():
+        db._execute_read("SELECT 1;").fetchone()
+
+    for _ in range(5):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    assert len(db._connections) == 1
+    db.close()
+
+def test_memory_database_reads_are_safe_across_threads(mem_db):
+    """Współdzielone połączenie bazy ':memory:' jest używane przez wiele wątków jednocześnie."""
+    mem_db.save_device_state("a", {"temp": 1}, save_config=True, device_data={"id": "a", "name": "a", "topic": "a", "type": "sensor"})
+    errors = []
+
+    def worker(index):
+        try:
+            for value in range(50):
+                mem_db.save_device_state("a", {"temp": value, f"k{index}": value})
+                assert mem_db.get_device_state("a", keys=["temp"])["temp"] in range(50)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+def test_state_values_keep_types_and_can_be_filtered_in_sql(mem_db):
+    """Sprawdza zapis wartości różnych typów oraz filtrowanie stanu po stronie SQL."""
+    for device_id, state in (("a", {"state": "ON", "occupancy": True, "color": {"x": 0.3}}), ("b", {"state": "OFF", "occupancy": False})):
+        device_data = {"id": device_id, "name": device_id, "topic": device_id, "type": "sensor"}
+        mem_db.save_device_state(device_id, state, save_config=True, device_data=device_data)
+
+    assert mem_db.get_device_state("a") == {"state": "ON", "occupancy": True, "color": {"x": 0.3}}
+    assert mem_db.get_device_state("a", keys=["occupancy"]) == {"occupancy": True}
+    assert mem_db.find_devices_by_state("state", "OFF") == ["b"]
+    assert mem_db.find_devices_by_state("occupancy", True) == ["a"]
+
+# --- Testy dla grup ---
+
+def test_group_members_are_updated_individually(mem_db):
+    mem_db.add_group("g1", "Salon", ["a", "b"])
+    mem_db.add_group_member("g1", "c")
+    assert mem_db.remove_group_member("g1", "a") is True
+
+    assert mem_db.get_all_groups() == [{"id": "g1", "name": "Salon", "members": ["b", "c"]}]
+
+def test_removing_device_removes_it_from_groups(mem_db):
+    mem_db.save_device_state("a", {"state": "ON"}, save_config=True, device_data={"id": "a", "name": "a", "topic": "a", "type": "socket"})
+    mem_db.add_group("g1", "Salon", ["a", "b"])
+
+    assert mem_db.remove_device("a") is True
+    assert mem_db.get_all_groups()[0]["members"] == ["b"]
+    assert mem_db.get_device_state("a") == {}
+
+# --- Migracja schematu ---
+
+def test_migrates_json_columns_from_previous_schema(tmp_path):
+    """Baza w starym schemacie (JSON w kolumnach) jest przenoszona do tabel znormalizowanych."""
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE devices (id TEXT PRIMARY KEY, name TEXT NOT NULL, topic TEXT NOT NULL, type TEXT NOT NULL, state TEXT, attributes TEXT);
+        CREATE TABLE rules (id TEXT PRIMARY KEY, name TEXT NOT NULL, active INTEGER NOT NULL, trigger TEXT NOT NULL, action TEXT NOT NULL);
+        CREATE TABLE groups (id TEXT PRIMARY KEY, name TEXT NOT NULL, members TEXT NOT NULL);
+        INSERT INTO devices VALUES ('0x01', 'Lampa', 'zigbee2mqtt/Lampa', 'light', '{"state": "ON", "brightness": 120}', '["state", "brightness"]');
+        INSERT INTO rules VALUES ('r1', 'R', 1, '{"device_id": "0x01", "key": "state", "operator": "eq", "value": "ON"}', '{"device_id": "0x02", "command": "turn_on"}');
+        INSERT INTO groups VALUES ('g1', 'Salon', '["0x01"]');
+    """)
+    conn.commit()
+    conn.close()
+
+    db = DatabaseManager(db_path=path)
+
+    assert db._execute_read("PRAGMA user_version;").fetchone()[0] == SCHEMA_VERSION
+    device = db.get_all_devices_data()[0]
+    assert device["state"] == {"state": "ON", "brightness": 120}
+    assert device["attributes"] == ["state", "brightness"]
+    assert db.get_all_groups() == [{"id": "g1", "name": "Salon", "members": ["0x01"]}]
+    assert [r["id"] for r in db.get_rules_data_for_device("0x01")] == ["r1"]
+    assert db.get_all_rules_data()[0]["action"] == {"device_id": "0x02", "command": "turn_on"}
+    db.close()
+
+def test_migrates_baseline_file_database_without_drop_column(tmp_path, monkeypatch):
+    """Migracja pliku bazy w schemacie bazowym odtwarza tabele zamiast ALTER TABLE ... DROP COLUMN (SQLite < 3.35)."""
+    path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS devices (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            type TEXT NOT NULL,
+            state TEXT,
+            attributes TEXT
+        );
+        CREATE TABLE IF NOT EXISTS rules (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            active INTEGER NOT NULL,
+            trigger TEXT NOT NULL,
+            action TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS groups (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            members TEXT NOT NULL
+        );
+        INSERT INTO devices VALUES ('0x01', 'Lampa', 'zigbee2mqtt/Lampa', 'light', '{"state": "OFF"}', '["state"]');
+        INSERT INTO devices VALUES ('0x02', 'Gniazdko', 'zigbee2mqtt/Gniazdko', 'socket', NULL, NULL);
+        INSERT INTO groups VALUES ('g1', 'Salon', '["0x01", "0x02"]');
+    """)
+    conn.commit()
+    conn.close()
+
+    statements = []
+    connect = sqlite3.connect
+    def traced_connect(*args, **kwargs):
+        traced = connect(*args, **kwargs)
+        traced.set_trace_callback(statements.append)
+        return traced
+    monkeypatch.setattr(sqlite3, "connect", traced_connect)
+
+    db = DatabaseManager(db_path=path)
+
+    assert not [statement for statement in statements if("DROP COLUMN" in statement.upper())]
+    assert db._columns(db._get_connection(), "devices") == {"id", "name", "topic", "type"}
+    assert db._columns(db._get_connection(), "groups") == {"id", "name"}
+    assert {d["id"]: d["state"] for d in db.get_all_devices_data()} == {"0x01": {"state": "OFF"}, "0x02": {}}
+    assert db.get_all_groups() == [{"id": "g1", "name": "Salon", "members": ["0x01", "0x02"]}]
+    db.close()
+
+    reopened = DatabaseManager(db_path=path)
+    assert reopened._execute_read("PRAGMA user_version;").fetchone()[0] == SCHEMA_VERSION
+    assert len(reopened.get_all_devices_data()) == 2
+    reopened.close()
@@ -0,0 +1,159 @@
+import pytest
+import threading
+from core.device_manager import DeviceManager
+from core.devices_types import SensorDevice, SocketDevice
+from core.database import DatabaseManager
+
+# --- Fixture ---
+@pytest.fixture
+def manager():
+    """Zapewnia DeviceManager z bazą w pamięci RAM."""
+    mem_db = DatabaseManager(db_path=":memory:")
+    yield DeviceManager(db_manager=mem_db)
+
+# --- Testy indeksu topiców ---
+
+def test_get_device_by_exact_topic_and_subtopic(manager):
+    sensor = SensorDevice(device_id="0x01", name="Czujnik", topic="zigbee2mqtt/Czujnik")
+    manager.add_device(sensor)
+
+    assert manager.get_device_by_topic("zigbee2mqtt/Czujnik") is sensor
+    assert manager.get_device_by_topic("zigbee2mqtt/Czujnik/availability") is sensor
+    assert manager.get_device_by_topic("zigbee2mqtt/Czujnik2") is None
+    assert manager.get_device_by_topic("zigbee2mqtt") is None
+
+def test_topic_index_follows_rename_and_removal(manager):
+    manager.update_or_create_device(SocketDevice(device_id="0x02", name="Stara", topic="zigbee2mqtt/Stara"))
+    manager.update_or_create_device(SocketDevice(device_id="0x02", name="Nowa", topic="zigbee2mqtt/Nowa"))
+
+    assert manager.get_device_by_topic("zigbee2mqtt/Stara") is None
+    assert manager.get_device_by_topic("zigbee2mqtt/Nowa").device_id == "0x02"
+
+    manager.remove_device("0x02")
+    assert manager.get_device_by_topic("zigbee2mqtt/Nowa") is None
+
+def test_topic_index_follows_type_change(manager):
+    manager.update_or_create_device(SensorDevice(device_id="0x03", name="X", topic="zigbee2mqtt/X"))
+    manager.update_or_create_device(SocketDevice(device_id="0x03", name="X", topic="zigbee2mqtt/X"))
+
+    assert isinstance(manager.get_device_by_topic("zigbee2mqtt/X"), SocketDevice)
+
+def test_topic_index_is_rebuilt_on_load(manager):
+    manager.add_device(SensorDevice(device_id="0x04", name="Y", topic="zigbee2mqtt/Y"))
+    manager.load_from_db()
+
+    assert manager.get_device_by_topic("zigbee2mqtt/Y/availability").device_id == "0x04"
+
+# --- Testy zapisu write-behind ---
+
+def test_write_behind_defers_state_until_flush(manager):
+    sensor = SensorDevice(device_id="0x05", name="Z", topic="zigbee2mqtt/Z")
+    manager.add_device(sensor)
+
+    manager.update_device("zigbee2mqtt/Z", {"temperature": 21.5})
+    stored = manager.db_manager.get_all_devices_data()[0]
+    assert "temperature" not in stored["state"]
+
+    assert manager.flush_states() == 1
+    stored = manager.db_manager.get_all_devices_data()[0]
+    assert stored["state"]["temperature"] == 21.5
+    assert manager.flush_states() == 0
+
+def test_stop_flush_loop_persists_pending_states(manager):
+    manager.add_device(SensorDevice(device_id="0x06", name="W", topic="zigbee2mqtt/W"))
+    manager.start_flush_loop()
+    manager.update_device("zigbee2mqtt/W", {"humidity": 40})
+    manager.stop_flush_loop()
+
+    stored = manager.db_manager.get_all_devices_data()[0]
+    assert stored["state"]["humidity"] == 40
+
+# --- Testy zdarzeń zmian stanu ---
+
+def test_state_updates_emit_sequenced_deltas(manager):
+    events = []
+    manager.add_device(SensorDevice(device_id="0x07", name="E", topic="zigbee2mqtt/E"))
+    manager.add_listener(events.append)
+    seq, devices = manager.get_snapshot()
+
+    manager.update_device("zigbee2mqtt/E", {"temperature": 19})
+    manager.remove_device("0x07")
+
+    assert [d["id"] for d in devices] == ["0x07"]
+    state_events = [e for e in events if e["type"] == "state"]
+    assert state_events == [{"seq": state_events[0]["seq"], "type": "state", "device_id": "0x07", "state": {"temperature": 19}}]
+    assert events[-1]["type"] == "device_removed"
+    assert [e["seq"] for e in events] == list(range(seq + 1, seq + 1 + len(events)))
+
+def test_removing_unknown_device_emits_nothing(manager):
+    events = []
+    manager.add_listener(events.append)
+    seq, _ = manager.get_snapshot()
+
+    assert manager.remove_device("0xghost") is False
+    assert events == []
+    assert manager.get_snapshot()[0] == seq
+
+# --- Testy zapisu tylko zmienionych kluczy ---
+
+def test_repeated_report_changes_nothing(manager):
+    events = []
+    manager.add_device(SensorDevice(device_id="0x08", name="R", topic="zigbee2mqtt/R"))
+    manager.flush_states()
+    manager.add_listener(events.append)
+
+    assert manager.update_device("zigbee2mqtt/R", {"temperature": 20.5, "battery": 90}) == ["temperature", "battery"]
+    assert manager.update_device("zigbee2mqtt/R", {"temperature": 20.5, "battery": 90}) == []
+    assert manager.update_device("zigbee2mqtt/R", {"temperature": 20.5, "battery": 89}) == ["battery"]
+
+    assert [e["state"] for e in events if e["type"] == "state"] == [{"temperature": 20.5, "battery": 90}, {"battery": 89}]
+
+def test_volatile_keys_are_not_persisted(manager):
+    manager.add_device(SensorDevice(device_id="0x09", name="V", topic="zigbee2mqtt/V"))
+    manager.flush_states()
+
+    assert manager.update_device("zigbee2mqtt/V", {"linkquality": 120, "last_seen": "2024-01-01T10:00:00"}) == []
+    assert manager.flush_states() == 0
+    assert manager.get_device("0x09").state["linkquality"] == 120
+
+    assert manager.update_device("zigbee2mqtt/V", {"linkquality": 80, "humidity": 51}) == ["humidity"]
+    manager.flush_states()
+    stored = manager.db_manager.get_all_devices_data()[0]["state"]
+    assert stored["humidity"] == 51 and "linkquality" not in stored
+
+def test_unchanged_state_report_confirms_command(manager):
+    class FakeMqtt:
+        def __init__(self):
+            self.published = []
+        def publish(self, topic, payload):
+            self.published.append((topic, payload))
+
+    mqtt = FakeMqtt()
+    plug = SocketDevice(device_id="0x08", name="P", topic="zigbee2mqtt/P")
+    manager.add_device(plug)
+    manager.update_device("zigbee2mqtt/P", {"state": "ON"})
+
+    assert manager.perform_action(mqtt, "0x08", "turn_on") is True
+    command = manager.commands.pending("0x08")
+    assert mqtt.published == [("zigbee2mqtt/P/set", {"state": "ON"})]
+
+    # Urządzenie już było włączone - raport nie zmienia stanu, ale potwierdza komendę.
+    assert manager.update_device("zigbee2mqtt/P", {"state": "ON"}) == []
+    assert command.status == "confirmed"
+
+def test_db_writer_moves_writes_off_the_calling_thread():
+    """Tryb asyncio: zapis stanu bez write-behind i nowych atrybutów nie blokuje wątku pętli zdarzeń."""
+    db = DatabaseManager(db_path=":memory:")
+    manager = DeviceManager(db_manager=db, write_behind=False)
+    manager.add_device(SocketDevice("plug", "Gniazdko", "zigbee2mqtt/plug"))
+    writer_threads = set()
+    save_device_state = db.save_device_state
+    db.save_device_state = lambda *args, **kwargs: (writer_threads.add(threading.current_thread().name), save_device_state(*args, **kwargs))
+
+    manager.start_db_writer()
+    manager.update_device("zigbee2mqtt/plug", {"power": 12})
+    manager.stop_db_writer()
+
+    assert len(writer_threads) == 1 and next(iter(writer_threads)).startswith("db-writer")
+    assert db.get_device_state("plug")["power"] == 12
+    assert db.get_all_devices_data()[0]["attributes"] == ["power"]
@@ -0,0 +1,104 @@
+import pytest
+import threading
+from core.device_state import DeviceState, KEY_TABLE
+from core.devices_types import LightDevice, SensorDevice
+
+def test_behaves_like_dict():
+    state = DeviceState({"state": "ON", "brightness": 120, "temperature": 21.5, "color_mode": "xy"})
+
+    assert dict(state) == {"state": "ON", "brightness": 120, "temperature": 21.5, "color_mode": "xy"}
+    assert len(state) == 4
+    assert "brightness" in state and "power" not in state
+    assert state.get("power") is None
+
+    state["brightness"] = 200
+    del state["color_mode"]
+    assert dict(state) == {"state": "ON", "brightness": 200, "temperature": 21.5}
+    with pytest.raises(KeyError):
+        del state["color_mode"]
+
+def test_numeric_values_keep_their_type():
+    state = DeviceState({"battery": 87, "voltage": 2985, "humidity": 48.2})
+
+    assert state["battery"] == 87 and isinstance(state["battery"], int)
+    assert state["humidity"] == 48.2 and isinstance(state["humidity"], float)
+
+    state["battery"] = 86.5
+    assert isinstance(state["battery"], float)
+
+def test_non_numeric_values_on_numeric_keys():
+    state = DeviceState({"brightness": 100})
+
+    state["brightness"] = True
+    assert state["brightness"] is True
+    state["brightness"] = None
+    assert state["brightness"] is None and len(state) == 1
+    state["brightness"] = 50
+    assert state["brightness"] == 50 and len(state) == 1
+
+def test_keys_are_interned():
+    key = "".join(["child_", "lock"])
+    state = DeviceState({key: "LOCK"})
+
+    assert next(iter(state)) is KEY_TABLE.intern("child_lock")
+
+def test_devices_have_no_instance_dict():
+    light = LightDevice("0x01", "Lampa", "zigbee2mqtt/Lampa")
+    sensor = SensorDevice("0x02", "Czujnik", "zigbee2mqtt/Czujnik")
+
+    assert not hasattr(light, "__dict__") and not hasattr(sensor, "__dict__")
+    with pytest.raises(AttributeError):
+        light.extra = 1
+    light.update_state({"state": "ON", "brightness": 254})
+    assert dict(light.state) == {"state": "ON", "brightness": 254}
+
+def test_concurrent_reads_see_consistent_values():
+    """Czytelnicy nie dostają wartości innego klucza ani błędów, gdy zapis wstawia i usuwa atrybuty liczbowe."""
+    state = DeviceState({"brightness": 1, "power": 2.5, "voltage": 230})
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        value = 0
+        while(not stop.is_set()):
+            value += 1
+            state["color_temp"] = 1000 + value
+            state["temperature"] = 20.5
+            del state["color_temp"]
+            del state["temperature"]
+
+    def reader():
+        try:
+            for _ in range(20000):
+                assert state["voltage"] == 230
+                assert state["power"] == 2.5
+                for key, value in state.items():
+                    assert key != "voltage" or value == 230
+                for key in state:
+                    state.get(key)
+        except Exception as e:
+            errors.append(e)
+
+    writer_thread = threading.Thread(target=writer)
+    readers = [threading.Thread(target=reader) for _ in range(3)]
+    writer_thread.start()
+    for thread in readers:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    stop.set()
+    writer_thread.join()
+
+    assert errors == []
+
+def test_state_keeps_no_per_instance_lock():
+    state = DeviceState({"state": "ON"})
+    assert not hasattr(state, "__dict__")
+    assert "_lock" not in DeviceState.__slots__
+
+    # Stany dzielące blokadę z puli można zagnieżdżać w jednym wątku.
+    other = DeviceState({"brightness": 10})
+    state.update(other)
+    with state._lock:
+        with other._lock:
+            assert dict(state) == {"state": "ON", "brightness": 10}
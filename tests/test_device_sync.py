@@ -0,0 +1,96 @@
+import pytest
+from core.database import DatabaseManager
+from core.device_manager import DeviceManager
+from core.device_sync import DeviceSyncEngine
+from core.devices_types import LightDevice, SocketDevice, SensorDevice
+
+LIGHT_DEFINITION = {"vendor": "IKEA", "model": "LED1545G12", "exposes": [{"type": "light", "features": [{"name": "state"}, {"name": "brightness"}]}]}
+SENSOR_DEFINITION = {"vendor": "Xiaomi", "model": "WSDCGQ11LM", "exposes": [{"name": "temperature"}]}
+
+def bridge_devices(*entries):
+    return [{"type": "Coordinator", "ieee_address": "0x00"}] + [
+        {"type": "Router", "ieee_address": ieee, "friendly_name": name, "definition": definition}
+        for ieee, name, definition in entries
+    ]
+
+@pytest.fixture
+def db():
+    return DatabaseManager(db_path=":memory:")
+
+@pytest.fixture
+def manager(db):
+    return DeviceManager(db_manager=db)
+
+@pytest.fixture
+def sync(manager):
+    return DeviceSyncEngine(manager)
+
+def test_new_devices_are_created_with_detected_types(sync, manager, db):
+    result = sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION), ("0x02", "Czujnik", SENSOR_DEFINITION)))
+
+    assert result == {"added": 2, "updated": 0, "removed": 0, "skipped": 0}
+    assert isinstance(manager.get_device("0x01"), LightDevice)
+    assert isinstance(manager.get_device("0x02"), SensorDevice)
+    assert {d["id"] for d in db.get_all_devices_data()} == {"0x01", "0x02"}
+
+def test_unchanged_entries_are_skipped(sync):
+    payload = bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION))
+    sync.sync(payload)
+
+    assert sync.sync(payload) == {"added": 0, "updated": 0, "removed": 0, "skipped": 1}
+
+def test_rename_updates_only_changed_device(sync, manager, db):
+    sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION), ("0x02", "Czujnik", SENSOR_DEFINITION)))
+    result = sync.sync(bridge_devices(("0x01", "Salon", LIGHT_DEFINITION), ("0x02", "Czujnik", SENSOR_DEFINITION)))
+
+    assert result == {"added": 0, "updated": 1, "removed": 0, "skipped": 1}
+    assert manager.get_device_by_topic("zigbee2mqtt/Salon").device_id == "0x01"
+    assert next(d for d in db.get_all_devices_data() if d["id"] == "0x01")["name"] == "Salon"
+
+def test_vanished_zigbee_devices_are_removed_from_manager_and_groups(sync, manager, db):
+    manager.add_device(SocketDevice(device_id="manual", name="Ręczne", topic="custom/plug"))
+    sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION), ("0x02", "Czujnik", SENSOR_DEFINITION)))
+    manager.create_group("g", "G", ["0x01", "0x02"])
+
+    result = sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION)))
+
+    assert result["removed"] == 1
+    assert manager.get_device("0x02") is None
+    assert manager.get_device("manual") is not None
+    assert manager.groups["g"]["members"] == ["0x01"]
+    assert db.get_all_groups()[0]["members"] == ["0x01"]
+    assert {d["id"] for d in db.get_all_devices_data()} == {"0x01", "manual"}
+
+def test_partial_list_without_coordinator_does_not_remove(sync, manager):
+    sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION), ("0x02", "Czujnik", SENSOR_DEFINITION)))
+    sync.sync([{"type": "Router", "ieee_address": "0x01", "friendly_name": "Lampa", "definition": LIGHT_DEFINITION}])
+
+    assert manager.get_device("0x02") is not None
+
+def test_device_type_is_cached_per_model(sync, monkeypatch):
+    calls = []
+    import core.device_sync as device_sync
+    original = device_sync.determine_device_type
+    monkeypatch.setattr(device_sync, "determine_device_type", lambda d: calls.append(d) or original(d))
+    sync.sync(bridge_devices(("0x01", "L1", LIGHT_DEFINITION), ("0x02", "L2", LIGHT_DEFINITION), ("0x03", "L3", LIGHT_DEFINITION)))
+
+    assert len(calls) == 1
+
+def test_manually_added_device_with_ieee_id_survives_sync(sync, manager, db):
+    manager.add_device(SocketDevice(device_id="0x99", name="Ręczne", topic="custom/plug"))
+    sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION)))
+
+    result = sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION)))
+
+    assert result["removed"] == 0
+    assert manager.get_device("0x99") is not None
+    assert "0x99" in {d["id"] for d in db.get_all_devices_data()}
+
+def test_incomplete_list_does_not_forget_bridge_devices(sync, manager):
+    sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION), ("0x02", "Czujnik", SENSOR_DEFINITION)))
+    sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION), ("0x02", "Czujnik", SENSOR_DEFINITION))[1:2])
+
+    result = sync.sync(bridge_devices(("0x01", "Lampa", LIGHT_DEFINITION)))
+
+    assert result["removed"] == 1
+    assert manager.get_device("0x02") is None
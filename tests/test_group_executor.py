@@ -0,0 +1,104 @@
+import json
+import pytest
+from core.device_manager import DeviceManager
+from core.devices_types import LightDevice, SensorDevice, SocketDevice
+from core.database import DatabaseManager
+
+class FakeMQTT:
+    def __init__(self):
+        self.batches = []
+
+    def publish_many(self, messages):
+        self.batches.append(list(messages))
+        return len(messages)
+
+@pytest.fixture
+def manager():
+    """DeviceManager z bazą w pamięci RAM i grupą 'dom' (dwie lampy, gniazdko, czujnik)."""
+    manager = DeviceManager(db_manager=DatabaseManager(db_path=":memory:"))
+    manager.add_device(LightDevice(device_id="0x01", name="L1", topic="zigbee2mqtt/L1"))
+    manager.add_device(LightDevice(device_id="0x02", name="L2", topic="zigbee2mqtt/L2"))
+    manager.add_device(SocketDevice(device_id="0x03", name="S1", topic="zigbee2mqtt/S1"))
+    manager.add_device(SensorDevice(device_id="0x04", name="C1", topic="zigbee2mqtt/C1"))
+    manager.create_group("dom", "Dom", ["0x01", "0x02", "0x03", "0x04"])
+    yield manager
+
+def test_group_action_is_published_as_one_batch(manager):
+    mqtt = FakeMQTT()
+    assert manager.perform_action(mqtt, "dom", "turn_off") is True
+
+    assert len(mqtt.batches) == 1
+    topics = [topic for topic, _ in mqtt.batches[0]]
+    assert topics == ["zigbee2mqtt/L1/set", "zigbee2mqtt/L2/set", "zigbee2mqtt/S1/set"]
+    assert all(json.loads(payload) == {"state": "OFF"} for _, payload in mqtt.batches[0])
+
+def test_nested_groups_are_flattened_without_duplicates(manager):
+    manager.create_group("parter", "Parter", ["0x01", "dom"])
+    manager.create_group("cykl", "Cykl", ["parter"])
+    manager.add_device_to_group("dom", "cykl")
+    mqtt = FakeMQTT()
+    manager.perform_action(mqtt, "cykl", "turn_on")
+
+    topics = [topic for topic, _ in mqtt.batches[0]]
+    assert sorted(topics) == ["zigbee2mqtt/L1/set", "zigbee2mqtt/L2/set", "zigbee2mqtt/S1/set"]
+
+def test_native_group_is_synced_then_used(manager):
+    executor = manager.group_executor
+    executor.native_groups = True
+    manager.create_group("lampy", "Lampy", ["0x01", "0x02"])
+    mqtt = FakeMQTT()
+
+    manager.perform_action(mqtt, "lampy", "turn_on")
+    assert len(mqtt.batches[0]) == 2
+    sync = mqtt.batches[1]
+    assert sync[0] == ("zigbee2mqtt/bridge/request/group/add", json.dumps({"friendly_name": "smarthome_lampy"}))
+    assert [topic for topic, _ in sync[1:]] == ["zigbee2mqtt/bridge/request/group/members/add"] * 2
+
+    manager.perform_action(mqtt, "lampy", "turn_off")
+    assert mqtt.batches[2] == [("zigbee2mqtt/smarthome_lampy/set", json.dumps({"state": "OFF"}))]
+
+def test_native_group_state_follows_bridge_groups_and_errors(manager):
+    executor = manager.group_executor
+    executor.native_groups = True
+    manager.create_group("lampy", "Lampy", ["0x01", "0x02"])
+    executor.handle_bridge_groups([{"friendly_name": "smarthome_lampy", "members": [{"ieee_address": "0x01", "endpoint": 1}]}])
+    mqtt = FakeMQTT()
+
+    manager.perform_action(mqtt, "lampy", "turn_on")
+    assert len(mqtt.batches[0]) == 2
+    assert mqtt.batches[1] == [("zigbee2mqtt/bridge/request/group/members/add", json.dumps({"group": "smarthome_lampy", "device": "0x02"}))]
+
+    executor.handle_bridge_response("zigbee2mqtt/bridge/response/group/members/add",
+                                    {"status": "error", "data": {"group": "smarthome_lampy", "device": "0x02"}, "error": "x"})
+    manager.perform_action(mqtt, "lampy", "turn_on")
+    assert len(mqtt.batches[2]) == 2
+
+def test_group_command_supersedes_pending_device_command(manager):
+    """Ponowienie starszej komendy urządzenia nie może cofnąć nowszej akcji grupowej."""
+    clock = [1000.0]
+    manager.commands.clock = lambda: clock[0]
+    manager.commands._timers.clock = manager.commands.clock
+    mqtt = FakeMQTT()
+    mqtt.publish = lambda topic, payload: mqtt.batches.append([(topic, json.dumps(payload))])
+    first = manager.send_command(mqtt, manager.get_device("0x01"), "turn_on")
+
+    manager.perform_action(mqtt, "dom", "turn_off")
+    manager.update_device("zigbee2mqtt/L1", {"state": "OFF"})
+    published = len(mqtt.batches)
+    clock[0] += 10
+    manager.commands.run_due()
+
+    assert first.status == "superseded"
+    assert manager.commands.pending("0x01") is None
+    assert all(json.loads(payload) != {"state": "ON"} for batch in mqtt.batches[published:] for _, payload in batch)
+
+def test_native_group_command_is_tracked_per_member(manager):
+    executor = manager.group_executor
+    executor.native_groups = True
+    executor.handle_bridge_groups([{"friendly_name": "smarthome_lampy", "members": [{"ieee_address": "0x01"}, {"ieee_address": "0x02"}]}])
+    manager.create_group("lampy", "Lampy", ["0x01", "0x02"])
+
+    manager.perform_action(FakeMQTT(), "lampy", "turn_on")
+
+    assert manager.commands.pending("0x01").payload == {"state": "ON"}
+    assert manager.commands.pending("0x02").payload == {"state": "ON"}
@@ -0,0 +1,95 @@
+import pytest
+import time
+from core.database import DatabaseManager
+from core.history import HistoryManager
+
+@pytest.fixture
+def history():
+    """Tworzy HistoryManager na bazie w pamięci RAM dla każdego testu."""
+    db = DatabaseManager(db_path=":memory:")
+    yield HistoryManager(db_manager=db)
+
+BASE = 1_699_920_000  # północ UTC, wyrównana do wszystkich przedziałów agregatów
+
+def test_only_numeric_values_are_recorded(history):
+    history.record("plug", {"power": 12.5, "state": "ON", "child_lock": True, "linkquality": 80}, timestamp=BASE)
+    assert history.flush() == 1
+    assert history.get_keys("plug") == ["power"]
+
+def test_raw_range_query(history):
+    for n in range(10):
+        history.record("plug", {"power": n}, timestamp=BASE + n)
+    history.flush()
+
+    result = history.query("plug", "power", BASE + 2, BASE + 5, resolution="raw")
+    assert [p["value"] for p in result["points"]] == [2, 3, 4, 5]
+
+def test_rollups_aggregate_across_batches(history):
+    history.record("plug", {"power": 10}, timestamp=BASE)
+    history.flush()
+    history.record("plug", {"power": 30}, timestamp=BASE + 30)
+    history.record("plug", {"power": 20}, timestamp=BASE + 59)
+    history.flush()
+
+    point = history.query("plug", "power", BASE, BASE + 59, resolution="1m")["points"][0]
+    # Średnia ważona czasem: 10 przez 30 s, 30 przez 29 s.
+    assert point == {"ts": BASE - BASE % 60, "avg": pytest.approx(1170 / 59), "min": 10, "max": 30, "count": 3}
+
+def test_rollup_average_is_weighted_by_time_held(history):
+    history.record("plug", {"power": 100}, timestamp=BASE)
+    history.record("plug", {"power": 0}, timestamp=BASE + 3540)
+    history.record("plug", {"power": 0}, timestamp=BASE + 3599)
+    history.flush()
+
+    point = history.query("plug", "power", BASE, BASE + 3599, resolution="1h")["points"][0]
+    assert point["avg"] == pytest.approx(100 * 3540 / 3599)
+    assert point["count"] == 3
+
+def test_query_includes_buffered_readings_without_flushing(history):
+    history.record("plug", {"power": 1}, timestamp=BASE)
+    history.flush()
+    history.record("plug", {"power": 2}, timestamp=BASE + 1)
+
+    points = history.query("plug", "power", BASE, BASE + 10, resolution="raw")["points"]
+    assert [p["value"] for p in points] == [1, 2]
+    assert len(history._buffer) == 1
+    assert history.get_keys("plug") == ["power"]
+
+def test_series_survive_restart(history):
+    history.record("plug", {"power": 5}, timestamp=BASE)
+    history.flush()
+
+    restarted = HistoryManager(db_manager=history.db_manager)
+    assert restarted.get_keys("plug") == ["power"]
+    assert restarted.query("plug", "power", BASE, BASE + 1, resolution="raw")["points"] == [{"ts": BASE, "value": 5}]
+
+def test_resolution_is_chosen_by_range(history):
+    assert history.choose_resolution(BASE, BASE + 600) == "raw"
+    assert history.choose_resolution(BASE, BASE + 86400) == "1m"
+    assert history.choose_resolution(BASE, BASE + 7 * 86400) == "1h"
+
+def test_unknown_series_returns_none(history):
+    assert history.query("plug", "power", BASE, BASE + 60) is None
+
+def test_prune_removes_data_past_retention(history):
+    history.retention_days = {"raw": 1, "1m": None, "1h": None, "1d": None}
+    history.record("plug", {"power": 1}, timestamp=BASE)
+    history.record("plug", {"power": 2}, timestamp=BASE + 2 * 86400)
+    history.flush()
+
+    assert history.prune(now=BASE + 2 * 86400) == 1
+    points = history.query("plug", "power", BASE, BASE + 2 * 86400, resolution="raw")["points"]
+    assert [p["value"] for p in points] == [2]
+
+def test_week_of_1hz_data_queries_quickly(history):
+    for day in range(7):
+        for second in range(0, 86400, 1):
+            history.record("plug", {"power": second % 100}, timestamp=BASE + day * 86400 + second)
+        history.flush()
+
+    started = time.perf_counter()
+    result = history.query("plug", "power", BASE, BASE + 7 * 86400)
+    elapsed = time.perf_counter() - started
+    assert result["resolution"] == "1h"
+    assert len(result["points"]) == 168
+    assert elapsed < 0.1
@@ -0,0 +1,118 @@
+import logging
+import queue
+import threading
+from logging_config import RingBufferHandler, DeviceLogSampler, DroppingQueueHandler, tail_file
+
+def make_logger(handler, name="test.ring"):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.handlers = [handler]
+    return logger
+
+def test_ring_buffer_keeps_only_latest_entries():
+    handler = RingBufferHandler(capacity=3)
+    logger = make_logger(handler)
+    for n in range(5):
+        logger.info(f"linia {n}")
+
+    assert [entry[3] for entry in handler.get_entries(lines=10)] == ["linia 2", "linia 3", "linia 4"]
+    assert [entry[3] for entry in handler.get_entries(lines=2)] == ["linia 3", "linia 4"]
+
+def test_ring_buffer_filters_by_level_and_logger():
+    handler = RingBufferHandler(capacity=10)
+    make_logger(handler, "core.rule_engine").info("reguła")
+    make_logger(handler, "core.device_manager").warning("urządzenie")
+    make_logger(handler, "core.device_manager.sub").error("błąd")
+
+    assert [e[3] for e in handler.get_entries(level=logging.WARNING)] == ["urządzenie", "błąd"]
+    assert [e[3] for e in handler.get_entries(logger_name="core.device_manager")] == ["urządzenie", "błąd"]
+    assert [e[3] for e in handler.get_entries(logger_name="core.device")] == []
+
+def test_ring_buffer_returns_only_entries_newer_than_seq():
+    handler = RingBufferHandler(capacity=10)
+    logger = make_logger(handler)
+    logger.info("stara")
+    seq = handler.last_seq
+    logger.info("nowa")
+
+    assert [e[3] for e in handler.get_entries(since=seq)] == ["nowa"]
+
+def test_listener_that_logs_does_not_recurse():
+    handler = RingBufferHandler(capacity=10)
+    logger = make_logger(handler)
+    received = []
+    handler.add_listener(lambda event: (received.append(event["line"]), logger.info("z wnętrza słuchacza")))
+    logger.info("wpis")
+
+    assert received == ["wpis"]
+
+def test_tail_file_reads_last_lines_across_blocks(tmp_path):
+    path = tmp_path / "app.log"
+    path.write_text("".join(f"linia {n}\n" for n in range(1000)), encoding="utf-8")
+
+    assert tail_file(str(path), 3, block_size=16) == ["linia 997\n", "linia 998\n", "linia 999\n"]
+    assert len(tail_file(str(path), 5000)) == 1000
+
+def test_sampler_limits_device_records_and_reports_suppressed():
+    handler = RingBufferHandler(capacity=10)
+    handler.addFilter(DeviceLogSampler(interval=60))
+    logger = make_logger(handler, "test.sampler")
+    for n in range(3):
+        logger.info(f"odczyt {n}", extra={"device_id": "plug", "sampled": True})
+    logger.info("inne urządzenie", extra={"device_id": "lamp", "sampled": True})
+    logger.warning("ostrzeżenie", extra={"device_id": "plug", "sampled": True})
+    logger.info("bez urządzenia")
+
+    assert [e[3] for e in handler.get_entries()] == ["odczyt 0", "inne urządzenie", "ostrzeżenie", "bez urządzenia"]
+
+    sampler = handler.filters[0]
+    sampler._last.clear()
+    logger.info("odczyt 3", extra={"device_id": "plug", "sampled": True})
+    assert handler.get_entries(lines=1)[0][3] == "odczyt 3 (pominięto 2 podobnych wpisów)"
+
+def test_sampler_passes_unmarked_device_records():
+    handler = RingBufferHandler(capacity=10)
+    handler.addFilter(DeviceLogSampler(interval=60))
+    logger = make_logger(handler, "test.sampler.unmarked")
+    logger.debug("odczyt", extra={"device_id": "plug", "sampled": True})
+    for n in range(2):
+        logger.info(f"komenda {n}", extra={"device_id": "plug"})
+
+    assert [e[3] for e in handler.get_entries()] == ["odczyt", "komenda 0", "komenda 1"]
+
+def test_sampler_counts_every_record_from_concurrent_threads():
+    sampler = DeviceLogSampler(interval=60)
+    threads_count, per_thread = 8, 2000
+    passed = []
+    barrier = threading.Barrier(threads_count)
+
+    def worker():
+        barrier.wait()
+        for _ in range(per_thread):
+            record = logging.makeLogRecord({"name": "test.sampler.threads", "levelno": logging.INFO, "msg": "odczyt",
+                                            "device_id": "plug", "sampled": True})
+            if(sampler.filter(record)):
+                passed.append(record)
+
+    threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(passed) == 1
+    sampler._last.clear()
+    record = logging.makeLogRecord({"name": "test.sampler.threads", "levelno": logging.INFO, "msg": "odczyt",
+                                    "device_id": "plug", "sampled": True})
+    assert sampler.filter(record)
+    assert record.getMessage() == f"odczyt (pominięto {threads_count * per_thread - 1} podobnych wpisów)"
+
+def test_queue_handler_drops_instead_of_blocking_when_full():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+    logger = make_logger(handler, "test.queue")
+    for n in range(5):
+        logger.info(f"wpis {n}")
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import pytest
+from core.message_pipeline import MessagePipeline, UpdateCoalescer
+
+def test_per_key_ordering_is_preserved_across_workers():
+    received = {}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def handler(topic, payload):
+        with lock:
+            received.setdefault(topic, []).append(payload["n"])
+            if(sum(len(v) for v in received.values()) == 400):
+                done.set()
+
+    pipeline = MessagePipeline(handler=handler, workers=4, queue_size=4000)
+    pipeline.start()
+    for n in range(100):
+        for topic in ("z/a", "z/b", "z/c", "z/d"):
+            pipeline.submit(topic, {"n": n})
+    assert done.wait(timeout=5)
+    pipeline.stop()
+
+    assert all(values == list(range(100)) for values in received.values())
+    assert pipeline.get_metrics()["processed"] == 400
+
+def test_router_resolves_topic_once_and_passes_context_to_handler():
+    lookups = []
+    received = []
+    done = threading.Event()
+
+    def router(topic):
+        lookups.append(topic)
+        device_id = topic.split("/")[1]
+        return device_id, {"device_id": device_id}
+
+    def handler(topic, payload, device):
+        received.append((topic, device["device_id"]))
+        if(len(received) == 2):
+            done.set()
+
+    pipeline = MessagePipeline(handler=handler, router=router, workers=2, queue_size=10)
+    pipeline.start()
+    pipeline.submit("z/a", {"n": 1})
+    pipeline.submit("z/a/availability", "online")
+    assert done.wait(timeout=5)
+    pipeline.stop()
+
+    assert lookups == ["z/a", "z/a/availability"]
+    assert received == [("z/a", "a"), ("z/a/availability", "a")]
+
+def test_drop_oldest_policy_bounds_the_queue():
+    pipeline = MessagePipeline(handler=lambda t, p: None, workers=1, queue_size=3, overflow_policy="drop_oldest")
+    for n in range(5):
+        pipeline.submit("z/a", {"n": n})
+
+    metrics = pipeline.get_metrics()
+    assert metrics["queue_depth"] == 3
+    assert metrics["dropped"] == 2
+    assert [entry[1]["n"] for entry in pipeline._shards[0].queue] == [2, 3, 4]
+
+def test_coalesce_policy_merges_pending_payload_of_same_topic():
+    pipeline = MessagePipeline(handler=lambda t, p: None, workers=1, queue_size=2, overflow_policy="coalesce")
+    pipeline.submit("z/a", {"power": 1})
+    pipeline.submit("z/b", {"power": 5})
+    pipeline.submit("z/a", {"power": 2, "voltage": 230})
+
+    metrics = pipeline.get_metrics()
+    assert metrics["coalesced"] == 1
+    assert metrics["dropped"] == 0
+    assert list(pipeline._shards[0].queue)[0][:2] == ["z/a", {"power": 2, "voltage": 230}]
+
+def test_unknown_overflow_policy_is_rejected():
+    with pytest.raises(ValueError):
+        MessagePipeline(handler=lambda t, p: None, overflow_policy="block")
+
+# --- Testy scalania aktualizacji ---
+
+class FakeDevice:
+    def __init__(self, device_id):
+        self.device_id = device_id
+
+def test_coalescer_merges_updates_within_window():
+    processed = []
+    coalescer = UpdateCoalescer(handler=lambda d, t, p: processed.append(p), windows={"plug": 60})
+    device = FakeDevice("plug")
+
+    assert coalescer.submit(device, "z/plug", {"power": 10}) is True
+    assert coalescer.submit(device, "z/plug", {"power": 12, "voltage": 230}) is True
+    assert processed == []
+
+    coalescer.flush()
+    assert processed == [{"power": 12, "voltage": 230}]
+
+def test_coalescer_flushes_pending_state_on_rule_transition():
+    processed = []
+    crosses_threshold = lambda device_id, previous, current: (previous["power"] > 100) != (current["power"] > 100)
+    coalescer = UpdateCoalescer(handler=lambda d, t, p: processed.append(p), windows={"plug": 60}, transition_check=crosses_threshold)
+    device = FakeDevice("plug")
+
+    coalescer.submit(device, "z/plug", {"power": 10})
+    coalescer.submit(device, "z/plug", {"power": 20})
+    coalescer.submit(device, "z/plug", {"power": 150})
+    assert processed == [{"power": 20}]
+
+    coalescer.flush()
+    assert processed == [{"power": 20}, {"power": 150}]
+
+def test_coalescer_without_window_passes_message_through():
+    coalescer = UpdateCoalescer(handler=lambda d, t, p: None, windows={})
+    assert coalescer.submit(FakeDevice("x"), "z/x", {"a": 1}) is False
+
+def test_coalescer_timer_flushes_after_window():
+    done = threading.Event()
+    coalescer = UpdateCoalescer(handler=lambda d, t, p: done.set(), windows={"plug": 0.05})
+    coalescer.start()
+    coalescer.submit(FakeDevice("plug"), "z/plug", {"power": 1})
+    assert done.wait(timeout=2)
+    coalescer.stop()
+
+def test_slow_flush_does_not_block_other_topics():
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(device, topic, payload):
+        if(topic == "z/slow"):
+            started.set()
+            release.wait(timeout=5)
+
+    coalescer = UpdateCoalescer(handler=handler, windows={"slow": 0.01, "plug": 60})
+    coalescer.start()
+    try:
+        coalescer.submit(FakeDevice("slow"), "z/slow", {"power": 1})
+        assert started.wait(timeout=5)
+        submitted = threading.Event()
+        threading.Thread(target=lambda: (coalescer.submit(FakeDevice("plug"), "z/plug", {"power": 2}), submitted.set())).start()
+        assert submitted.wait(timeout=1)
+    finally:
+        release.set()
+        coalescer.stop()
+
+def test_non_dict_payload_is_handled_after_pending_state():
+    processed = []
+    coalescer = UpdateCoalescer(handler=lambda d, t, p: processed.append(p), windows={"plug": 60})
+    device = FakeDevice("plug")
+
+    coalescer.submit(device, "z/plug", {"state": "ON"})
+    assert coalescer.submit(device, "z/plug", "offline") is False
+
+    assert processed == [{"state": "ON"}]
+
+def test_coalescer_runs_handler_on_the_event_loop_in_async_mode():
+    handled = []
+
+    async def scenario():
+        loop_thread = threading.get_ident()
+        coalescer = UpdateCoalescer(handler=lambda d, t, p: handled.append((threading.get_ident() == loop_thread, p)), windows={"plug": 0.05})
+        task = asyncio.create_task(coalescer.run_async())
+        await asyncio.sleep(0)
+        coalescer.submit(FakeDevice("plug"), "z/plug", {"power": 1})
+        for _ in range(100):
+            if(handled):
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert coalescer._thread is None
+
+    asyncio.run(scenario())
+    assert handled == [(True, {"power": 1})]
@@ -1,5 +1,11 @@
 import pytest
+import threading
+import time
+import config
+from datetime import datetime
 from core.rule_engine import RulesEngine
+from core.time_scheduler import TimeScheduler
+from core.timer_wheel import TimerWheel
 from core.devices_types import SensorDevice
 from core.database import DatabaseManager
 
@@ -85,4 +91,419 @@ def test_rule_evaluation_for_nonexistent_device_or_key(clean_engine):
     try:
         engine.evaluate_state_change_rules(device_id="ghost")
     except Exception as e:
-        pytest.fail(f"Silnik reguł zgłosił nieoczekiwany wyjątek: {e}")
\ No newline at end of file
+        pytest.fail(f"Silnik reguł zgłosił nieoczekiwany wyjątek: {e}")
+def test_rule_index_tracks_add_and_remove(clean_engine):
+    engine = clean_engine
+    action = {"device_id": "d2", "command": "c"}
+    engine.add_rule({"id": "r_state", "name": "S", "trigger": {"device_id": "d1", "key": "k", "operator": "eq", "value": 1}, "action": action})
+    engine.add_rule({"id": "r_time", "name": "T", "trigger": {"type": "time", "time": "07:00"}, "action": action})
+    engine.add_rule({"id": "r_off", "name": "O", "active": False, "trigger": {"device_id": "d1", "key": "k", "operator": "eq", "value": 1}, "action": action})
+
+    assert [r.rule_id for r in engine._rules_by_device["d1"]] == ["r_state"]
+    assert [r.rule_id for r in engine._time_rules] == ["r_time"]
+
+    assert [r.rule_id for r in engine._rules_by_key[("d1", "k")]] == ["r_state"]
+
+    engine.remove_rule("r_state")
+    assert "d1" not in engine._rules_by_device
+    assert ("d1", "k") not in engine._rules_by_key
+
+def test_only_rules_for_changed_keys_are_evaluated(clean_engine):
+    engine = clean_engine
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    sensor.update_state({"occupancy": True, "battery": 80})
+    engine.device_manager.devices["d1"] = sensor
+    engine.add_rule({
+        "id": "r1", "name": "N",
+        "trigger": {"device_id": "d1", "key": "occupancy", "operator": "eq", "value": True},
+        "action": {"device_id": "lamp", "command": "turn_on"}
+    })
+
+    engine.evaluate_state_change_rules("d1", changed_keys=["battery", "illuminance"])
+    assert engine.device_manager.action_performed is None
+
+    engine.evaluate_state_change_rules("d1", changed_keys=["battery", "occupancy"])
+    assert engine.device_manager.action_performed["device_id"] == "lamp"
+
+@pytest.mark.parametrize("trigger", [
+    {"device_id": "d1", "key": "k", "operator": "between", "value": 1},
+    {"device_id": "d1", "key": "k", "operator": "gt", "value": "dużo"},
+    {"device_id": "d1", "operator": "eq", "value": 1},
+    {"type": "time", "time": "25:99"},
+])
+def test_malformed_rules_are_rejected_on_add(clean_engine, trigger):
+    rule = {"id": "bad", "name": "N", "trigger": trigger, "action": {"device_id": "d2", "command": "c"}}
+    assert clean_engine.add_rule(rule) is False
+    assert clean_engine.get_rules() == []
+
+def test_numeric_rule_value_is_coerced_once(clean_engine):
+    engine = clean_engine
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    sensor.update_state({"temp": 25})
+    engine.device_manager.devices["d1"] = sensor
+    engine.add_rule({
+        "id": "r1", "name": "N",
+        "trigger": {"device_id": "d1", "key": "temp", "operator": "gt", "value": "20"},
+        "action": {"device_id": "ac", "command": "on"}
+    })
+
+    engine.evaluate_state_change_rules(device_id="d1")
+    assert engine.device_manager.action_performed is not None
+
+def test_active_rule_does_not_refire_while_condition_holds(clean_engine):
+    engine = clean_engine
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    engine.device_manager.devices["d1"] = sensor
+    engine.add_rule({
+        "id": "r1", "name": "N",
+        "trigger": {"device_id": "d1", "key": "temp", "operator": "gt", "value": 20},
+        "action": {"device_id": "ac", "command": "on"}
+    })
+
+    sensor.update_state({"temp": 25})
+    engine.evaluate_state_change_rules(device_id="d1")
+    engine.device_manager.action_performed = None
+    sensor.update_state({"temp": 26})
+    engine.evaluate_state_change_rules(device_id="d1")
+
+    assert engine.device_manager.action_performed is None
+    assert engine.rule_states["r1"]["is_active"] is True
+
+# --- Testy harmonogramu reguł czasowych ---
+
+def test_scheduler_fires_exactly_at_target_minute_and_reschedules():
+    scheduler = TimeScheduler(grace_seconds=60)
+    scheduler.schedule("r1", "07:00", now=datetime(2025, 1, 1, 6, 59, 30))
+
+    assert scheduler.seconds_until_next(now=datetime(2025, 1, 1, 6, 59, 30)) == 30
+    assert scheduler.pop_due(now=datetime(2025, 1, 1, 6, 59, 59)) == []
+    assert scheduler.pop_due(now=datetime(2025, 1, 1, 7, 0, 0)) == ["r1"]
+    assert scheduler.seconds_until_next(now=datetime(2025, 1, 1, 7, 0, 0)) == 24 * 3600
+
+def test_scheduler_skips_stale_fire_after_clock_jump_and_honours_unschedule():
+    scheduler = TimeScheduler(grace_seconds=60)
+    scheduler.schedule("late", "07:00", now=datetime(2025, 1, 1, 6, 0))
+    scheduler.schedule("gone", "06:30", now=datetime(2025, 1, 1, 6, 0))
+    scheduler.unschedule("gone")
+
+    assert scheduler.pop_due(now=datetime(2025, 1, 1, 12, 0)) == []
+    assert scheduler.seconds_until_next(now=datetime(2025, 1, 1, 12, 0)) == 19 * 3600
+
+def test_due_time_rule_triggers_action(clean_engine):
+    engine = clean_engine
+    engine.add_rule({
+        "id": "morning", "name": "Poranek",
+        "trigger": {"type": "time", "time": "07:00"},
+        "action": {"device_id": "lamp", "command": "turn_on"}
+    })
+    engine._scheduler.schedule("morning", "07:00", now=datetime(2025, 1, 1, 6, 0))
+
+    engine.run_due_time_rules(now=datetime(2025, 1, 1, 7, 0, 0, 5000))
+    assert engine.device_manager.action_performed == {"device_id": "lamp", "action": "turn_on", "value": None}
+
+def test_is_transition_detects_condition_flip(clean_engine):
+    engine = clean_engine
+    engine.add_rule({
+        "id": "r1", "name": "N",
+        "trigger": {"device_id": "plug", "key": "power", "operator": "gt", "value": 100},
+        "action": {"device_id": "ac", "command": "on"}
+    })
+
+    assert engine.is_transition("plug", {"power": 10}, {"power": 20}) is False
+    assert engine.is_transition("plug", {"power": 10}, {"power": 150}) is True
+    assert engine.is_transition("plug", {"voltage": 10}, {"voltage": 150}) is False
+
+# --- Reguły złożone (sieć warunków) ---
+
+def compound_rule(rule_id, condition, target="lamp"):
+    return {"id": rule_id, "name": rule_id, "trigger": {"type": "compound", **condition},
+            "action": {"device_id": target, "command": "turn_on"}}
+
+def test_compound_rule_fires_on_transition(clean_engine):
+    engine = clean_engine
+    motion = SensorDevice(device_id="motion", name="M", topic="T1")
+    motion.update_state({"occupancy": False, "illuminance": 5})
+    engine.device_manager.devices["motion"] = motion
+    assert engine.add_rule(compound_rule("r1", {"all": [
+        {"device_id": "motion", "key": "occupancy", "operator": "eq", "value": True},
+        {"any": [
+            {"device_id": "motion", "key": "illuminance", "operator": "lt", "value": 10},
+            {"time_window": {"from": "22:00", "to": "06:00"}},
+        ]},
+    ]}))
+
+    motion.update_state({"illuminance": 3})
+    engine.evaluate_state_change_rules("motion", ["illuminance"])
+    assert engine.device_manager.action_performed is None
+
+    motion.update_state({"occupancy": True})
+    engine.evaluate_state_change_rules("motion", ["occupancy"])
+    assert engine.device_manager.action_performed["device_id"] == "lamp"
+    assert engine.rule_states["r1"]["is_active"] is True
+
+    motion.update_state({"occupancy": False})
+    engine.evaluate_state_change_rules("motion", ["occupancy"])
+    assert engine.rule_states["r1"]["is_active"] is False
+
+def test_shared_conditions_are_evaluated_once(clean_engine):
+    engine = clean_engine
+    motion = SensorDevice(device_id="motion", name="M", topic="T1")
+    engine.device_manager.devices["motion"] = motion
+    occupied = {"device_id": "motion", "key": "occupancy", "operator": "eq", "value": True}
+    for n in range(50):
+        engine.add_rule(compound_rule(f"r{n}", {"all": [occupied, {"device_id": f"door{n}", "key": "contact", "operator": "eq", "value": False}]}))
+    network = engine._network
+    nodes = len(network)
+
+    engine.add_rule(compound_rule("r_last", {"all": [occupied, {"device_id": "door0", "key": "contact", "operator": "eq", "value": False}]}))
+    assert len(network) == nodes
+
+    network.evaluations = 0
+    motion.update_state({"occupancy": True})
+    engine.evaluate_state_change_rules("motion", ["occupancy"])
+    assert network.evaluations == 1
+
+    engine.remove_rule("r0")
+    assert len(network) == nodes
+    engine.remove_rule("r_last")
+    assert len(network) == nodes - 2
+
+def test_compound_rule_reacts_to_time_window(clean_engine):
+    engine = clean_engine
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    sensor.update_state({"contact": False})
+    engine.device_manager.devices["d1"] = sensor
+    engine._network.clock = lambda: datetime(2024, 1, 1, 12, 0)
+    engine.add_rule(compound_rule("r1", {"all": [
+        {"device_id": "d1", "key": "contact", "operator": "eq", "value": False},
+        {"time_window": {"from": "22:00", "to": "06:00"}},
+    ]}))
+
+    engine.run_due_time_rules(datetime(2024, 1, 1, 21, 59))
+    assert engine.device_manager.action_performed is None
+    engine.run_due_time_rules(datetime(2024, 1, 1, 22, 0))
+    assert engine.device_manager.action_performed is not None
+
+def test_compound_rules_are_not_in_device_indexes(clean_engine):
+    engine = clean_engine
+    engine.add_rule(compound_rule("r1", {"all": [
+        {"device_id": "d1", "key": "contact", "operator": "eq", "value": False},
+    ]}))
+    assert None not in engine._rules_by_device
+    assert (None, None) not in engine._rules_by_key
+    assert engine.rules_for_change("d1", ["contact"]) == ()
+
+def test_removing_compound_rule_unschedules_its_window_boundaries(clean_engine):
+    engine = clean_engine
+    engine.add_rule(compound_rule("r1", {"all": [
+        {"device_id": "d1", "key": "contact", "operator": "eq", "value": False},
+        {"time_window": {"from": "22:00", "to": "06:00"}},
+    ]}))
+    assert any(key[1] == "22:00" for key in engine._scheduler._entries if(isinstance(key, tuple)))
+
+    engine.remove_rule("r1")
+    assert not any(isinstance(key, tuple) for key in engine._scheduler._entries)
+
+@pytest.mark.parametrize("trigger", [
+    {"type": "compound"},
+    {"type": "compound", "all": []},
+    {"type": "compound", "all": [{"device_id": "d1", "key": "k", "operator": "eq", "value": 1}], "any": []},
+    {"type": "compound", "any": [{"time_window": {"from": "22:00", "to": "22:00"}}]},
+    {"type": "compound", "any": [{"device_id": "d1", "operator": "eq", "value": 1}]},
+])
+def test_malformed_compound_rules_are_rejected(clean_engine, trigger):
+    rule = {"id": "bad", "name": "N", "trigger": trigger, "action": {"device_id": "d2", "command": "c"}}
+    assert clean_engine.add_rule(rule) is False
+
+# --- Debounce, histereza i minimalny odstęp akcji ---
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def engine_with_clock(engine):
+    clock = FakeClock()
+    engine._timers = TimerWheel(tick=0.25, slots=64, clock=clock)
+    return clock
+
+def temperature_rule(**options):
+    rule = {"id": "heat", "name": "N", "trigger": {"device_id": "d1", "key": "temp", "operator": "gt", "value": 25},
+            "action": {"device_id": "fan", "command": "turn_on"}}
+    rule.update(options)
+    return rule
+
+def report(engine, sensor, value):
+    sensor.update_state({"temp": value})
+    engine.evaluate_state_change_rules("d1", ["temp"])
+
+def test_debounce_requires_condition_to_hold(clean_engine):
+    engine = clean_engine
+    clock = engine_with_clock(engine)
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    engine.device_manager.devices["d1"] = sensor
+    engine.add_rule(temperature_rule(debounce=10))
+
+    report(engine, sensor, 26)
+    clock.now += 5
+    report(engine, sensor, 24)
+    clock.now += 10
+    engine.run_due_timers()
+    assert engine.device_manager.action_performed is None
+
+    report(engine, sensor, 27)
+    clock.now += 10.5
+    engine.run_due_timers()
+    assert engine.device_manager.action_performed["device_id"] == "fan"
+
+def test_hysteresis_prevents_flapping(clean_engine):
+    engine = clean_engine
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    engine.device_manager.devices["d1"] = sensor
+    engine.add_rule(temperature_rule(trigger={"device_id": "d1", "key": "temp", "operator": "gt", "value": 25, "hysteresis": 1}))
+
+    report(engine, sensor, 25.5)
+    assert engine.rule_states["heat"]["is_active"] is True
+    engine.device_manager.action_performed = None
+
+    report(engine, sensor, 24.5)
+    report(engine, sensor, 25.5)
+    assert engine.rule_states["heat"]["is_active"] is True
+    assert engine.device_manager.action_performed is None
+
+    report(engine, sensor, 23.9)
+    assert engine.rule_states["heat"]["is_active"] is False
+
+def test_min_interval_defers_repeated_actions(clean_engine):
+    engine = clean_engine
+    clock = engine_with_clock(engine)
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    engine.device_manager.devices["d1"] = sensor
+    engine.add_rule(temperature_rule(min_interval=60))
+
+    report(engine, sensor, 26)
+    assert engine.device_manager.action_performed is not None
+    engine.device_manager.action_performed = None
+
+    report(engine, sensor, 24)
+    report(engine, sensor, 26)
+    assert engine.device_manager.action_performed is None
+    assert engine._timers.pending("heat")
+
+    engine.rule_states["heat"]["last_triggered"] = datetime(2000, 1, 1)
+    clock.now += 61
+    engine.run_due_timers()
+    assert engine.device_manager.action_performed is not None
+
+def test_rule_options_are_validated(clean_engine):
+    assert clean_engine.add_rule(temperature_rule(debounce=-1)) is False
+    assert clean_engine.add_rule(temperature_rule(trigger={"device_id": "d1", "key": "s", "operator": "eq", "value": "ON", "hysteresis": 1})) is False
+
+# --- Trwałość stanu reguł ---
+
+def test_rule_state_survives_restart(tmp_path):
+    """Po restarcie aktywna reguła nie jest wyzwalana ponownie, a czas ostatniego wyzwolenia jest zachowany."""
+    path = str(tmp_path / "rules.db")
+    engine = RulesEngine(db_manager=DatabaseManager(db_path=path))
+    engine.setup(FakeDeviceManager(), FakeMqttClient())
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    engine.device_manager.devices["d1"] = sensor
+    engine.add_rule({
+        "id": "r1", "name": "N",
+        "trigger": {"device_id": "d1", "key": "temp", "operator": "gt", "value": 20},
+        "action": {"device_id": "ac", "command": "on"}
+    })
+    sensor.update_state({"temp": 25})
+    engine.evaluate_state_change_rules(device_id="d1")
+    triggered_at = engine.rule_states["r1"]["last_triggered"]
+
+    assert engine.flush_rule_states() == 1
+    assert engine.flush_rule_states() == 0
+    engine.db_manager.close()
+
+    restarted = RulesEngine(db_manager=DatabaseManager(db_path=path))
+    restarted.setup(FakeDeviceManager(), FakeMqttClient())
+    restarted.device_manager.devices["d1"] = sensor
+    restarted.load_from_db()
+    restarted.evaluate_state_change_rules(device_id="d1")
+
+    assert restarted.device_manager.action_performed is None
+    assert restarted.rule_states["r1"] == {"last_triggered": triggered_at, "is_active": True}
+    restarted.db_manager.close()
+
+def test_removed_rule_drops_persisted_state(clean_engine):
+    engine = clean_engine
+    engine.add_rule({
+        "id": "r1", "name": "N",
+        "trigger": {"device_id": "d1", "key": "temp", "operator": "gt", "value": 20},
+        "action": {"device_id": "ac", "command": "on"}
+    })
+    engine.db_manager.save_rule_states([("r1", 1700000000.0, True)])
+
+    assert engine.remove_rule("r1") is True
+    assert engine.db_manager.get_rule_states() == {}
+
+# --- Wykonywanie akcji ---
+
+def test_duplicate_actions_from_one_state_change_are_sent_once(clean_engine):
+    engine = clean_engine
+    performed = []
+    engine.device_manager.perform_action = lambda mqtt_client, device_id, action, value: performed.append((device_id, action))
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    engine.device_manager.devices["d1"] = sensor
+    for rule_id, key in (("r1", "temp"), ("r2", "humidity")):
+        engine.add_rule({
+            "id": rule_id, "name": "N",
+            "trigger": {"device_id": "d1", "key": key, "operator": "gt", "value": 20},
+            "action": {"device_id": "fan", "command": "on"}
+        })
+
+    sensor.update_state({"temp": 25, "humidity": 60})
+    engine.evaluate_state_change_rules(device_id="d1", changed_keys=["temp", "humidity"])
+
+    assert performed == [("fan", "on")]
+    assert engine.rule_states["r1"]["is_active"] and engine.rule_states["r2"]["is_active"]
+    assert engine.actions.get_metrics()["deduplicated"] == 1
+
+def test_concurrent_reports_trigger_rule_once(clean_engine):
+    """Wątki MQTT zgłaszające jednocześnie spełniony warunek nie wyzwalają reguły wielokrotnie."""
+    engine = clean_engine
+    performed = []
+    engine.device_manager.perform_action = lambda mqtt_client, device_id, action, value: performed.append(device_id)
+    engine.add_rule(temperature_rule(min_interval=60))
+    compiled = engine._compiled["heat"]
+    barrier = threading.Barrier(8)
+
+    def worker():
+        barrier.wait()
+        engine._apply_condition(compiled, True)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert performed == ["fan"]
+    assert not engine._timers.pending("heat")
+
+def test_triggered_state_is_flushed_within_configured_interval(clean_engine, monkeypatch):
+    """Pierwszy niezapisany stan budzi pętlę reguł, więc zapis nie czeka na TIME_CHECK_INTERVAL_SECONDS."""
+    monkeypatch.setattr(config, "RULE_STATE_FLUSH_INTERVAL_SECONDS", 0.3)
+    monkeypatch.setattr(config, "TIME_CHECK_INTERVAL_SECONDS", 60)
+    engine = clean_engine
+    sensor = SensorDevice(device_id="d1", name="N", topic="T")
+    engine.device_manager.devices["d1"] = sensor
+    engine.add_rule(temperature_rule())
+    engine.start_time_loop()
+    try:
+        time.sleep(0.1)
+        report(engine, sensor, 26)
+        deadline = time.monotonic() + 1.0
+        while(not engine.db_manager.get_rule_states() and time.monotonic() < deadline):
+            time.sleep(0.02)
+        assert "heat" in engine.db_manager.get_rule_states()
+    finally:
+        engine.stop_time_loop()
@@ -0,0 +1,50 @@
+from core.timer_wheel import TimerWheel
+
+def test_timers_expire_in_order_of_ticks():
+    wheel = TimerWheel(tick=1, slots=8, clock=lambda: 0.0)
+    fired = []
+    wheel.schedule("a", 2, lambda: fired.append("a"), now=0.0)
+    wheel.schedule("b", 5, lambda: fired.append("b"), now=0.0)
+
+    assert wheel.advance(2.5) == []
+    for _, callback in wheel.advance(3.0):
+        callback()
+    assert fired == ["a"]
+    assert wheel.seconds_until_next(3.0) == 3.0
+    assert [key for key, _ in wheel.advance(6.0)] == ["b"]
+    assert len(wheel) == 0
+
+def test_delays_longer_than_one_rotation():
+    wheel = TimerWheel(tick=1, slots=4, clock=lambda: 0.0)
+    wheel.schedule("long", 10, lambda: None, now=0.0)
+
+    assert wheel.advance(5.0) == []
+    assert wheel.advance(10.0) == []
+    assert [key for key, _ in wheel.advance(11.0)] == ["long"]
+
+def test_reschedule_and_cancel():
+    wheel = TimerWheel(tick=1, slots=8, clock=lambda: 0.0)
+    wheel.schedule("a", 1, lambda: None, now=0.0)
+    wheel.schedule("a", 4, lambda: None, now=0.0)
+    wheel.schedule("b", 1, lambda: None, now=0.0)
+
+    assert wheel.pending("a") and len(wheel) == 2
+    assert wheel.cancel("b") is True
+    assert wheel.cancel("b") is False
+    assert wheel.advance(3.0) == []
+    assert [key for key, _ in wheel.advance(5.0)] == ["a"]
+
+def test_next_deadline_skips_cancelled_and_rescheduled_timers():
+    wheel = TimerWheel(tick=1, slots=8, clock=lambda: 0.0)
+    for n in range(200):
+        wheel.schedule(n, 100 + n, lambda: None, now=0.0)
+    wheel.schedule("soon", 2, lambda: None, now=0.0)
+    assert wheel.seconds_until_next(0.0) == 3.0
+
+    wheel.schedule("soon", 50, lambda: None, now=0.0)
+    assert wheel.seconds_until_next(0.0) == 51.0
+    wheel.cancel("soon")
+    assert wheel.seconds_until_next(0.0) == 101.0
+    for n in range(200):
+        wheel.cancel(n)
+    assert wheel.seconds_until_next(0.0) is None